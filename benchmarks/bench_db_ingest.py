@@ -0,0 +1,145 @@
+"""
+Ingest benchmark: the original per-row write path vs batched upsert_many.
+
+Each run writes into a fresh temporary database. The per-row baseline is
+the write path from before batching, reproduced here: a new connection
+per message with default pragmas (synchronous=FULL, so every commit is
+fsynced even in WAL mode), INSERT OR REPLACE into the original emails
+table with bodies inline, one commit per message. It is capped by
+--per-row-limit and extrapolated above that. upsert_many runs on the
+current schema and DatabaseManager's pooled connections (WAL with
+synchronous=NORMAL, which only fsyncs at checkpoints).
+
+Usage:
+    python -m benchmarks.bench_db_ingest --sizes 10000,100000 --batch-size 1000
+"""
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import time
+
+from src.database import DatabaseManager
+
+
+def make_emails(n):
+    for i in range(n):
+        yield {
+            'id': f"msg{i:08d}",
+            'threadId': f"thread{i // 3:08d}",
+            'historyId': str(1000 + i),
+            'date': f"2025-01-{1 + i % 28:02d}T10:{i % 60:02d}:00+00:00",
+            'sender': "Me <me@example.com>",
+            'to': [f"recruiter{i % 50}@example.org"],
+            'cc': [],
+            'bcc': [],
+            'subject': f"Application #{i} for Software Engineering Intern",
+            'body_text': "Hi,\n\nFollowing up on my application. " * 20,
+            'body_html': "<p>Following up on my application.</p>" * 20,
+            'attachments': [],
+            'snippet': "Hi, Following up on my application.",
+            'is_job_related': i % 2,
+        }
+
+
+# Schema and write path of the original DatabaseManager
+BASELINE_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS emails (
+        id TEXT PRIMARY KEY, thread_id TEXT, date DATETIME, sender TEXT,
+        recipients_to TEXT, recipients_cc TEXT, recipients_bcc TEXT,
+        subject TEXT, body_text TEXT, body_html TEXT, attachments TEXT, snippet TEXT,
+        is_job_related BOOLEAN DEFAULT 0, last_synced TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_thread_id ON emails(thread_id)',
+    '''
+    CREATE TABLE IF NOT EXISTS message_sync_state (
+        id TEXT PRIMARY KEY, history_id TEXT, status TEXT DEFAULT 'synced',
+        synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+]
+
+
+def baseline_init(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    for statement in BASELINE_SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    conn.close()
+
+
+def baseline_upsert_email(db_path, email_data):
+    conn = sqlite3.connect(db_path)
+    to_json = lambda obj: json.dumps(obj) if obj is not None else '[]'
+    try:
+        conn.execute('''
+            INSERT OR REPLACE INTO emails (
+                id, thread_id, date, sender, recipients_to, recipients_cc, recipients_bcc,
+                subject, body_text, body_html, attachments, snippet, is_job_related
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            email_data.get('id'), email_data.get('threadId'), email_data.get('date'), email_data.get('sender'),
+            to_json(email_data.get('to', [])), to_json(email_data.get('cc', [])), to_json(email_data.get('bcc', [])),
+            email_data.get('subject'), email_data.get('body_text', ''), email_data.get('body_html', ''),
+            to_json(email_data.get('attachments', [])), email_data.get('snippet', ''), email_data.get('is_job_related', 0),
+        ))
+        conn.execute('''
+            INSERT OR REPLACE INTO message_sync_state (id, history_id, status) VALUES (?, ?, 'synced')
+        ''', (email_data.get('id'), email_data.get('historyId')))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def timed(label, n, fn):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<28} {n:>7} rows  {elapsed:8.2f}s  {n / elapsed:10.0f} rows/s")
+    return elapsed
+
+
+def run_size(n, batch_size, per_row_limit):
+    print(f"\n{n} messages")
+    with tempfile.TemporaryDirectory() as tmp:
+        baseline = os.path.join(tmp, 'per_row.db')
+        baseline_init(baseline)
+        rows = min(n, per_row_limit)
+        elapsed = timed("per-row (original path)", rows,
+                        lambda: [baseline_upsert_email(baseline, e) for e in make_emails(rows)])
+        if rows < n:
+            print(f"  {'(extrapolated)':<28} {n:>7} rows  {elapsed * n / rows:8.2f}s")
+
+        db = DatabaseManager(os.path.join(tmp, 'batched.db'))
+
+        def batched():
+            batch = []
+            for e in make_emails(n):
+                batch.append(e)
+                if len(batch) >= batch_size:
+                    db.upsert_many(batch)
+                    batch = []
+            db.upsert_many(batch)
+
+        timed(f"upsert_many (batch={batch_size})", n, batched)
+        # Re-ingesting unchanged mail should be nearly free: the conflict WHERE skips the rewrite
+        timed("upsert_many re-sync (no-op)", n, batched)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default="10000,100000")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--per-row-limit', type=int, default=10000)
+    args = parser.parse_args()
+
+    for n in [int(s) for s in args.sizes.split(',')]:
+        run_size(n, args.batch_size, args.per_row_limit)
+
+
+if __name__ == "__main__":
+    main()
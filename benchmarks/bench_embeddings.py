@@ -0,0 +1,96 @@
+"""
+Embedding index benchmark: build, load, search and compaction over N emails.
+
+Fills a fresh index in a temporary directory with random unit vectors (the
+embedder's own speed is reported separately, over real-looking text), then
+times cold loads of the memory-mapped file, top-k queries and a compaction
+after deleting a third of the emails.
+
+Usage:
+    python -m benchmarks.bench_embeddings --emails 100000 --dim 384
+    MAUTO_EMBEDDER=sentence-transformers python -m benchmarks.bench_embeddings --embed 512
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from src.database import DatabaseManager
+from src.embeddings import EmbeddingIndex, create_embedder
+
+
+class RandomEmbedder:
+    def __init__(self, dim):
+        self.dim = dim
+        self.name = f"random-{dim}"
+        self._rng = np.random.default_rng(0)
+
+    def embed(self, texts):
+        vectors = self._rng.standard_normal((len(texts), self.dim)).astype(np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def timed(label, fn, repeat=1):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    print(f"{label:<36} {np.median(times) * 1000:9.1f} ms" + (f"  (median of {repeat})" if repeat > 1 else ""))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--emails', type=int, default=100000)
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--k', type=int, default=20)
+    parser.add_argument('--embed', type=int, default=256, help="Texts to time the configured embedder on")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    db = DatabaseManager(os.path.join(workdir, 'bench.db'))
+    index = EmbeddingIndex(db, root=os.path.join(workdir, 'embeddings'), embedder=RandomEmbedder(args.dim))
+    print(f"{args.emails} emails, dim={args.dim}, in {workdir}\n")
+
+    def build():
+        for start in range(0, args.emails, args.batch_size):
+            index.add([{'id': f"msg{i:08d}"} for i in range(start, min(start + args.batch_size, args.emails))])
+    timed(f"build ({args.batch_size}/batch)", build)
+    size = sum(os.path.getsize(os.path.join(index.root, f)) for f in os.listdir(index.root))
+    print(f"{'vectors on disk':<36} {size / 1e6:9.1f} MB")
+
+    fresh = EmbeddingIndex(db, root=index.root, embedder=index.embedder)
+    timed("cold load", lambda: fresh.stats())
+    queries = index.embedder.embed(['q'] * 20)
+    it = iter(queries)
+    timed(f"search top-{args.k}", lambda: fresh.search_vector(next(it), args.k), repeat=len(queries))
+    timed(f"similar top-{args.k}", lambda: fresh.similar('msg00000042', args.k), repeat=10)
+    timed("warm load (writer)", lambda: index.stats())
+    timed("append 25 (resident copy extended)", lambda: index.add([{'id': f"new{i}"} for i in range(25)]))
+    timed("search after append", lambda: index.search_vector(queries[0], args.k))
+
+    db.executemany('DELETE FROM email_embeddings WHERE email_id = ?',
+                   [(f"msg{i:08d}",) for i in range(0, args.emails, 3)])
+    dropped = timed("compact (a third deleted)", lambda: index.compact())
+    print(f"{'rows dropped':<36} {dropped:9d}")
+
+    embedder = create_embedder()
+    texts = [f"Following up on the software engineer interview #{i}, happy to share availability next week."
+             for i in range(args.embed)]
+    embedder.embed(texts[:2])
+    elapsed = timed(f"embed {args.embed} texts ({embedder.name})", lambda: _embed(embedder, texts))
+    print(f"{'embedding throughput':<36} {args.embed / elapsed:9.1f} texts/s")
+
+
+def _embed(embedder, texts):
+    start = time.perf_counter()
+    embedder.embed(texts)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    main()
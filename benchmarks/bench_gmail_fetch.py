@@ -0,0 +1,52 @@
+"""
+Offline throughput benchmark for Gmail message fetching.
+
+Compares the serial one-request-per-message path against batched and
+concurrent fetching, and format='full' against format='metadata', using
+FakeGmailService to simulate round-trip latency.
+
+Usage:
+    python -m benchmarks.bench_gmail_fetch --messages 2000 --latency 0.05
+"""
+import argparse
+import time
+
+from src.fake_gmail import FakeGmailService
+from src.gmail_client import GmailClient
+
+
+def run(label, service, fetch):
+    service.round_trips = 0
+    service.bytes_sent = 0
+    start = time.perf_counter()
+    count = fetch()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {count:>6} msgs  {elapsed:7.2f}s  {count / elapsed:9.1f} msg/s  {service.round_trips:>6} round trips  {service.bytes_sent / 1e6:8.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.05, help="Simulated round-trip latency in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of calls failing with 429")
+    parser.add_argument('--serial-limit', type=int, default=200, help="Cap for the (slow) serial baseline")
+    args = parser.parse_args()
+
+    service = FakeGmailService(num_messages=args.messages, latency=args.latency, error_rate=args.error_rate)
+    client = GmailClient(service=service)
+    ids = client.list_sent_message_ids(max_results=args.messages)
+    print(f"Benchmarking {len(ids)} messages, {args.latency * 1000:.0f}ms latency, {args.error_rate:.0%} errors\n")
+
+    serial_ids = ids[:args.serial_limit]
+    run("serial get (baseline)", service, lambda: sum(1 for i in serial_ids if client.get_message(i)))
+
+    for batch_size, workers in [(50, 1), (50, 4), (50, 8), (100, 8)]:
+        run(f"batch={batch_size} workers={workers}", service,
+            lambda: sum(1 for _ in client.iter_messages(ids, batch_size=batch_size, max_workers=workers)))
+
+    run("batch=50 workers=4 metadata", service,
+        lambda: sum(1 for _ in client.iter_messages(ids, batch_size=50, max_workers=4, format='metadata')))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Inference benchmark: draft generation and batched classification throughput
+for one backend, so backends and models can be compared on the same machine.
+
+Reports average latency and tokens/sec as measured by the backend itself.
+
+Usage:
+    python -m benchmarks.bench_inference --backend transformers --drafts 3 --classify 64
+    python -m benchmarks.bench_inference --backend mlx --model mlx-community/Qwen2.5-3B-Instruct-4bit
+    MAUTO_PROMPT_CACHE_MB=0 python -m benchmarks.bench_inference   # without prefix reuse
+"""
+import argparse
+import time
+
+from src.ai_engine import AIEngine
+
+
+def make_email(i):
+    return {
+        'subject': f"Application #{i} for Research Intern",
+        'sender': "Me <me@example.com>",
+        'recipients_to': '["professor@example.edu"]',
+        'date': "2025-01-15T10:00:00+00:00",
+        'body_text': "Dear Professor,\n\nI am writing about openings in your lab this summer. " * 10,
+    }
+
+
+def make_items(n):
+    # Neutral wording so the keyword pre-filter leaves them to the model
+    return [(f"Quick question {i}", f"Hi, I was hoping to catch up about thing number {i} next week.") for i in range(n)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', default=None, help="mlx, transformers or fake (default: MAUTO_BACKEND, else mlx)")
+    parser.add_argument('--model', default=None)
+    parser.add_argument('--drafts', type=int, default=3)
+    parser.add_argument('--classify', type=int, default=64)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    engine = AIEngine(model_id=args.model, backend=args.backend)
+    print(f"Loaded {engine.model_id} in {time.perf_counter() - start:.1f}s")
+
+    for i in range(args.drafts):
+        # Same thread, new context: the prefilled thread prefix is reused after the first draft
+        engine.generate_follow_up(make_email(0), context=f"Variant {i}. Keep it short.")
+    if args.classify:
+        engine.classify_batch(make_items(args.classify))
+
+    stats = engine.stats()
+    print(f"\n{stats['backend']} / {stats['model_id']}")
+    for op, s in stats['ops'].items():
+        print(f"  {op:<9} {s['items']:>5} items  {s['avg_latency_ms']:9.1f} ms/call  "
+              f"{s['prompt_tokens_per_sec']:10.0f} prompt tok/s  {s['generated_tokens_per_sec']:8.1f} gen tok/s")
+    if stats['prompt_cache']:
+        print(f"  prompt cache: {stats['prompt_cache']}")
+
+
+if __name__ == "__main__":
+    main()
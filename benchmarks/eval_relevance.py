@@ -0,0 +1,138 @@
+"""
+Offline evaluation of the job-relevance classifier: accuracy and throughput.
+
+Trains RelevanceModel on a random split of labeled emails and reports, on
+the held-out rest: accuracy/precision/recall of the model, how many emails
+the keywords and the model decide at each confidence level (everything
+else would go to the LLM) and how accurate those decisions are, plus
+classification and training speed.
+
+Labels come from the DB (is_job_related plus user corrections), or from a
+synthetic mailbox with --synthetic N when there is no labeled DB at hand.
+
+Usage:
+    python -m benchmarks.eval_relevance                      # MAUTO_DB_PATH / emails.db
+    python -m benchmarks.eval_relevance --synthetic 50000
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+from src.relevance import RelevanceModel, keyword_decision, training_data
+
+JOB_SUBJECTS = ["Application for {role}", "Following up on my {role} application", "Interview availability",
+                "Re: next steps for the {role} position", "Thank you for the {company} interview",
+                "Referral for {role} at {company}", "Quick question about the {role} opening",
+                "Coffee chat about {company}?", "Re: offer details", "Research assistant inquiry"]
+OTHER_SUBJECTS = ["Weekend plans", "Invoice for {month}", "Re: dinner on {day}", "Your {company} receipt",
+                  "Notes from the {day} meeting", "Photos from the trip", "Re: rent for {month}",
+                  "Question about my {company} order", "Happy birthday!", "Group project slides"]
+JOB_SNIPPETS = ["I wanted to follow up on my application for the {role} role and share my updated resume",
+                "Thank you for taking the time to speak with me about the team at {company}",
+                "I am available for an interview any time on {day}, please let me know what works",
+                "I recently applied and would love to learn more about the hiring timeline",
+                "Attached is my cover letter for the {role} position"]
+OTHER_SNIPPETS = ["Are we still on for {day}? Let me know if you want to grab food after",
+                  "Here is the invoice for {month}, payment is due by the end of the week",
+                  "I uploaded the slides for our presentation, can you review section two",
+                  "Thanks for the photos, the trip was great",
+                  "My order from {company} arrived damaged, what should I do"]
+FILL = {'role': ["Software Engineering Intern", "Data Analyst", "ML Engineer", "Product Manager", "Research Intern"],
+        'company': ["Acme", "Globex", "Initech", "Umbrella", "Hooli", "Stark"],
+        'month': ["March", "April", "May", "June"], 'day': ["Monday", "Friday", "Saturday", "Sunday"]}
+
+
+def synthetic(n, noise, seed=0):
+    """n (subject, snippet) pairs with labels; `noise` of the labels are flipped."""
+    rng = random.Random(seed)
+
+    def fill(template):
+        return template.format(**{k: rng.choice(v) for k, v in FILL.items()})
+
+    items, labels = [], []
+    for _ in range(n):
+        is_job = rng.random() < 0.4
+        subjects, snippets = (JOB_SUBJECTS, JOB_SNIPPETS) if is_job else (OTHER_SUBJECTS, OTHER_SNIPPETS)
+        # Some emails borrow the other kind's snippet, so not everything is separable
+        if rng.random() < 0.15:
+            snippets = OTHER_SNIPPETS if is_job else JOB_SNIPPETS
+        items.append((fill(rng.choice(subjects)), fill(rng.choice(snippets))))
+        labels.append(int(is_job) ^ int(rng.random() < noise))
+    return items, labels, [1.0] * n
+
+
+def rate(label, n, seconds):
+    print(f"{label:<40} {n / seconds:12,.0f} emails/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=None, help="SQLite DB with labeled emails (default MAUTO_DB_PATH)")
+    parser.add_argument('--synthetic', type=int, default=0, help="Evaluate on N synthetic emails instead of a DB")
+    parser.add_argument('--noise', type=float, default=0.03, help="Label noise of the synthetic mailbox")
+    parser.add_argument('--test-fraction', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        items, labels, weights = synthetic(args.synthetic, args.noise, args.seed)
+        source = f"{args.synthetic} synthetic emails"
+    else:
+        from src.database import DatabaseManager
+        db = DatabaseManager(args.db)
+        items, labels, weights = training_data(db)
+        source = db.db_path
+    labels = np.array(labels)
+    print(f"{len(items)} labeled emails from {source}, {labels.mean():.0%} job-related\n")
+    if len(items) < 50:
+        print("Not enough labeled emails to evaluate.")
+        return
+
+    order = np.random.default_rng(args.seed).permutation(len(items))
+    n_test = max(1, int(len(items) * args.test_fraction))
+    test, train = order[:n_test], order[n_test:]
+    train_items = [items[i] for i in train]
+    test_items = [items[i] for i in test]
+    y_test = labels[test]
+
+    start = time.perf_counter()
+    model = RelevanceModel().fit(train_items, labels[train], [weights[i] for i in train])
+    train_time = time.perf_counter() - start
+
+    p = model.predict_proba(test_items)
+    predicted = p >= 0.5
+    tp = np.sum(predicted & (y_test == 1))
+    precision = tp / max(predicted.sum(), 1)
+    recall = tp / max((y_test == 1).sum(), 1)
+    print(f"Model on {n_test} held-out emails:")
+    print(f"  accuracy {np.mean(predicted == y_test):.3f}  precision {precision:.3f}  recall {recall:.3f}  "
+          f"F1 {2 * precision * recall / max(precision + recall, 1e-9):.3f}\n")
+
+    keyword = [keyword_decision(subject, snippet) for subject, snippet in test_items]
+    by_keyword = np.array([d is not None for d in keyword])
+    keyword_right = np.array([d is not None and int(d) == y for d, y in zip(keyword, y_test)])
+    print(f"{'keywords decide':<28} {by_keyword.mean():6.1%}  accuracy {keyword_right.sum() / max(by_keyword.sum(), 1):.3f}")
+    print(f"{'confidence':<12} {'model decides':>15} {'accuracy':>10} {'to LLM':>10}")
+    for confidence in (0.7, 0.8, 0.9, 0.95, 0.99):
+        sure = ~by_keyword & (np.maximum(p, 1 - p) >= confidence)
+        accuracy = np.mean(predicted[sure] == y_test[sure]) if sure.any() else float('nan')
+        print(f"{confidence:<12} {sure.mean():>15.1%} {accuracy:>10.3f} {np.mean(~by_keyword & ~sure):>10.1%}")
+    print()
+
+    sample = (test_items * (10000 // len(test_items) + 1))[:10000]
+    start = time.perf_counter()
+    for subject, snippet in sample:
+        keyword_decision(subject, snippet)
+    rate("keyword decision", len(sample), time.perf_counter() - start)
+    for batch_size in (16, 1000):
+        start = time.perf_counter()
+        for i in range(0, len(sample), batch_size):
+            model.predict_proba(sample[i:i + batch_size])
+        rate(f"model, batches of {batch_size}", len(sample), time.perf_counter() - start)
+    rate("training", len(train), train_time)
+
+
+if __name__ == "__main__":
+    main()
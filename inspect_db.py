@@ -17,7 +17,10 @@ def inspect_db():
 
     # 2. Attachments Check
     print("\n--- Attachments ---")
-    c.execute("SELECT id, subject, attachments FROM emails WHERE attachments != '[]' LIMIT 3")
+    c.execute("""
+        SELECT e.id, e.subject, b.attachments FROM emails e JOIN email_bodies b ON b.email_id = e.id
+        WHERE b.attachments != '[]' LIMIT 3
+    """)
     att_emails = c.fetchall()
     if att_emails:
         for e in att_emails:
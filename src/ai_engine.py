@@ -1,99 +1,170 @@
-from mlx_lm import load, generate
-from src.prompts import FOLLOW_UP_TEMPLATE
+import datetime
+import json
+import math
+import os
+import string
+from concurrent.futures import ThreadPoolExecutor
+from src.backends import create_backend
+from src.prompts import FOLLOW_UP_TEMPLATE, CLASSIFICATION_TEMPLATE, FILTER_QUERY_TEMPLATE, FILTER_TEMPLATE
+from src.search import normalize_filter_plan
+from src.relevance import keyword_decision
+from src.context import ThreadContextBuilder, DEFAULT_THREAD_TOKENS
+from src.calibration import load_temperature
+
+DRAFT_MAX_TOKENS = 500
+
+# Stands in for a template field to find where the chat-formatted prefix ends
+_PREFIX_MARK = "\x00"
+
+def default_thread_tokens():
+    return int(os.environ.get('MAUTO_THREAD_TOKENS', DEFAULT_THREAD_TOKENS))
+
+
+def draft_params(thread_tokens=None):
+    # Decoding is greedy, so the token limits are the only knobs
+    return {'max_tokens': DRAFT_MAX_TOKENS, 'decoding': 'greedy',
+            'thread_tokens': default_thread_tokens() if thread_tokens is None else thread_tokens}
+
 
 class AIEngine:
-    def __init__(self, model_id="mlx-community/Qwen2.5-3B-Instruct-4bit"):
-        print(f"DEBUG: Initializing AIEngine with model: {model_id}")
-        print("DEBUG: Calling load()...")
-        self.model, self.tokenizer = load(model_id)
+    def __init__(self, model_id=None, backend=None, calibration_temperature=None, thread_tokens=None):
+        """
+        backend: an InferenceBackend from src.backends, or a backend name
+        ("mlx", "transformers", "fake"). Defaults to MAUTO_BACKEND, else MLX.
+        model_id: overrides the backend's default model (or MAUTO_MODEL_ID).
+        calibration_temperature: divides the YES-NO logit margin before the
+        sigmoid; values > 1 soften over-confident models. Defaults to the
+        value fitted by src.calibration (or MAUTO_CALIBRATION_TEMPERATURE),
+        else 1.0, which leaves job probabilities uncalibrated.
+        thread_tokens: token budget for the thread given to drafts
+        (default MAUTO_THREAD_TOKENS, else 1500).
+        """
+        if backend is None or isinstance(backend, str):
+            print(f"DEBUG: Initializing AIEngine with backend: {backend or 'default'}, model: {model_id or 'default'}")
+            backend = create_backend(backend, model_id)
+        self.backend = backend
+        self.model_id = backend.model_id
+        if calibration_temperature is None:
+            calibration_temperature = load_temperature(self.model_id) or 1.0
+        self.calibration_temperature = calibration_temperature
+        self._static_prefixes = {}
+        if thread_tokens is None:
+            thread_tokens = default_thread_tokens()
+        self.thread_context = ThreadContextBuilder(backend.count_tokens, max_tokens=thread_tokens)
         print("DEBUG: Model loaded successfully.")
 
-    def generate_follow_up(self, email_data, context="I haven't heard back yet. Keep it short."):
+    @property
+    def draft_params(self):
+        """Generation settings that affect drafts (part of DraftCache keys)."""
+        return draft_params(self.thread_context.max_tokens)
+
+    def stats(self):
+        """Latency and tokens/sec per operation, as measured by the backend."""
+        return dict(self.backend.stats(), calibration_temperature=self.calibration_temperature)
+
+    def _chat(self, content):
+        return self.backend.apply_chat_template([{"role": "user", "content": content}])
+
+    def _prefix_before(self, template, field, **values):
         """
-        Generates a follow up based on a structured email dictionary from the DB.
+        The chat-formatted prompt text that comes before `field`, given the
+        values of the fields preceding it: what every such prompt starts with.
         """
-        # Format thread content
-        thread_content = f"Subject: {email_data['subject']}\nFrom: {email_data['sender']}\nBody:\n{email_data['body_text'][:2000]}" # Truncate for safety
-        
-        prompt = FOLLOW_UP_TEMPLATE.format(
+        names = [name for _, name, _, _ in string.Formatter().parse(template) if name]
+        fields = dict({name: '' for name in names}, **values)
+        fields[field] = _PREFIX_MARK
+        prompt = self._chat(template.format(**fields))
+        return prompt[:prompt.index(_PREFIX_MARK)]
+
+    def _static_prefix(self, template):
+        """Chat-formatted text up to the template's first field, shared by every call."""
+        if template not in self._static_prefixes:
+            first = next(name for _, name, _, _ in string.Formatter().parse(template) if name)
+            self._static_prefixes[template] = self._prefix_before(template, first)
+        return self._static_prefixes[template]
+
+    def _follow_up_prompt(self, email_data, context, thread=None):
+        """The chat prompt plus its reusable prefixes: the instructions, and the instructions + thread."""
+        # Whole thread newest first, deduplicated and cut to the token budget
+        thread_content = self.thread_context.build(thread or [email_data])
+
+        values = dict(
             recipient=email_data['recipients_to'],
             subject=email_data['subject'],
             date=email_data['date'],
             thread_content=thread_content,
-            context=context
         )
+        prompt = FOLLOW_UP_TEMPLATE.format(context=context, **values)
+        # Regenerating with another context only prefills the context
+        prefixes = [self._static_prefix(FOLLOW_UP_TEMPLATE), self._prefix_before(FOLLOW_UP_TEMPLATE, 'context', **values)]
+        return self._chat(prompt), prefixes
 
-        messages = [{"role": "user", "content": prompt}]
-        formatted_prompt = self.tokenizer.apply_chat_template(
-            messages, tokenize=False, add_generation_prompt=True
-        )
+    def generate_follow_up(self, email_data, context="I haven't heard back yet. Keep it short.", thread=None):
+        """
+        Generates a follow up based on a structured email dictionary from the DB.
+        thread: all messages of its thread (DatabaseManager.get_thread); defaults to just this one.
+        """
+        prompt, prefixes = self._follow_up_prompt(email_data, context, thread)
+        return self.backend.generate(prompt, max_tokens=DRAFT_MAX_TOKENS, prefixes=prefixes)
 
-        response = generate(
-            self.model, 
-            self.tokenizer, 
-            prompt=formatted_prompt, 
-            verbose=True, 
-            max_tokens=500
-        )
-        return response
+    def stream_follow_up(self, email_data, context="I haven't heard back yet. Keep it short.", thread=None):
+        """
+        Same as generate_follow_up, but yields the draft text as it is decoded.
+        Closing the generator stops decoding.
+        """
+        prompt, prefixes = self._follow_up_prompt(email_data, context, thread)
+        return self.backend.stream(prompt, max_tokens=DRAFT_MAX_TOKENS, prefixes=prefixes)
 
     def classify_relevance(self, subject, snippet):
         """
         Hybrid classifier: Keywords first, then LLM.
         """
-        text = (subject + " " + snippet).lower()
-        
-        # 1. Obvious Job Keywords (High Confidence YES)
-        job_keywords = [
-            "job", "internship", "intern ", "career", "vacancy", "opening", 
-            "hiring", "recruitment", "application", "applied", "position", 
-            "role", "candidate", "interview", "offer", "resume", "cv ", "linkedin",
-            "handshake", "workday", "greenhouse", "lever", "smartrecruiters",
-            "thank you for applying", "your application", "employment"
-        ]
-        
-        # 2. Obvious Non-Job Keywords (High Confidence NO)
-        trash_keywords = [
-            "newsletter", "unsubscribe", "sale", "discount", "promotional",
-            "subscription", "billing", "receipt", "verification code", "otp",
-            "marketing", "advertisement", "daily digest"
-        ]
-
-        # Heuristic Scoring
-        job_score = sum(1 for kw in job_keywords if kw in text)
-        trash_score = sum(1 for kw in trash_keywords if kw in text)
-
-        # Decision Logic
-        if job_score >= 2 and trash_score == 0:
-            return True # High confidence Job
-        if trash_score >= 2 and job_score == 0:
-            return False # High confidence Irrelevant
-            
-        # 3. Ambiguous - Use LLM
-        print(f"Ambiguous email (Score: J{job_score}/T{trash_score}), using LLM...")
-        from src.prompts import CLASSIFICATION_TEMPLATE
-        prompt = CLASSIFICATION_TEMPLATE.format(subject=subject, snippet=snippet)
-        messages = [{"role": "user", "content": prompt}]
-        formatted_prompt = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-        
-        response = generate(self.model, self.tokenizer, prompt=formatted_prompt, max_tokens=10).strip().upper()
-        return "YES" in response
+        return self.classify_batch([(subject, snippet)])[0][0]
+
+    def classify_batch(self, items, threshold=0.5):
+        """
+        Classifies (subject, snippet) pairs. Keyword matches decide the obvious
+        ones; all ambiguous ones are scored together by comparing the YES and NO
+        logits of the first answer token (one prefill, no decoding).
+        Returns a list of (is_job, probability); probability is None for
+        keyword decisions.
+        """
+        results = [None] * len(items)
+        ambiguous = []
+        for i, (subject, snippet) in enumerate(items):
+            decision = keyword_decision(subject, snippet)
+            if decision is not None:
+                results[i] = (decision, None)
+            else:
+                ambiguous.append(i)
+
+        if ambiguous:
+            print(f"{len(ambiguous)} ambiguous emails, scoring with LLM...")
+            margins = self.score_margins([items[i] for i in ambiguous])
+            for i, margin in zip(ambiguous, margins):
+                probability = 1 / (1 + math.exp(-margin / self.calibration_temperature))
+                results[i] = (probability >= threshold, probability)
+
+        return results
+
+    def score_margins(self, items):
+        """YES minus NO logit of the classification prompt for each (subject, snippet) pair."""
+        prompts = [self._chat(CLASSIFICATION_TEMPLATE.format(subject=subject, snippet=snippet))
+                   for subject, snippet in items]
+        scores = self.backend.score_choices(prompts, ["YES", "NO"], prefix=self._static_prefix(CLASSIFICATION_TEMPLATE))
+        return [yes - no for yes, no in scores]
 
     def filter_emails(self, emails_metadata, prompt):
         """
         Filters a list of email metadata based on a natural language prompt.
         emails_metadata: List of dicts with {id, subject, date, sender}
         """
-        from src.prompts import FILTER_TEMPLATE
-        import json
-        
         metadata_str = "\n".join([f"- ID: {e['id']}, To: {e['sender']}, Sub: {e['subject']}, Date: {e['date']}" for e in emails_metadata])
         full_prompt = FILTER_TEMPLATE.format(prompt=prompt, metadata_list=metadata_str)
         
-        messages = [{"role": "user", "content": full_prompt}]
-        formatted_prompt = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-        
-        response = generate(self.model, self.tokenizer, prompt=formatted_prompt, max_tokens=1000).strip()
+        # Scan mode sends the same prompt with every chunk
+        prefixes = [self._static_prefix(FILTER_TEMPLATE), self._prefix_before(FILTER_TEMPLATE, 'metadata_list', prompt=prompt)]
+        response = self.backend.generate(self._chat(full_prompt), max_tokens=1000, prefixes=prefixes).strip()
         
         # Try to extract JSON list
         try:
@@ -105,3 +176,46 @@ class AIEngine:
             return []
         except:
             return []
+
+    def plan_filter_query(self, prompt, today=None):
+        """
+        Turns a natural language filter into a small structured query
+        ({keywords, sender, recipient, date_from, date_to, is_job}) that can
+        be run as SQL/FTS over the whole mailbox. Returns None if the model
+        output could not be parsed.
+        """
+        today = today or datetime.date.today().isoformat()
+        full_prompt = FILTER_QUERY_TEMPLATE.format(prompt=prompt, today=today)
+        prefixes = [self._static_prefix(FILTER_QUERY_TEMPLATE)]
+        response = self.backend.generate(self._chat(full_prompt), max_tokens=150, prefixes=prefixes).strip()
+
+        start = response.find('{')
+        end = response.rfind('}') + 1
+        if start == -1 or end == 0:
+            return None
+        try:
+            return normalize_filter_plan(json.loads(response[start:end]))
+        except ValueError:
+            return None
+
+    def filter_emails_scan(self, metadata_chunks, prompt, workers=2):
+        """
+        Fallback filter: runs filter_emails over each chunk of metadata and
+        yields the matching IDs chunk by chunk, as soon as each is done.
+        Chunks are prepared and parsed on a worker pool; decoding itself is
+        serialized by the backend on the single loaded model.
+        """
+        def scan(chunk):
+            # Drop IDs the model made up
+            known_ids = {e['id'] for e in chunk}
+            return [i for i in self.filter_emails(chunk, prompt) if i in known_ids]
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            in_flight = []
+            for chunk in metadata_chunks:
+                in_flight.append(pool.submit(scan, chunk))
+                # Bound look-ahead so the chunk iterator is consumed lazily
+                if len(in_flight) >= workers:
+                    yield in_flight.pop(0).result()
+            for future in in_flight:
+                yield future.result()
@@ -1,11 +1,25 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+import queue
 from pydantic import BaseModel
-import sqlite3
+from typing import Optional
 import json
+import mimetypes
+import os
 from src.database import DatabaseManager
-from src.ai_engine import AIEngine
+from src.scheduler import InferenceScheduler, ScheduledEngine, INTERACTIVE, BACKGROUND, IDLE
+from src.cache import DraftCache
+from src.context import DRAFT_PROMPT_VERSION
+from src.attachments import AttachmentStore
 from src.sync import main as run_sync
+from src.sync_jobs import SyncJobManager
+from src.hydration import BodyHydrator
+from src.embeddings import EmbeddingIndex
+from src.relevance import RelevanceClassifier, train_relevance_model
+from src.threads import utc_cutoff
+from src.pregenerate import DraftPregenerator, draft_key, DEFAULT_CONTEXT
 
 app = FastAPI(title="Mauto API")
 
@@ -16,133 +30,402 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Content-Range", "Accept-Ranges"],
 )
 
 # Global Managers
 db_manager = DatabaseManager()
-ai_engine = None
+# One worker owns the model; drafts jump ahead of background classification
+scheduler = InferenceScheduler()
+AI_TIMEOUT = float(os.environ.get('MAUTO_AI_TIMEOUT', 120))
+interactive_ai = ScheduledEngine(scheduler, INTERACTIVE, timeout=AI_TIMEOUT)
+background_ai = ScheduledEngine(scheduler, BACKGROUND)
+# Sync classification: keywords and the trained model first, background_ai for the unsure rest
+relevance_classifier = RelevanceClassifier(background_ai)
+draft_cache = DraftCache(db_manager)
+attachment_store = AttachmentStore(db_manager)
+# Downloads bodies of emails synced with MAUTO_SYNC_FORMAT=metadata
+body_hydrator = BodyHydrator(db_manager)
+# Vectors for semantic search and similar emails; filled in by sync
+embedding_index = EmbeddingIndex(db_manager) if os.environ.get('MAUTO_EMBEDDINGS', '1') != '0' else None
+# Drafts for stale threads, written while the model is otherwise idle
+draft_pregenerator = DraftPregenerator(db_manager, draft_cache, ScheduledEngine(scheduler, IDLE),
+                                       hydrate=body_hydrator.hydrate)
 
-def get_ai_engine():
-    global ai_engine
-    if ai_engine is None:
-        ai_engine = AIEngine()
-    return ai_engine
-
-def sync_task():
+def sync_task(**options):
     # Helper to run sync in background with shared engine
-    engine = get_ai_engine()
-    run_sync(ai=engine, db=db_manager)
+    try:
+        return run_sync(ai=relevance_classifier, db=db_manager, embeddings=embedding_index, **options)
+    finally:
+        body_hydrator.wake()
+        if os.environ.get('MAUTO_PREGENERATE', '1') != '0':
+            draft_pregenerator.wake()
+
+sync_jobs = SyncJobManager(sync_task, db_manager)
 
 class GenerateRequest(BaseModel):
     email_id: str
     context: str
+    # Skip the draft cache and generate a fresh draft (which replaces the cached one)
+    regenerate: bool = False
+
+class RelevanceRequest(BaseModel):
+    is_job: bool
 
 class FilterRequest(BaseModel):
     prompt: str
+    # "plan": the LLM writes a structured query that runs over the whole DB
+    # "scan": the LLM reads metadata chunk by chunk (slow fallback)
+    mode: str = "plan"
+    limit: int = 200
 
 @app.get("/api/emails")
-def get_emails(limit: int = 50, offset: int = 0, is_job: bool = True):
-    conn = sqlite3.connect('emails.db')
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    
-    # Ensure table exists (safeguard)
-    c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='emails'")
-    if not c.fetchone():
-        conn.close()
-        return []
-    
-    # Filter by job relatedness if requested
-    query = "SELECT id, subject, sender, date, snippet, thread_id, recipients_to, recipients_cc, recipients_bcc FROM emails"
-    query += " WHERE is_job_related = ?"
-    query += " ORDER BY date DESC LIMIT ? OFFSET ?"
-    
-    c.execute(query, (1 if is_job else 0, limit, offset))
-    rows = c.fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+def get_emails(response: Response, limit: int = 50, offset: int = 0, is_job: bool = True, after: Optional[str] = None):
+    """
+    Lists emails newest first. Pass the X-Next-Cursor header of a page back as
+    ?after=<date,id> for keyset pagination (constant time at any depth).
+    """
+    cursor = None
+    if after:
+        date, sep, last_id = after.rpartition(',')
+        if not sep:
+            raise HTTPException(status_code=400, detail="after must be '<date>,<id>'")
+        cursor = (date, last_id)
+
+    # Schema is guaranteed by DatabaseManager._init_db at startup
+    rows = db_manager.list_emails(is_job=is_job, limit=limit, offset=offset, after=cursor)
+    if len(rows) == limit:
+        response.headers["X-Next-Cursor"] = f"{rows[-1]['date']},{rows[-1]['id']}"
+    return rows
+
+@app.get("/api/threads")
+def get_threads(response: Response, limit: int = 50, is_job: bool = True, awaiting_reply: Optional[bool] = None,
+                stale_days: Optional[float] = None, after: Optional[str] = None):
+    """
+    Lists threads with their latest activity. stale_days=N is the follow-up
+    inbox: threads still awaiting a reply where we last wrote more than N days
+    ago. Paginate with the X-Next-Cursor header as ?after=<date,thread_id>.
+    """
+    cursor = None
+    if after:
+        date, sep, last_id = after.rpartition(',')
+        if not sep:
+            raise HTTPException(status_code=400, detail="after must be '<date>,<thread_id>'")
+        cursor = (date, last_id)
+
+    sent_before = None
+    if stale_days is not None:
+        sent_before = utc_cutoff(days=stale_days)
+        awaiting_reply = True
+    rows = db_manager.list_threads(is_job=is_job, awaiting_reply=awaiting_reply, sent_before=sent_before,
+                                   limit=limit, after=cursor)
+    if len(rows) == limit:
+        sort_key = 'last_date' if awaiting_reply is None else 'last_sent_date'
+        response.headers["X-Next-Cursor"] = f"{rows[-1][sort_key]},{rows[-1]['thread_id']}"
+    return rows
 
-from fastapi import Response
 from src.gmail_client import GmailClient
+from src.search import build_match_query
 
 # ...
 
+@app.get("/api/search")
+def search_emails(q: str, limit: int = 50, offset: int = 0, is_job: Optional[bool] = None, mode: str = "keyword"):
+    """
+    Full-text search over the whole mailbox, best matches first.
+    Supports prefix* terms, "quoted phrases", -exclusions and
+    from:/to:/cc:/bcc:/subject:/body: field filters.
+    mode="semantic" ranks by meaning instead (embedding similarity), for
+    queries like "offer negotiation" that don't share words with the email.
+    """
+    if mode == "semantic":
+        if not q.strip():
+            return []
+        return _embedding_results(lambda k: _embeddings().search(q, k), limit, offset, is_job)
+    if mode != "keyword":
+        raise HTTPException(status_code=400, detail="mode must be 'keyword' or 'semantic'")
+    match_query = build_match_query(q)
+    if match_query is None:
+        return []
+    return db_manager.search(match_query, limit=limit, offset=offset, is_job=is_job)
+
 @app.get("/api/emails/{email_id}")
 def get_email_detail(email_id: str):
-    # ... (existing code)
-    conn = sqlite3.connect('emails.db')
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    
     # Get the specific email
-    c.execute("SELECT * FROM emails WHERE id = ?", (email_id,))
-    row = c.fetchone()
-    if not row:
-        conn.close()
+    email = db_manager.get_email(email_id)
+    if not email:
         raise HTTPException(status_code=404, detail="Email not found")
     
-    email = dict(row)
-    
-    # Get the full thread
-    c.execute("SELECT * FROM emails WHERE thread_id = ? ORDER BY date ASC", (email['thread_id'],))
-    thread_rows = c.fetchall()
-    conn.close()
-    
+    # Get the full thread, downloading any bodies that were synced as metadata only
+    thread = body_hydrator.hydrate(db_manager.get_thread(email['thread_id']))
+    email = next((m for m in thread if m['id'] == email_id), None) or body_hydrator.hydrate([email])[0]
+    # A draft pre-generated (or generated earlier) with the default instructions, shown without inference
+    key = draft_key(draft_cache, interactive_ai, email, thread, DEFAULT_CONTEXT)
     return {
         "email": email,
-        "thread": [dict(r) for r in thread_rows]
+        "thread": thread,
+        "suggested_draft": draft_cache.get(key) if draft_cache.contains(key) else None
     }
 
+@app.post("/api/emails/{email_id}/relevance")
+def correct_relevance(email_id: str, req: RelevanceRequest):
+    """
+    Records the user's job-related label for an email and moves it to that list.
+    Corrections are the strongest training signal; the model is retrained
+    with them after the next sync (or via POST /api/relevance/train).
+    """
+    if not db_manager.record_relevance_correction(email_id, req.is_job):
+        raise HTTPException(status_code=404, detail="Email not found")
+    return {"id": email_id, "is_job_related": 1 if req.is_job else 0}
+
+@app.post("/api/relevance/train")
+def train_relevance():
+    """Retrains the relevance model on the current labels and corrections now."""
+    model = train_relevance_model(db_manager)
+    if model is None:
+        raise HTTPException(status_code=409, detail="Not enough labeled emails of both kinds to train on yet")
+    return model.meta
+
+@app.get("/api/emails/{email_id}/similar")
+def get_similar_emails(email_id: str, limit: int = 10, is_job: Optional[bool] = None):
+    """Emails from other threads that are closest in meaning to this one, best first."""
+    email = db_manager.get_email(email_id)
+    if not email:
+        raise HTTPException(status_code=404, detail="Email not found")
+
+    def search(k):
+        hits = _embeddings().similar(email_id, k)
+        if hits is None:
+            raise HTTPException(status_code=404, detail="Email is not indexed yet")
+        return hits
+
+    return _embedding_results(search, limit, 0, is_job, exclude_thread=email['thread_id'])
+
+def _embeddings():
+    if embedding_index is None:
+        raise HTTPException(status_code=503, detail="Embeddings are disabled (MAUTO_EMBEDDINGS=0)")
+    return embedding_index
+
+def _embedding_results(search, limit, offset, is_job=None, exclude_thread=None):
+    """
+    List rows (plus score) for the top hits of search(k). Filters apply after
+    ranking, so it asks for more hits until the page is full or the index runs out.
+    """
+    wanted = limit + offset
+    k = wanted
+    while True:
+        hits = search(k)
+        scores = dict(hits)
+        rows = [r for r in db_manager.get_list_rows(scores)
+                if (is_job is None or bool(r['is_job_related']) == is_job) and r['thread_id'] != exclude_thread]
+        if len(rows) >= wanted or len(hits) < k:
+            break
+        k *= 4
+    for row in rows:
+        row['score'] = round(scores[row['id']], 4)
+    rows.sort(key=lambda r: r['score'], reverse=True)
+    return rows[offset:offset + limit]
+
 @app.get("/api/attachments/{message_id}/{attachment_id}")
-def get_attachment(message_id: str, attachment_id: str):
-    client = GmailClient()
+def get_attachment(message_id: str, attachment_id: str, request: Request):
+    """
+    Serves an attachment from the local store, downloading it from Gmail only
+    the first time. Content-addressed, so the ETag never goes stale; Range
+    requests are supported (PDF viewers and media seeking use them).
+    """
+    meta = db_manager.get_attachment_meta(message_id, attachment_id) or {}
     try:
-        data = client.get_attachment_data(message_id, attachment_id)
-        if not data:
-            raise HTTPException(status_code=404, detail="Attachment not found")
-        
-        # Determine mime type ?? For now generic or trust browser
-        # Ideally we pass it in query param or lookup in DB, but simple blob return works for images
-        return Response(content=data)
+        found = attachment_store.get(
+            message_id, attachment_id, lambda: GmailClient().get_attachment_data(message_id, attachment_id)
+        )
     except Exception as e:
         print(f"Error fetching attachment: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    if found is None:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+
+    sha256, path = found
+    etag = f'"{sha256}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=31536000, immutable"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+
+    filename = meta.get('filename')
+    media_type = meta.get('mimeType') or (mimetypes.guess_type(filename)[0] if filename else None)
+    return FileResponse(path, media_type=media_type or "application/octet-stream", filename=filename,
+                        content_disposition_type="inline", headers=headers)
+
+def _sse(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
 
 @app.post("/api/sync")
-def trigger_sync(background_tasks: BackgroundTasks):
-    background_tasks.add_task(sync_task)
-    return {"status": "Sync started in background"}
+def trigger_sync(full: bool = False):
+    """
+    Starts a sync job, or returns the one already running (started=false).
+    Follow it with GET /api/sync/events.
+    """
+    job, started = sync_jobs.start(full=full)
+    return {"status": "Sync started in background" if started else "Sync already running",
+            "started": started, "job": job.to_dict()}
+
+@app.get("/api/sync/jobs")
+def list_sync_jobs():
+    return [job.to_dict() for job in sync_jobs.jobs()]
+
+@app.get("/api/sync/jobs/{job_id}")
+def get_sync_job(job_id: str):
+    job = sync_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Sync job not found")
+    return job.to_dict()
+
+@app.post("/api/sync/jobs/{job_id}/cancel")
+def cancel_sync_job(job_id: str):
+    job = sync_jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Sync job not found")
+    return job.to_dict()
+
+@app.get("/api/sync/events")
+async def sync_events(request: Request):
+    """
+    Server-sent events for sync jobs: `event: job` with the job's status and
+    counters (listed/fetched/classified/stored) as they change, `event: emails`
+    with rows as they are stored, and `event: deleted` with removed IDs. The
+    running job, if any, is sent first.
+    """
+    events = sync_jobs.subscribe()
+
+    async def stream():
+        try:
+            job = sync_jobs.current()
+            if job is not None:
+                yield _sse(job.to_dict(), event="job")
+            while not await request.is_disconnected():
+                try:
+                    event, data = await run_in_threadpool(events.get, timeout=15)
+                except queue.Empty:
+                    # Keeps proxies from closing an idle connection
+                    yield ": keep-alive\n\n"
+                    continue
+                yield _sse(data, event=event)
+        finally:
+            sync_jobs.unsubscribe(events)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def _draft_request(req):
+    """Loads the email and its thread, and the draft cache key for this request."""
+    email = db_manager.get_email(req.email_id)
+    if not email:
+        raise HTTPException(status_code=404, detail="Email not found")
+    thread = body_hydrator.hydrate(db_manager.get_thread(email['thread_id']))
+    email = next((m for m in thread if m['id'] == email['id']), email)
+    return email, thread, draft_key(draft_cache, interactive_ai, email, thread, req.context)
 
 @app.post("/api/generate")
 def generate_draft(req: GenerateRequest):
-    conn = sqlite3.connect('emails.db')
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT * FROM emails WHERE id = ?", (req.email_id,))
-    row = c.fetchone()
-    conn.close()
-
-    if not row:
-        raise HTTPException(status_code=404, detail="Email not found")
+    email, thread, key = _draft_request(req)
+    if not req.regenerate:
+        draft = draft_cache.get(key)
+        if draft is not None:
+            return {"draft": draft, "cached": True}
 
-    engine = get_ai_engine()
-    draft = engine.generate_follow_up(dict(row), context=req.context)
-    
-    return {"draft": draft}
+    try:
+        draft = interactive_ai.generate_follow_up(email, context=req.context, thread=thread)
+    except TimeoutError:
+        raise HTTPException(status_code=503, detail="The model is busy, try again shortly")
+    draft_cache.put(key, email['id'], draft, interactive_ai.model_id, DRAFT_PROMPT_VERSION)
+    return {"draft": draft, "cached": False}
+
+@app.post("/api/generate/stream")
+def generate_draft_stream(req: GenerateRequest):
+    """
+    Server-sent events: one `data: {"token": ...}` per decoded chunk, then
+    `event: done` with the full draft and whether it came from the cache (or
+    `event: error`). Closing the connection stops decoding.
+    """
+    email, thread, key = _draft_request(req)
+    cached = None if req.regenerate else draft_cache.get(key)
+    if cached is not None:
+        events = iter([_sse({"token": cached}), _sse({"draft": cached, "cached": True}, event="done")])
+        return StreamingResponse(events, media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    tokens = interactive_ai.stream_follow_up(email, context=req.context, thread=thread)
+
+    async def events():
+        draft = []
+        try:
+            async for token in iterate_in_threadpool(tokens):
+                draft.append(token)
+                yield _sse({"token": token})
+            draft = "".join(draft)
+            # Only complete drafts are cached; a cancelled stream never gets here
+            await run_in_threadpool(draft_cache.put, key, email['id'], draft, interactive_ai.model_id, DRAFT_PROMPT_VERSION)
+            yield _sse({"draft": draft, "cached": False}, event="done")
+        except Exception as e:
+            print(f"Error streaming draft: {e}")
+            yield _sse({"detail": str(e)}, event="error")
+        finally:
+            # Also reached when the client disconnects: stop decoding and release the model
+            tokens.close()
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/api/ai/stats")
+def ai_stats():
+    # Don't load the model just to report that nothing has run yet
+    return {"loaded": scheduler.engine is not None, **interactive_ai.stats(), "scheduler": scheduler.stats(),
+            "draft_cache": draft_cache.stats(), "attachments": attachment_store.stats(),
+            "hydration": body_hydrator.stats(), "relevance": relevance_classifier.stats(),
+            "pregenerated_drafts": draft_pregenerator.stats(),
+            "embeddings": embedding_index.stats() if embedding_index is not None else None}
 
 @app.post("/api/filter")
 def filter_emails(req: FilterRequest):
-    conn = sqlite3.connect('emails.db')
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    # Get all emails for context (simplified, might want to limit to current view)
-    c.execute("SELECT id, subject, sender, date FROM emails ORDER BY date DESC LIMIT 100")
-    emails = [dict(r) for r in c.fetchall()]
-    conn.close()
-    
-    engine = get_ai_engine()
-    matching_ids = engine.filter_emails(emails, req.prompt)
-    return {"matching_ids": matching_ids}
+    engine = interactive_ai
+    if req.mode == "scan":
+        chunks = db_manager.iter_metadata_chunks()
+        try:
+            matching_ids = [i for ids in engine.filter_emails_scan(chunks, req.prompt) for i in ids]
+        except TimeoutError:
+            raise HTTPException(status_code=503, detail="The model is busy, try again shortly")
+        return {"matching_ids": matching_ids, "query": None}
+
+    try:
+        plan = engine.plan_filter_query(req.prompt)
+    except TimeoutError:
+        plan = None
+    if plan is None:
+        # The model's query couldn't be parsed; fall back to full-text search of the prompt
+        match_query = build_match_query(req.prompt)
+        emails = db_manager.search(match_query, limit=req.limit) if match_query else []
+    else:
+        emails = db_manager.filter_emails(plan, limit=req.limit)
+    return {"matching_ids": [e['id'] for e in emails], "query": plan, "emails": emails}
+
+@app.post("/api/filter/stream")
+def filter_emails_stream(req: FilterRequest):
+    """
+    Scan-mode filter that streams matching IDs as NDJSON, one line per
+    processed chunk. If the model stays busy, the last line is {"error": ...}.
+    """
+    engine = interactive_ai
+
+    def matches():
+        chunks = engine.filter_emails_scan(db_manager.iter_metadata_chunks(), req.prompt)
+        try:
+            for ids in chunks:
+                yield json.dumps({"matching_ids": ids}) + "\n"
+        except TimeoutError:
+            yield json.dumps({"error": "The model is busy, try again shortly"}) + "\n"
+        finally:
+            chunks.close()
+
+    return StreamingResponse(matches(), media_type="application/x-ndjson")
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+DEFAULT_ATTACHMENT_DIR = 'attachments'
+DEFAULT_ATTACHMENT_CACHE_MB = 1024
+# Sync only prefetches attachments up to this size; bigger ones are fetched when opened
+DEFAULT_PREFETCH_MAX_BYTES = 10 * 1024 * 1024
+
+
+class AttachmentStore:
+    """
+    On-disk, content-addressed attachment cache. Each blob is written once to
+    root/<sha256[:2]>/<sha256>; attachment_refs maps Gmail's (message id,
+    attachment id) pairs onto blobs, so identical files sent twice share one
+    copy. Filled on demand by get() or during sync by prefetch(); the least
+    recently used blobs are evicted once the total exceeds max_bytes.
+    """
+    def __init__(self, db, root=None, max_bytes=None):
+        self.db = db
+        self.root = root or os.environ.get('MAUTO_ATTACHMENT_DIR', DEFAULT_ATTACHMENT_DIR)
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get('MAUTO_ATTACHMENT_CACHE_MB', DEFAULT_ATTACHMENT_CACHE_MB)) * 1024 * 1024)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def path(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    def lookup(self, message_id, attachment_id):
+        """(sha256, path) if the attachment is stored, else None. Marks it as recently used."""
+        row = self.db.query_one(
+            'SELECT sha256 FROM attachment_refs WHERE message_id = ? AND attachment_id = ?', (message_id, attachment_id)
+        )
+        if row is None:
+            return None
+        path = self.path(row['sha256'])
+        if not os.path.exists(path):
+            # Deleted behind our back; refetch it
+            return None
+        self.db.execute('UPDATE attachment_blobs SET last_used = CURRENT_TIMESTAMP WHERE sha256 = ?', (row['sha256'],))
+        return row['sha256'], path
+
+    def get(self, message_id, attachment_id, fetch):
+        """
+        (sha256, path) for the attachment. On a miss, fetch() is called for
+        the raw bytes (once, even if several requests miss at the same time)
+        and the result is stored. Returns None if fetch() returns nothing.
+        """
+        found = self.lookup(message_id, attachment_id)
+        if found is None:
+            with self._key_lock((message_id, attachment_id)):
+                found = self.lookup(message_id, attachment_id)
+                if found is None:
+                    self.misses += 1
+                    data = fetch()
+                    return self.put(message_id, attachment_id, data) if data is not None else None
+        self.hits += 1
+        return found
+
+    def put(self, message_id, attachment_id, data):
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = self.path(sha256)
+        if not os.path.exists(path):
+            directory = os.path.dirname(path)
+            os.makedirs(directory, exist_ok=True)
+            # Write then rename, so a reader never sees a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+        self.db.execute('''
+            INSERT INTO attachment_blobs (sha256, size) VALUES (?, ?)
+            ON CONFLICT(sha256) DO UPDATE SET last_used = CURRENT_TIMESTAMP
+        ''', (sha256, len(data)))
+        self.db.execute('INSERT OR REPLACE INTO attachment_refs (message_id, attachment_id, sha256) VALUES (?, ?, ?)',
+                        (message_id, attachment_id, sha256))
+        self.evict(keep=sha256)
+        return sha256, path
+
+    def evict(self, keep=None):
+        """Deletes least recently used blobs until the store fits max_bytes. Returns how many were removed."""
+        total = self.db.query_one('SELECT COALESCE(SUM(size), 0) AS total FROM attachment_blobs')['total']
+        if total <= self.max_bytes:
+            return 0
+
+        kept = self.db.query_one('SELECT size FROM attachment_blobs WHERE sha256 = ?', (keep,)) if keep else None
+        budget = self.max_bytes - (kept['size'] if kept else 0)
+        victims = [row['sha256'] for row in self.db.query('''
+            SELECT sha256 FROM (
+                SELECT sha256, SUM(size) OVER (ORDER BY last_used DESC, sha256) AS running
+                FROM attachment_blobs WHERE sha256 IS NOT ?
+            ) WHERE running > ?
+        ''', (keep, budget))]
+
+        for sha256 in victims:
+            self.db.execute('DELETE FROM attachment_refs WHERE sha256 = ?', (sha256,))
+            self.db.execute('DELETE FROM attachment_blobs WHERE sha256 = ?', (sha256,))
+            try:
+                os.remove(self.path(sha256))
+            except FileNotFoundError:
+                pass
+        return len(victims)
+
+    def prefetch(self, client, email, max_size=DEFAULT_PREFETCH_MAX_BYTES):
+        """Stores the email's attachments (up to max_size each). Returns how many were downloaded."""
+        attachments = email.get('attachments') or []
+        if isinstance(attachments, str):
+            attachments = json.loads(attachments)
+
+        downloaded = 0
+        for att in attachments:
+            if att.get('size', 0) > max_size:
+                continue
+            misses = self.misses
+            try:
+                self.get(email['id'], att['attachmentId'],
+                         lambda: client.get_attachment_data(email['id'], att['attachmentId']))
+            except Exception as e:
+                print(f"Error prefetching attachment {att.get('filename')} of {email['id']}: {e}")
+                continue
+            downloaded += self.misses - misses
+        return downloaded
+
+    def stats(self):
+        row = self.db.query_one('SELECT COUNT(*) AS blobs, COALESCE(SUM(size), 0) AS bytes FROM attachment_blobs')
+        return {'hits': self.hits, 'misses': self.misses, 'blobs': row['blobs'], 'bytes': row['bytes'],
+                'max_bytes': self.max_bytes}
+
+    def _key_lock(self, key):
+        with self._locks_lock:
+            lock = self._locks.get(key)
+            if lock is None:
+                # Drop idle locks so this stays small; at worst two requests then fetch the same file
+                if len(self._locks) > 1024:
+                    self._locks = {k: l for k, l in self._locks.items() if l.locked()}
+                lock = self._locks[key] = threading.Lock()
+            return lock
@@ -0,0 +1,578 @@
+"""
+Inference backends behind AIEngine.
+
+A backend owns the model and tokenizer and exposes:
+- apply_chat_template(messages) -> prompt string
+- generate(prompt, max_tokens, verbose=False, prefixes=()) -> completion text
+- stream(prompt, max_tokens, prefixes=()) -> generator of text chunks as they
+  are decoded; closing it early stops decoding
+- score_choices(prompts, choices, prefix=None) -> per prompt, one logit per
+  choice for the first generated token, from a single padded forward pass per
+  micro-batch
+- count_tokens(text)
+- stats() -> call counts, latency and tokens/sec per operation
+
+MLXBackend runs on Apple Silicon. TransformersBackend runs on any CPU/GPU
+with a small stand-in model, so the AI path can be tested off macOS.
+FakeBackend is deterministic and model-free, for tests and plumbing benchmarks.
+
+Pick one with create_backend(name) or the MAUTO_BACKEND / MAUTO_MODEL_ID
+environment variables.
+
+Prompt prefixes: `prefixes` / `prefix` are leading strings of the prompt that
+other calls share (a template's instructions, or a whole thread). Their KV
+state is prefilled once and kept in a PrefixCache (LRU, MAUTO_PROMPT_CACHE_MB
+budget), so later calls only prefill the rest of the prompt.
+"""
+import copy
+import hashlib
+import math
+import os
+import threading
+import time
+
+from src.cache import PrefixCache
+
+DEFAULT_MLX_MODEL = "mlx-community/Qwen2.5-3B-Instruct-4bit"
+# Same family as the MLX default, small enough for CPU tests
+DEFAULT_TRANSFORMERS_MODEL = "Qwen/Qwen2.5-0.5B-Instruct"
+DEFAULT_FAKE_MODEL = "fake"
+DEFAULT_PROMPT_CACHE_MB = 512
+
+
+def logsumexp(values):
+    m = max(values)
+    return m + math.log(sum(math.exp(v - m) for v in values))
+
+
+def choice_token_ids(encode, word):
+    """First-token ids of the common casings of a one-word answer (e.g. YES/Yes/yes)."""
+    ids = []
+    for variant in (word.upper(), word.capitalize(), word.lower()):
+        tokens = encode(variant)
+        if tokens and tokens[0] not in ids:
+            ids.append(tokens[0])
+    return ids
+
+
+class InferenceBackend:
+    """Base class: times every call and counts tokens; subclasses implement the underscored methods."""
+    model_id = None
+
+    def __init__(self, prompt_cache_mb=None):
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+        if prompt_cache_mb is None:
+            prompt_cache_mb = float(os.environ.get('MAUTO_PROMPT_CACHE_MB', DEFAULT_PROMPT_CACHE_MB))
+        self.prompt_cache = PrefixCache(int(prompt_cache_mb * 1024 * 1024)) if prompt_cache_mb > 0 else None
+        self.prefill_tokens_reused = 0
+
+    def apply_chat_template(self, messages):
+        raise NotImplementedError
+
+    def count_tokens(self, text):
+        raise NotImplementedError
+
+    def generate(self, prompt, max_tokens, verbose=False, prefixes=()):
+        start = time.perf_counter()
+        text = self._generate(prompt, max_tokens, verbose, prefixes)
+        self._record('generate', time.perf_counter() - start, self.count_tokens(prompt), self.count_tokens(text))
+        return text
+
+    def stream(self, prompt, max_tokens, prefixes=()):
+        """Yields text as it is decoded. Closing the generator stops decoding and frees the model."""
+        start = time.perf_counter()
+        first_token = None
+        parts = []
+        try:
+            for chunk in self._stream(prompt, max_tokens, prefixes):
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                parts.append(chunk)
+                yield chunk
+        finally:
+            self._record('stream', time.perf_counter() - start, self.count_tokens(prompt),
+                         self.count_tokens(''.join(parts)), first_token_seconds=first_token)
+
+    def score_choices(self, prompts, choices, prefix=None):
+        start = time.perf_counter()
+        scores = self._score_choices(prompts, choices, prefix)
+        prompt_tokens = sum(self.count_tokens(p) for p in prompts)
+        self._record('score', time.perf_counter() - start, prompt_tokens, 0, items=len(prompts))
+        return scores
+
+    def _generate(self, prompt, max_tokens, verbose, prefixes):
+        raise NotImplementedError
+
+    def _stream(self, prompt, max_tokens, prefixes):
+        raise NotImplementedError
+
+    def _score_choices(self, prompts, choices, prefix):
+        raise NotImplementedError
+
+    # Prefix KV reuse. Backends that support it implement _tokens, _prefill,
+    # _copy_kv and _kv_nbytes, and call _cached_prefix with the model lock held.
+
+    def _tokens(self, text):
+        """Token ids exactly as the backend encodes a full prompt."""
+        raise NotImplementedError
+
+    def _prefill(self, tokens, kv):
+        """Runs tokens through the model on top of kv (None = empty) and returns the extended state."""
+        raise NotImplementedError
+
+    def _copy_kv(self, kv):
+        return copy.deepcopy(kv)
+
+    def _kv_nbytes(self, kv):
+        raise NotImplementedError
+
+    def _cached_prefix(self, tokens, prefixes, copy_kv=True):
+        """
+        KV state for the longest of `prefixes` that the prompt tokens start
+        with, prefilling and caching any that are missing (each on top of the
+        previous one). Returns (kv, n_tokens), or (None, 0) if nothing applies.
+        The returned kv is a copy unless copy_kv=False, so callers may extend it.
+        """
+        if self.prompt_cache is None:
+            return None, 0
+        kv, n = None, 0
+        for text in sorted(prefixes, key=len):
+            prefix_tokens = self._tokens(text)
+            m = len(prefix_tokens)
+            # The prompt must continue past the prefix, and token boundaries must line up
+            if m <= n or m >= len(tokens) or tokens[:m] != prefix_tokens:
+                continue
+            key = tuple(prefix_tokens)
+            cached = self.prompt_cache.get(key)
+            if cached is None:
+                base = self._copy_kv(kv) if kv is not None else None
+                cached = self._prefill(prefix_tokens[n:], base)
+                self.prompt_cache.put(key, cached, self._kv_nbytes(cached))
+            kv, n = cached, m
+        if kv is None:
+            return None, 0
+        return (self._copy_kv(kv) if copy_kv else kv), n
+
+    def _batch_prefix(self, token_lists, prefix):
+        """Cached KV (not copied) for a prefix every prompt in the batch starts with, or (None, 0)."""
+        kv, n = self._cached_prefix(token_lists[0], [prefix], copy_kv=False)
+        if kv is None or any(len(t) <= n or t[:n] != token_lists[0][:n] for t in token_lists):
+            return None, 0
+        self.prefill_tokens_reused += n * len(token_lists)
+        return kv, n
+
+    def _record(self, op, seconds, prompt_tokens, generated_tokens, items=1, first_token_seconds=None):
+        with self._stats_lock:
+            s = self._stats.setdefault(op, {'calls': 0, 'items': 0, 'seconds': 0.0, 'prompt_tokens': 0, 'generated_tokens': 0})
+            s['calls'] += 1
+            s['items'] += items
+            s['seconds'] += seconds
+            s['prompt_tokens'] += prompt_tokens
+            s['generated_tokens'] += generated_tokens
+            if first_token_seconds is not None:
+                s['first_token_seconds'] = s.get('first_token_seconds', 0.0) + first_token_seconds
+
+    def stats(self):
+        """Totals per operation plus average latency and throughput."""
+        with self._stats_lock:
+            out = {}
+            for op, s in self._stats.items():
+                seconds = s['seconds'] or 1e-9
+                out[op] = dict(
+                    s,
+                    avg_latency_ms=1000 * s['seconds'] / s['calls'],
+                    prompt_tokens_per_sec=s['prompt_tokens'] / seconds,
+                    generated_tokens_per_sec=s['generated_tokens'] / seconds,
+                )
+                if 'first_token_seconds' in s:
+                    out[op]['avg_first_token_ms'] = 1000 * s['first_token_seconds'] / s['calls']
+            prompt_cache = self.prompt_cache.stats() if self.prompt_cache is not None else None
+            if prompt_cache is not None:
+                prompt_cache['prefill_tokens_reused'] = self.prefill_tokens_reused
+            return {'backend': type(self).__name__, 'model_id': self.model_id, 'ops': out, 'prompt_cache': prompt_cache}
+
+
+class MLXBackend(InferenceBackend):
+    def __init__(self, model_id=DEFAULT_MLX_MODEL, batch_size=8, prompt_cache_mb=None):
+        from mlx_lm import load
+        super().__init__(prompt_cache_mb)
+        self.model_id = model_id
+        self.batch_size = batch_size
+        print("DEBUG: Calling load()...")
+        self.model, self.tokenizer = load(model_id)
+        # One model instance can't decode two prompts at once
+        self._lock = threading.Lock()
+
+    def apply_chat_template(self, messages):
+        return self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+
+    def count_tokens(self, text):
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def _prompt_and_cache(self, prompt, prefixes):
+        """What to hand mlx_lm: the prompt, or only its uncached remainder plus the prompt_cache to continue from."""
+        tokens = self._encode(prompt)
+        kv, n = self._cached_prefix(tokens, prefixes) if prefixes else (None, 0)
+        if kv is None:
+            return prompt, {}
+        self.prefill_tokens_reused += n
+        return tokens[n:], {'prompt_cache': kv}
+
+    def _generate(self, prompt, max_tokens, verbose, prefixes):
+        from mlx_lm import generate
+        with self._lock:
+            prompt, kwargs = self._prompt_and_cache(prompt, prefixes)
+            return generate(self.model, self.tokenizer, prompt=prompt, verbose=verbose, max_tokens=max_tokens, **kwargs)
+
+    def _stream(self, prompt, max_tokens, prefixes):
+        from mlx_lm import stream_generate
+        with self._lock:
+            prompt, kwargs = self._prompt_and_cache(prompt, prefixes)
+            for response in stream_generate(self.model, self.tokenizer, prompt, max_tokens=max_tokens, **kwargs):
+                # Older mlx_lm versions yield plain strings
+                text = getattr(response, 'text', response)
+                if text:
+                    yield text
+
+    def _encode(self, text):
+        # Mirrors mlx_lm.generate: chat templates already carry the BOS token
+        bos = self.tokenizer.bos_token
+        add_special_tokens = bos is None or not text.startswith(bos)
+        return self.tokenizer.encode(text, add_special_tokens=add_special_tokens)
+
+    def _tokens(self, text):
+        return self._encode(text)
+
+    def _prefill(self, tokens, kv):
+        import mlx.core as mx
+        from mlx_lm.models.cache import make_prompt_cache
+        if kv is None:
+            kv = make_prompt_cache(self.model)
+        self.model(mx.array(tokens)[None], cache=kv)
+        mx.eval([layer.state for layer in kv])
+        return kv
+
+    def _kv_nbytes(self, kv):
+        return sum(array.nbytes for layer in kv for array in layer.state)
+
+    def _pad_id(self):
+        pad_id = self.tokenizer.pad_token_id
+        return self.tokenizer.eos_token_id if pad_id is None else pad_id
+
+    def _score_choices(self, prompts, choices, prefix):
+        import mlx.core as mx
+
+        choice_ids = [choice_token_ids(lambda w: self.tokenizer.encode(w, add_special_tokens=False), c) for c in choices]
+
+        results = []
+        for start in range(0, len(prompts), self.batch_size):
+            token_lists = [self._encode(p) for p in prompts[start:start + self.batch_size]]
+            with self._lock:
+                kv, n = self._batch_prefix(token_lists, prefix) if prefix else (None, 0)
+                if kv is not None:
+                    logits = self._logits_after_prefix(token_lists, kv, n)
+                else:
+                    logits = self._logits_padded(token_lists)
+                mx.eval(logits)
+
+            rows = logits.tolist()
+            for row in rows:
+                results.append([logsumexp([row[i] for i in ids]) for ids in choice_ids])
+        return results
+
+    def _logits_padded(self, token_lists):
+        import mlx.core as mx
+
+        lengths = [len(t) for t in token_lists]
+        L = max(lengths)
+
+        # Left-pad so every prompt's last token sits in the final column
+        tokens = mx.array([[self._pad_id()] * (L - n) + t for t, n in zip(token_lists, lengths)])
+
+        # Boolean mask (B, 1, L, L), True = may attend: causal, and never to padding.
+        # Pad positions attend to themselves so their rows stay finite.
+        pos = mx.arange(L)
+        causal = pos[None, :] <= pos[:, None]
+        starts = mx.array([L - n for n in lengths])
+        key_valid = pos[None, :] >= starts[:, None]
+        mask = (causal[None, :, :] & key_valid[:, None, :]) | (pos[None, :] == pos[:, None])[None]
+        mask = mask[:, None, :, :]
+
+        return self.model(tokens, mask=mask)[:, -1, :].astype(mx.float32)
+
+    def _logits_after_prefix(self, token_lists, kv, n):
+        """Last-token logits when every prompt starts with the same n cached tokens: only the suffixes are run."""
+        import mlx.core as mx
+        from mlx_lm.models.cache import make_prompt_cache
+
+        B = len(token_lists)
+        suffixes = [t[n:] for t in token_lists]
+        lengths = [len(s) for s in suffixes]
+        L = max(lengths)
+        # Right-pad: under causal attention, padding after a prompt's last token can't affect it
+        tokens = mx.array([s + [self._pad_id()] * (L - len(s)) for s in suffixes])
+
+        cache = make_prompt_cache(self.model)
+        for layer, shared in zip(cache, kv):
+            keys, values = shared.state
+            layer.state = (mx.repeat(keys, B, axis=0), mx.repeat(values, B, axis=0))
+
+        logits = self.model(tokens, cache=cache)
+        return logits[mx.arange(B), mx.array(lengths) - 1].astype(mx.float32)
+
+
+class TransformersBackend(InferenceBackend):
+    def __init__(self, model_id=DEFAULT_TRANSFORMERS_MODEL, device="cpu", batch_size=8, prompt_cache_mb=None):
+        super().__init__(prompt_cache_mb)
+        try:
+            import torch
+            from transformers import AutoModelForCausalLM, AutoTokenizer
+        except ImportError as e:
+            raise ImportError("TransformersBackend needs `pip install torch transformers`") from e
+
+        self.torch = torch
+        self.model_id = model_id
+        self.device = device
+        self.batch_size = batch_size
+        self.tokenizer = AutoTokenizer.from_pretrained(model_id)
+        # Left padding keeps each prompt's last token in the final position
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.model = AutoModelForCausalLM.from_pretrained(model_id, torch_dtype=torch.float32).to(device)
+        self.model.eval()
+        self._lock = threading.Lock()
+
+    def apply_chat_template(self, messages):
+        return self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+
+    def count_tokens(self, text):
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def _inputs(self, prompt, prefixes):
+        """generate() kwargs for the prompt, plus the prefilled past_key_values of its longest cached prefix."""
+        inputs = self.tokenizer(prompt, return_tensors="pt", add_special_tokens=False).to(self.device)
+        if prefixes:
+            kv, n = self._cached_prefix(inputs["input_ids"][0].tolist(), prefixes)
+            if kv is not None:
+                self.prefill_tokens_reused += n
+                # generate() only prefills the input ids the cache doesn't cover yet
+                inputs["past_key_values"] = kv
+        return inputs
+
+    def _generate(self, prompt, max_tokens, verbose, prefixes):
+        with self._lock, self.torch.no_grad():
+            inputs = self._inputs(prompt, prefixes)
+            output = self.model.generate(**inputs, max_new_tokens=max_tokens, do_sample=False)
+        text = self.tokenizer.decode(output[0, inputs["input_ids"].shape[1]:], skip_special_tokens=True)
+        if verbose:
+            print(text)
+        return text
+
+    def _stream(self, prompt, max_tokens, prefixes):
+        from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+
+        torch = self.torch
+        stop = threading.Event()
+        errors = []
+
+        class _Stop(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs):
+                return torch.full((input_ids.shape[0],), stop.is_set(), dtype=torch.bool, device=input_ids.device)
+
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+
+        def run():
+            try:
+                with self._lock, torch.no_grad():
+                    inputs = self._inputs(prompt, prefixes)
+                    self.model.generate(**inputs, max_new_tokens=max_tokens, do_sample=False, streamer=streamer,
+                                        stopping_criteria=StoppingCriteriaList([_Stop()]))
+            except Exception as e:
+                errors.append(e)
+                streamer.end()
+
+        # generate() blocks, so it decodes on its own thread and hands text over through the streamer
+        worker = threading.Thread(target=run, daemon=True)
+        worker.start()
+        try:
+            for text in streamer:
+                if text:
+                    yield text
+        finally:
+            stop.set()
+            worker.join()
+        if errors:
+            raise errors[0]
+
+    def _tokens(self, text):
+        return self.tokenizer.encode(text, add_special_tokens=False)
+
+    def _prefill(self, tokens, kv):
+        from transformers import DynamicCache
+        ids = self.torch.tensor([tokens], device=self.device)
+        with self.torch.no_grad():
+            out = self.model(input_ids=ids, past_key_values=kv if kv is not None else DynamicCache(), use_cache=True)
+        return out.past_key_values
+
+    def _kv_nbytes(self, kv):
+        layers = getattr(kv, 'layers', None)
+        if layers is not None:
+            tensors = [t for layer in layers for t in (layer.keys, layer.values)]
+        else:
+            tensors = list(kv.key_cache) + list(kv.value_cache)
+        return sum(t.numel() * t.element_size() for t in tensors if t is not None)
+
+    def _score_choices(self, prompts, choices, prefix):
+        choice_ids = [choice_token_ids(lambda w: self.tokenizer.encode(w, add_special_tokens=False), c) for c in choices]
+
+        results = []
+        for start in range(0, len(prompts), self.batch_size):
+            batch_prompts = prompts[start:start + self.batch_size]
+            with self._lock, self.torch.no_grad():
+                kv, n = None, 0
+                if prefix:
+                    token_lists = [self._tokens(p) for p in batch_prompts]
+                    kv, n = self._batch_prefix(token_lists, prefix)
+                if kv is not None:
+                    logits = self._logits_after_prefix(token_lists, kv, n)
+                else:
+                    logits = self._logits_padded(batch_prompts)
+            for row in logits.tolist():
+                results.append([logsumexp([row[i] for i in ids]) for ids in choice_ids])
+        return results
+
+    def _logits_padded(self, batch_prompts):
+        batch = self.tokenizer(batch_prompts, return_tensors="pt", padding=True, add_special_tokens=False).to(self.device)
+        # Positions restart at 0 after the left padding, as in generate()
+        position_ids = (batch["attention_mask"].cumsum(-1) - 1).clamp(min=0)
+        return self.model(**batch, position_ids=position_ids).logits[:, -1, :].float()
+
+    def _logits_after_prefix(self, token_lists, kv, n):
+        """Last-token logits when every prompt starts with the same n cached tokens: only the suffixes are run."""
+        torch = self.torch
+        B = len(token_lists)
+        suffixes = [t[n:] for t in token_lists]
+        lengths = torch.tensor([len(s) for s in suffixes])
+        L = int(lengths.max())
+        # Right-pad: under causal attention, padding after a prompt's last token can't affect it
+        pad_id = self.tokenizer.pad_token_id
+        ids = torch.tensor([s + [pad_id] * (L - len(s)) for s in suffixes], device=self.device)
+        suffix_mask = (torch.arange(L)[None, :] < lengths[:, None]).long()
+        attention_mask = torch.cat([torch.ones(B, n, dtype=torch.long), suffix_mask], dim=1).to(self.device)
+        position_ids = (n + torch.arange(L, device=self.device)).expand(B, L)
+
+        kv = self._copy_kv(kv)
+        kv.batch_repeat_interleave(B)
+        logits = self.model(input_ids=ids, attention_mask=attention_mask, position_ids=position_ids,
+                            past_key_values=kv, use_cache=True).logits
+        return logits[torch.arange(B, device=self.device), (lengths - 1).to(self.device)].float()
+
+
+class FakeBackend(InferenceBackend):
+    """
+    Deterministic, model-free backend. A "token" is a whitespace-separated word.
+    generate() returns `reply` if given, otherwise text derived from a hash of
+    the prompt; score_choices() prefers the first choice when the prompt
+    mentions any of `positive_words`. seconds_per_token simulates decode cost
+    and seconds_per_prefill_token the cost of uncached prompt tokens.
+    """
+    def __init__(self, model_id=DEFAULT_FAKE_MODEL, reply=None, positive_words=("job", "intern", "research", "application", "interview"),
+                 seconds_per_token=0.0, seconds_per_prefill_token=0.0, prompt_cache_mb=None):
+        super().__init__(prompt_cache_mb)
+        self.model_id = model_id
+        self.reply = reply
+        self.positive_words = positive_words
+        self.seconds_per_token = seconds_per_token
+        self.seconds_per_prefill_token = seconds_per_prefill_token
+        self._lock = threading.Lock()
+
+    def apply_chat_template(self, messages):
+        return "".join(f"<|{m['role']}|>\n{m['content']}\n" for m in messages) + "<|assistant|>\n"
+
+    def count_tokens(self, text):
+        return len(text.split())
+
+    def _tokens(self, text):
+        return text.split()
+
+    def _prefill(self, tokens, kv):
+        if self.seconds_per_prefill_token:
+            time.sleep(self.seconds_per_prefill_token * len(tokens))
+        return (kv or ()) + tuple(tokens)
+
+    def _kv_nbytes(self, kv):
+        return 8 * len(kv)
+
+    def _words(self, prompt, max_tokens):
+        text = self.reply
+        if text is None:
+            digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+            text = f"Hi, I wanted to follow up on my previous email. Reference {digest[:8]}. Best regards"
+        return text.split(' ')[:max_tokens]
+
+    def _generate(self, prompt, max_tokens, verbose, prefixes):
+        text = ''.join(self._stream(prompt, max_tokens, prefixes))
+        if verbose:
+            print(text)
+        return text
+
+    def _stream(self, prompt, max_tokens, prefixes):
+        with self._lock:
+            tokens = self._tokens(prompt)
+            kv, n = self._cached_prefix(tokens, prefixes) if prefixes else (None, 0)
+            self.prefill_tokens_reused += n
+            self._prefill(tokens[n:], kv)
+            for i, word in enumerate(self._words(prompt, max_tokens)):
+                if self.seconds_per_token:
+                    time.sleep(self.seconds_per_token)
+                yield word if i == 0 else ' ' + word
+
+    def _score_choices(self, prompts, choices, prefix):
+        with self._lock:
+            token_lists = [self._tokens(p) for p in prompts]
+            kv, n = self._batch_prefix(token_lists, prefix) if prefix else (None, 0)
+            for tokens in token_lists:
+                self._prefill(tokens[n:], kv)
+        if self.seconds_per_token:
+            time.sleep(self.seconds_per_token * len(prompts))
+        results = []
+        for prompt in prompts:
+            lowered = prompt.lower()
+            first = 2.0 if any(w in lowered for w in self.positive_words) else -2.0
+            results.append([first] + [0.0] * (len(choices) - 1))
+        return results
+
+
+BACKENDS = {
+    "mlx": MLXBackend,
+    "transformers": TransformersBackend,
+    "fake": FakeBackend,
+}
+
+DEFAULT_MODELS = {
+    "mlx": DEFAULT_MLX_MODEL,
+    "transformers": DEFAULT_TRANSFORMERS_MODEL,
+    "fake": DEFAULT_FAKE_MODEL,
+}
+
+
+def configured_model_id(name=None, model_id=None):
+    """The model create_backend(name, model_id) would load, without loading it."""
+    name = name or os.environ.get('MAUTO_BACKEND', 'mlx')
+    model_id = model_id or os.environ.get('MAUTO_MODEL_ID')
+    if model_id:
+        return model_id
+    return DEFAULT_MODELS.get(name)
+
+
+def create_backend(name=None, model_id=None, **kwargs):
+    """Builds a backend by name; defaults come from MAUTO_BACKEND / MAUTO_MODEL_ID (else MLX)."""
+    name = name or os.environ.get('MAUTO_BACKEND', 'mlx')
+    model_id = model_id or os.environ.get('MAUTO_MODEL_ID')
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend '{name}'. Choose from: {', '.join(BACKENDS)}")
+    if model_id:
+        kwargs['model_id'] = model_id
+    return BACKENDS[name](**kwargs)
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+
+def content_key(*parts):
+    """Stable hash of the inputs that determine a cached result."""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(str(part if part is not None else '').encode('utf-8'))
+        h.update(b'\x1f')
+    return h.hexdigest()
+
+
+class ClassificationCache:
+    """
+    Persistent relevance decisions, keyed by a hash of subject + snippet +
+    model id + prompt version (classification_cache table). A new model or
+    prompt version simply misses, so only the affected entries are redone.
+    New entries are buffered and written in batches; call flush() when done.
+    """
+    def __init__(self, db, model_id, prompt_version, flush_size=50):
+        self.db = db
+        self.model_id = model_id
+        self.prompt_version = prompt_version
+        self.flush_size = flush_size
+        self.hits = 0
+        self.misses = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def key(self, subject, snippet):
+        return content_key(subject, snippet, self.model_id, self.prompt_version)
+
+    def get(self, subject, snippet):
+        """Returns the cached (is_job, probability), or None on a miss."""
+        key = self.key(subject, snippet)
+        with self._lock:
+            entry = self._pending.get(key)
+        if entry is None:
+            row = self.db.query_one('SELECT is_job_related, probability FROM classification_cache WHERE key = ?', (key,))
+            if row is not None:
+                entry = (row['is_job_related'], row['probability'])
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return bool(entry[0]), entry[1]
+
+    def put(self, subject, snippet, is_job, probability=None):
+        with self._lock:
+            self._pending[self.key(subject, snippet)] = (1 if is_job else 0, probability)
+            full = len(self._pending) >= self.flush_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if pending:
+            self.db.executemany('''
+                INSERT OR REPLACE INTO classification_cache (key, is_job_related, probability, model_id, prompt_version)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [(key, is_job, probability, self.model_id, self.prompt_version)
+                  for key, (is_job, probability) in pending.items()])
+
+    def prune(self):
+        """Deletes entries made by other models or prompt versions. Returns how many were removed."""
+        return self.db.execute(
+            'DELETE FROM classification_cache WHERE model_id IS NOT ? OR prompt_version IS NOT ?',
+            (self.model_id, self.prompt_version)
+        )
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0}
+
+
+class DraftCache:
+    """
+    Persistent follow-up drafts (draft_cache table), keyed by a hash of
+    everything that determines the output: email id, thread version, context,
+    model id, prompt version and generation parameters, so any change simply
+    misses. Entries unused for max_age_days, and the least recently used ones
+    beyond max_bytes, are evicted by prune(), which put() runs every
+    prune_every writes.
+    """
+    def __init__(self, db, max_bytes=20 * 1024 * 1024, max_age_days=30, prune_every=50):
+        self.db = db
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.prune_every = prune_every
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def key(self, email_id, thread_version, context, model_id, prompt_version, params):
+        return content_key(email_id, thread_version, context, model_id, prompt_version,
+                           json.dumps(params, sort_keys=True))
+
+    def get(self, key):
+        """Returns the cached draft, or None on a miss."""
+        row = self.db.query_one('SELECT draft FROM draft_cache WHERE key = ?', (key,))
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self.db.execute('UPDATE draft_cache SET last_used = CURRENT_TIMESTAMP WHERE key = ?', (key,))
+        return row['draft']
+
+    def contains(self, key):
+        """Whether a draft is cached, without counting a hit or miss."""
+        return self.db.query_one('SELECT 1 FROM draft_cache WHERE key = ?', (key,)) is not None
+
+    def put(self, key, email_id, draft, model_id=None, prompt_version=None):
+        self.db.execute('''
+            INSERT OR REPLACE INTO draft_cache (key, email_id, draft, model_id, prompt_version, size)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (key, email_id, draft, model_id, prompt_version, len(draft.encode('utf-8'))))
+        with self._lock:
+            self._writes += 1
+            due = self._writes % self.prune_every == 0
+        if due:
+            self.prune()
+
+    def prune(self):
+        """Evicts stale entries, then the least recently used ones over max_bytes. Returns how many were removed."""
+        removed = self.db.execute(
+            "DELETE FROM draft_cache WHERE last_used < datetime('now', ?)", (f'-{self.max_age_days} days',)
+        )
+        removed += self.db.execute('''
+            DELETE FROM draft_cache WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, SUM(size) OVER (ORDER BY last_used DESC, key) AS running FROM draft_cache
+                ) WHERE running > ?
+            )
+        ''', (self.max_bytes,))
+        return removed
+
+    def stats(self):
+        total = self.hits + self.misses
+        row = self.db.query_one('SELECT COUNT(*) AS entries, COALESCE(SUM(size), 0) AS bytes FROM draft_cache')
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0,
+                'entries': row['entries'], 'bytes': row['bytes']}
+
+
+class PrefixCache:
+    """
+    In-memory LRU of model KV states for prompt prefixes, bounded by a byte
+    budget. Keys are the prefix token ids; values are whatever state object
+    the backend prefilled, together with its size in bytes.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, state, nbytes):
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._entries[key] = (state, nbytes)
+            self.bytes += nbytes
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.bytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
@@ -0,0 +1,100 @@
+"""
+Temperature scaling of the LLM's job probability.
+
+AIEngine turns the YES-NO logit margin of the classification prompt into
+sigmoid(margin / T). Until T is fitted it is 1.0, i.e. the raw two-token
+softmax, which is usually over-confident. fit_temperature picks the T with
+the lowest log loss on the labels the user corrected (the only labels the
+LLM didn't produce itself), and it is stored per model in calibration.json
+(MAUTO_CALIBRATION_FILE), where AIEngine picks it up.
+MAUTO_CALIBRATION_TEMPERATURE overrides the stored value.
+
+Usage:
+    python -m src.calibration        # fit on the DB's corrections and save
+"""
+import datetime
+import json
+import os
+
+import numpy as np
+
+DEFAULT_CALIBRATION_PATH = 'calibration.json'
+MIN_CALIBRATION_EXAMPLES = 30
+MIN_EXAMPLES_PER_CLASS = 5
+# Candidate temperatures, log-spaced
+_TEMPERATURES = np.exp(np.linspace(np.log(0.05), np.log(20.0), 600))
+
+
+def default_calibration_path():
+    return os.environ.get('MAUTO_CALIBRATION_FILE', DEFAULT_CALIBRATION_PATH)
+
+
+def load_temperature(model_id, path=None):
+    """The temperature to use for model_id: MAUTO_CALIBRATION_TEMPERATURE, else the fitted one, else None."""
+    if os.environ.get('MAUTO_CALIBRATION_TEMPERATURE'):
+        return float(os.environ['MAUTO_CALIBRATION_TEMPERATURE'])
+    try:
+        with open(path or default_calibration_path()) as f:
+            entry = json.load(f).get(model_id)
+    except (FileNotFoundError, ValueError):
+        return None
+    return float(entry['temperature']) if entry else None
+
+
+def save_temperature(model_id, temperature, examples, path=None):
+    path = path or default_calibration_path()
+    try:
+        with open(path) as f:
+            fitted = json.load(f)
+    except (FileNotFoundError, ValueError):
+        fitted = {}
+    fitted[model_id] = {'temperature': temperature, 'examples': examples,
+                        'fitted_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')}
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(fitted, f, indent=2)
+    os.replace(tmp, path)
+
+
+def log_loss(margins, labels, temperature):
+    """Mean negative log-likelihood of labels (1/0) under sigmoid(margin / temperature)."""
+    signed = np.where(np.asarray(labels) == 1, 1.0, -1.0) * np.asarray(margins, dtype=np.float64)
+    return float(np.mean(np.logaddexp(0.0, -signed / temperature)))
+
+
+def fit_temperature(margins, labels):
+    """The temperature (from a log-spaced grid of 0.05..20) with the lowest log loss."""
+    signed = np.where(np.asarray(labels) == 1, 1.0, -1.0) * np.asarray(margins, dtype=np.float64)
+    losses = np.logaddexp(0.0, -signed[None, :] / _TEMPERATURES[:, None]).mean(axis=1)
+    return float(_TEMPERATURES[np.argmin(losses)])
+
+
+def calibrate(ai, db, path=None):
+    """
+    Scores the user-corrected emails with ai (an AIEngine), fits the
+    temperature, saves it and applies it to ai. Returns the temperature, or
+    None when there aren't enough corrections of both classes yet.
+    """
+    rows = [r for r in db.get_relevance_training_rows() if r['corrected']]
+    labels = [1 if r['is_job_related'] else 0 for r in rows]
+    positives = sum(labels)
+    if len(rows) < MIN_CALIBRATION_EXAMPLES or min(positives, len(rows) - positives) < MIN_EXAMPLES_PER_CLASS:
+        print(f"Not enough corrected labels to calibrate yet ({len(rows)}, {positives} job-related); "
+              f"job probabilities stay uncalibrated (T={ai.calibration_temperature}).")
+        return None
+    items = [(r['subject'] or '', r['snippet'] or '') for r in rows]
+    margins = []
+    for start in range(0, len(items), 16):
+        margins += ai.score_margins(items[start:start + 16])
+    temperature = fit_temperature(margins, labels)
+    print(f"Calibrated on {len(rows)} corrections: T={temperature:.3f}, log loss "
+          f"{log_loss(margins, labels, ai.calibration_temperature):.4f} -> {log_loss(margins, labels, temperature):.4f}")
+    save_temperature(ai.model_id, temperature, len(rows), path)
+    ai.calibration_temperature = temperature
+    return temperature
+
+
+if __name__ == "__main__":
+    from src.ai_engine import AIEngine
+    from src.database import DatabaseManager
+    calibrate(AIEngine(), DatabaseManager())
@@ -0,0 +1,119 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+from src.cache import content_key
+from src.prompts import FOLLOW_UP_TEMPLATE
+
+DEFAULT_THREAD_TOKENS = 1500
+
+# Where a quoted earlier message starts; everything from here on is a duplicate of the thread
+_QUOTE_START_RE = re.compile(
+    r'^(?:'
+    r'On\b.{0,300}?\bwrote:\s*$'                           # Gmail / Apple Mail
+    r'|-{2,}\s*Original Message\s*-{2,}'                    # Outlook (plain)
+    r'|From:\s.+\n(?:.+\n){0,3}?(?:Sent|Date):\s'           # Outlook header block
+    r'|_{10,}\s*$'                                          # Outlook separator line
+    r')',
+    re.MULTILINE | re.IGNORECASE,
+)
+
+# Where a signature starts: the "-- " delimiter or a mobile footer
+_SIGNATURE_START_RE = re.compile(
+    r'^(?:--\s*$|Sent from my \w+|Get Outlook for \w+)',
+    re.MULTILINE | re.IGNORECASE,
+)
+
+# Changes whenever the draft prompt or the thread rendering changes (part of DraftCache keys)
+DRAFT_PROMPT_VERSION = hashlib.sha256(
+    (FOLLOW_UP_TEMPLATE + _QUOTE_START_RE.pattern + _SIGNATURE_START_RE.pattern).encode('utf-8')
+).hexdigest()[:12]
+
+
+def thread_version(thread):
+    """Hash of a thread's messages; changes when a message is added, removed or edited."""
+    return content_key(*(f"{m['id']}\x1e{m.get('date')}\x1e{m.get('body_text')}" for m in thread))
+
+
+def clean_body(text):
+    """Drops quoted replies, '>' lines and the signature, and squeezes blank lines."""
+    text = (text or '').replace('\r\n', '\n')
+    match = _QUOTE_START_RE.search(text)
+    if match:
+        text = text[:match.start()]
+    match = _SIGNATURE_START_RE.search(text)
+    if match:
+        text = text[:match.start()]
+    lines = [line.rstrip() for line in text.split('\n') if not line.lstrip().startswith('>')]
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip()
+
+
+class ThreadContextBuilder:
+    """
+    Turns a thread into the text a follow-up draft is conditioned on: every
+    message newest first, with quotes and signatures stripped, cut to fit
+    max_tokens as measured by count_tokens (the model's tokenizer).
+    Results are memoized per thread and rebuilt when its messages change.
+    """
+    def __init__(self, count_tokens, max_tokens=DEFAULT_THREAD_TOKENS, max_threads=256):
+        self.count_tokens = count_tokens
+        self.max_tokens = max_tokens
+        self.max_threads = max_threads
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+
+    def build(self, thread):
+        """thread: message dicts from the DB (e.g. DatabaseManager.get_thread)."""
+        thread_id = thread[0].get('thread_id') or thread[0]['id']
+        version = thread_version(thread)
+        with self._lock:
+            memo = self._memo.get(thread_id)
+            if memo is not None and memo[0] == version:
+                self._memo.move_to_end(thread_id)
+                return memo[1]
+
+        text = self._build(thread)
+        with self._lock:
+            self._memo[thread_id] = (version, text)
+            self._memo.move_to_end(thread_id)
+            while len(self._memo) > self.max_threads:
+                self._memo.popitem(last=False)
+        return text
+
+    def _build(self, thread):
+        newest_first = sorted(thread, key=lambda m: (m.get('date') or '', m['id']), reverse=True)
+        parts = []
+        remaining = self.max_tokens
+        for message in newest_first:
+            header = (f"From: {message.get('sender')}\nTo: {message.get('recipients_to')}\n"
+                      f"Date: {message.get('date')}\nSubject: {message.get('subject')}\n")
+            body = clean_body(message.get('body_text')) or message.get('snippet') or ''
+            part = f"{header}\n{body}"
+            cost = self.count_tokens(part) + 2
+            if cost <= remaining:
+                parts.append(part)
+                remaining -= cost
+                continue
+            # Doesn't fit whole: keep the start of this message, then stop (older ones matter less)
+            body_budget = remaining - self.count_tokens(header) - 4
+            if body_budget > 0:
+                parts.append(f"{header}\n{self._truncate(body, body_budget)} [...]")
+            break
+        return "\n\n---\n\n".join(parts)
+
+    def _truncate(self, text, max_tokens):
+        """Longest word prefix of text within max_tokens (binary search over the word count)."""
+        words = text.split(' ')
+        lo, hi = 0, len(words)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if self.count_tokens(' '.join(words[:mid])) <= max_tokens:
+                lo = mid
+            else:
+                hi = mid - 1
+        return ' '.join(words[:lo])
+
+    def invalidate(self, thread_id):
+        with self._lock:
+            self._memo.pop(thread_id, None)
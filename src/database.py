@@ -1,14 +1,495 @@
 import sqlite3
+import datetime
+import html
 import json
+import re
 import os
+import threading
+import zlib
+from src.sanitize import sanitize_html
+from src.search import plan_match_query
+from src.cache import content_key
+
+# Columns written by sync, in the order _email_row produces them
+EMAIL_COLUMNS = [
+    'id', 'thread_id', 'date', 'sender',
+    'recipients_to', 'recipients_cc', 'recipients_bcc',
+    'subject', 'snippet', 'is_job_related', 'job_probability', 'body_state', 'label_source',
+]
+
+
+def _upsert_sql(updatable):
+    """Upsert that leaves unchanged rows (and columns not in `updatable`) alone."""
+    return f'''
+    INSERT INTO emails ({', '.join(EMAIL_COLUMNS)})
+    VALUES ({', '.join('?' * len(EMAIL_COLUMNS))})
+    ON CONFLICT(id) DO UPDATE SET
+        {', '.join(f'{col} = excluded.{col}' for col in updatable)},
+        last_synced = CURRENT_TIMESTAMP
+    WHERE {' OR '.join(f'{col} IS NOT excluded.{col}' for col in updatable)}
+'''
+
+
+UPSERT_EMAIL_SQL = _upsert_sql([col for col in EMAIL_COLUMNS if col != 'id'])
+
+# A metadata-only row never downgrades body_state (its body stays in email_bodies)
+UPSERT_METADATA_SQL = _upsert_sql([col for col in EMAIL_COLUMNS if col not in ('id', 'body_state')])
+
+# Bodies live in email_bodies, zlib-compressed. Each statement is a no-op when its
+# condition fails, so (update, insert) together write a row once and skip unchanged ones.
+UPDATE_BODY_SQL = '''
+    UPDATE email_bodies SET body_text = ?1, body_html = ?2, attachments = ?3
+    WHERE email_id = ?4 AND (body_text IS NOT ?1 OR body_html IS NOT ?2 OR attachments IS NOT ?3)
+'''
+INSERT_BODY_SQL = '''
+    INSERT INTO email_bodies (body_text, body_html, attachments, email_id)
+    SELECT ?1, ?2, ?3, ?4 WHERE NOT EXISTS (SELECT 1 FROM email_bodies WHERE email_id = ?4)
+'''
+
+
+_TAG_RE = re.compile(r'<[^>]*>')
+
+
+def _to_json(obj):
+    # Helper to safely serialize JSON
+    return json.dumps(obj) if obj is not None else '[]'
+
+
+def _email_row(email_data):
+    return (
+        email_data.get('id'),
+        email_data.get('threadId'),
+        email_data.get('date'),
+        email_data.get('sender'),
+        _to_json(email_data.get('to', [])),
+        _to_json(email_data.get('cc', [])),
+        _to_json(email_data.get('bcc', [])),
+        email_data.get('subject'),
+        email_data.get('snippet', ''),
+        email_data.get('is_job_related', 0),
+        email_data.get('job_probability'),
+        email_data.get('body_state', 'full'),
+        email_data.get('label_source'),
+    )
+
+
+def _body_row(email_data):
+    """(body_text, body_html, attachments, id) for email_bodies. body_html is already sanitized (parse_message)."""
+    return (
+        _deflate(email_data.get('body_text', '')),
+        _deflate(email_data.get('body_html', '')),
+        _to_json(email_data.get('attachments', [])),
+        email_data.get('id'),
+    )
+
+
+def _deflate(text):
+    return zlib.compress(text.encode('utf-8'), 6) if text else None
+
+
+def _inflate(blob):
+    return zlib.decompress(blob).decode('utf-8') if blob else ''
+
+
+def _register_functions(conn):
+    # inflate() is used by the FTS content view, so every connection needs it
+    conn.create_function('inflate', 1, _inflate, deterministic=True)
+    conn.create_function('deflate', 1, _deflate, deterministic=True)
+    conn.create_function('sanitize_html', 1, sanitize_html, deterministic=True)
+
+
+# Applied to every pooled connection. WAL itself is persistent and set once in _init_db.
+CONNECTION_PRAGMAS = [
+    'PRAGMA synchronous=NORMAL',     # safe with WAL, avoids an fsync per commit
+    'PRAGMA cache_size=-16000',      # 16MB page cache per connection
+    'PRAGMA mmap_size=268435456',    # 256MB memory-mapped reads
+    'PRAGMA temp_store=MEMORY',
+]
+
+LIST_COLUMNS = 'id, subject, sender, date, snippet, thread_id, recipients_to, recipients_cc, recipients_bcc'
+
+# Everything but bodies; the detail view and drafts add the decompressed bodies
+THREAD_COLUMNS = ('e.id, e.thread_id, e.date, e.sender, e.recipients_to, e.recipients_cc, e.recipients_bcc, '
+                  'e.subject, e.snippet, e.is_job_related, e.job_probability, e.body_state')
+BODY_PROJECTION = ('inflate(b.body_text) AS body_text, inflate(b.body_html) AS body_html, '
+                   "COALESCE(b.attachments, '[]') AS attachments")
+
+THREAD_LIST_COLUMNS = ('thread_id, subject, last_email_id, recipients_to, is_job_related, last_date, last_sender, '
+                       'message_count, last_sent_date, last_inbound_date, awaiting_reply')
+
+LIST_EMAILS_SQL = f'''
+    SELECT {LIST_COLUMNS}
+    FROM emails
+    WHERE is_job_related = ?
+    ORDER BY date DESC, id DESC LIMIT ? OFFSET ?
+'''
+
+# Keyset pagination: seek straight to the row after the cursor instead of skipping OFFSET rows
+LIST_EMAILS_AFTER_SQL = f'''
+    SELECT {LIST_COLUMNS}
+    FROM emails
+    WHERE is_job_related = ? AND (date, id) < (?, ?)
+    ORDER BY date DESC, id DESC LIMIT ?
+'''
+
+
+# --- Schema migrations (append only; never reorder or edit an applied one) ---
+
+def _migration_list_index(conn):
+    """Covering index for the email list"""
+    # Leads with (is_job_related, date DESC, id DESC), so it also serves as the composite
+    # filter/sort index; the trailing columns let list pages be answered from the index alone.
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_emails_job_date
+        ON emails(is_job_related, date DESC, id DESC, subject, sender, snippet, thread_id,
+                  recipients_to, recipients_cc, recipients_bcc)
+    ''')
+
+
+FTS_COLUMNS = ['subject', 'sender', 'recipients_to', 'recipients_cc', 'recipients_bcc', 'body_text']
+
+
+def _migration_fts(conn):
+    """Full-text search index over subject, body and recipients"""
+    cols = ', '.join(FTS_COLUMNS)
+    new_cols = ', '.join(f'new.{c}' for c in FTS_COLUMNS)
+    old_cols = ', '.join(f'old.{c}' for c in FTS_COLUMNS)
+
+    # External-content table: the text lives in `emails`, FTS only stores the index
+    conn.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS emails_fts USING fts5(
+            {cols},
+            content='emails', content_rowid='rowid',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS emails_fts_ai AFTER INSERT ON emails BEGIN
+            INSERT INTO emails_fts(rowid, {cols}) VALUES (new.rowid, {new_cols});
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS emails_fts_ad AFTER DELETE ON emails BEGIN
+            INSERT INTO emails_fts(emails_fts, rowid, {cols}) VALUES ('delete', old.rowid, {old_cols});
+        END
+    ''')
+    # Only re-index when an indexed column changes (not e.g. is_job_related)
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS emails_fts_au AFTER UPDATE OF {cols} ON emails BEGIN
+            INSERT INTO emails_fts(emails_fts, rowid, {cols}) VALUES ('delete', old.rowid, {old_cols});
+            INSERT INTO emails_fts(rowid, {cols}) VALUES (new.rowid, {new_cols});
+        END
+    ''')
+    conn.execute("INSERT INTO emails_fts(emails_fts) VALUES ('rebuild')")
+
+
+def _migration_classification_cache(conn):
+    """Persistent classification cache"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS classification_cache (
+            key TEXT PRIMARY KEY,
+            is_job_related INTEGER NOT NULL,
+            model_id TEXT,
+            prompt_version TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_classification_version ON classification_cache(model_id, prompt_version)')
+
+
+def _migration_job_probability(conn):
+    """Store the LLM's calibrated job probability"""
+    # NULL when the keyword heuristic decided on its own
+    conn.execute('ALTER TABLE emails ADD COLUMN job_probability REAL')
+    conn.execute('ALTER TABLE classification_cache ADD COLUMN probability REAL')
+
+
+def _migration_draft_cache(conn):
+    """Persistent draft cache"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS draft_cache (
+            key TEXT PRIMARY KEY,
+            email_id TEXT NOT NULL,
+            draft TEXT NOT NULL,
+            model_id TEXT,
+            prompt_version TEXT,
+            size INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_used TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_draft_cache_last_used ON draft_cache(last_used)')
+
+
+def _migration_attachment_store(conn):
+    """Index of the on-disk attachment store"""
+    # Blobs are content-addressed files; refs map Gmail's (message, attachment) ids onto them
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS attachment_blobs (
+            sha256 TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            last_used TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_attachment_blobs_last_used ON attachment_blobs(last_used)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS attachment_refs (
+            message_id TEXT NOT NULL,
+            attachment_id TEXT NOT NULL,
+            sha256 TEXT NOT NULL,
+            PRIMARY KEY (message_id, attachment_id)
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_attachment_refs_sha256 ON attachment_refs(sha256)')
+
+
+def _migration_body_state(conn):
+    """Track which emails still need their body downloaded"""
+    # 'metadata': synced from headers and snippet only; 'full': body and attachment list stored
+    conn.execute("ALTER TABLE emails ADD COLUMN body_state TEXT NOT NULL DEFAULT 'full'")
+    # Partial index: only the (few) rows still waiting for hydration, newest first
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_emails_unhydrated ON emails(date DESC, id DESC)
+        WHERE body_state = 'metadata'
+    ''')
+
+
+def _migration_email_bodies(conn):
+    """Move bodies into a compressed side table"""
+    # Expects inflate()/deflate()/sanitize_html() on the connection (see _register_functions)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS email_bodies (
+            email_id TEXT PRIMARY KEY,
+            body_text BLOB,
+            body_html BLOB,
+            attachments TEXT
+        )
+    ''')
+    conn.execute('''
+        INSERT INTO email_bodies (email_id, body_text, body_html, attachments)
+        SELECT id, deflate(body_text), deflate(sanitize_html(body_html)), attachments
+        FROM emails WHERE body_state = 'full'
+    ''')
+
+    # The old index and its triggers read emails.body_text, which is going away
+    for trigger in ('emails_fts_ai', 'emails_fts_ad', 'emails_fts_au'):
+        conn.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    conn.execute('DROP TABLE IF EXISTS emails_fts')
+    for column in ('body_text', 'body_html', 'attachments'):
+        conn.execute(f'ALTER TABLE emails DROP COLUMN {column}')
+
+    # FTS keeps indexing the plain text, through a view that joins and inflates the body
+    cols = ', '.join(FTS_COLUMNS)
+    view_cols = ', '.join(f'e.{c}' for c in FTS_COLUMNS if c != 'body_text')
+    conn.execute(f'''
+        CREATE VIEW IF NOT EXISTS emails_fts_content AS
+        SELECT e.rowid AS email_rowid, {view_cols}, inflate(b.body_text) AS body_text
+        FROM emails e LEFT JOIN email_bodies b ON b.email_id = e.id
+    ''')
+    conn.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS emails_fts USING fts5(
+            {cols},
+            content='emails_fts_content', content_rowid='email_rowid',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+    ''')
+
+    # An indexed document spans both tables. Before any change the document is removed using
+    # the view's current (= indexed) values, and afterwards it is re-added from the view.
+    remove = f'''INSERT INTO emails_fts(emails_fts, rowid, {cols})
+        SELECT 'delete', email_rowid, {cols} FROM emails_fts_content WHERE email_rowid = {{}};'''
+    add = f'''INSERT INTO emails_fts(rowid, {cols})
+        SELECT email_rowid, {cols} FROM emails_fts_content WHERE email_rowid = {{}};'''
+    email_rowid = '(SELECT rowid FROM emails WHERE id = {}.email_id)'
+    indexed = ', '.join(c for c in FTS_COLUMNS if c != 'body_text')
+    triggers = [
+        # Only re-index when an indexed column changes (not e.g. is_job_related)
+        ('emails_fts_bu', f'BEFORE UPDATE OF {indexed} ON emails', remove.format('old.rowid')),
+        ('emails_fts_au', f'AFTER UPDATE OF {indexed} ON emails', add.format('new.rowid')),
+        ('emails_fts_ai', 'AFTER INSERT ON emails', add.format('new.rowid')),
+        ('emails_fts_bd', 'BEFORE DELETE ON emails', remove.format('old.rowid')),
+        ('emails_bodies_ad', 'AFTER DELETE ON emails', 'DELETE FROM email_bodies WHERE email_id = old.id;'),
+        ('email_bodies_fts_bi', 'BEFORE INSERT ON email_bodies', remove.format(email_rowid.format('new'))),
+        ('email_bodies_fts_ai', 'AFTER INSERT ON email_bodies', add.format(email_rowid.format('new'))),
+        ('email_bodies_fts_bu', 'BEFORE UPDATE OF body_text ON email_bodies', remove.format(email_rowid.format('old'))),
+        ('email_bodies_fts_au', 'AFTER UPDATE OF body_text ON email_bodies', add.format(email_rowid.format('new'))),
+        ('email_bodies_fts_bd', 'BEFORE DELETE ON email_bodies', remove.format(email_rowid.format('old'))),
+        ('email_bodies_fts_ad', 'AFTER DELETE ON email_bodies', add.format(email_rowid.format('old'))),
+    ]
+    for name, event, body in triggers:
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END')
+    conn.execute("INSERT INTO emails_fts(emails_fts) VALUES ('rebuild')")
+
+
+# The dropped body columns leave most of the file free; reclaim it once this has run
+_migration_email_bodies.vacuum = True
+
+
+def _migration_email_embeddings(conn):
+    """Row map of the on-disk embedding index"""
+    # Vectors live in a file under the embedding dir (see src.embeddings); this maps emails to rows
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS email_embeddings (
+            email_id TEXT PRIMARY KEY,
+            row INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_email_embeddings_row ON email_embeddings(row)')
+    # A deleted email's vector becomes dead space until the index is compacted
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS email_embeddings_ad AFTER DELETE ON emails BEGIN
+            DELETE FROM email_embeddings WHERE email_id = old.id;
+        END
+    ''')
+
+
+def _migration_relevance_corrections(conn):
+    """User corrections of the job-relevance label"""
+    # Subject and snippet are kept so a correction still trains the model after its email is gone
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS relevance_corrections (
+            email_id TEXT PRIMARY KEY,
+            subject TEXT,
+            snippet TEXT,
+            is_job_related INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+# Recomputes the sent-mail side of thread summaries from `emails`. Reply columns (from
+# Gmail's thread view) are kept, and re-checked once we send something new in the thread.
+THREAD_SENT_COLUMNS = ['subject', 'last_email_id', 'last_sent_date', 'last_sent_sender', 'recipients_to',
+                       'sent_count', 'is_job_related']
+REFRESH_THREADS_SQL = f'''
+    INSERT INTO threads (thread_id, subject, last_email_id, last_sent_date, last_sent_sender, recipients_to,
+                         sent_count, is_job_related)
+    SELECT t.thread_id, e.subject, e.id, COALESCE(datetime(e.date), e.date), e.sender, e.recipients_to,
+           t.sent_count, t.is_job_related
+    FROM (
+        SELECT thread_id, COUNT(*) AS sent_count, MAX(is_job_related) AS is_job_related
+        FROM emails WHERE {{where}} GROUP BY thread_id
+    ) t
+    JOIN emails e ON e.id = (SELECT id FROM emails WHERE thread_id = t.thread_id ORDER BY date DESC, id DESC LIMIT 1)
+    WHERE true
+    ON CONFLICT(thread_id) DO UPDATE SET
+        subject = excluded.subject, last_email_id = excluded.last_email_id,
+        last_sent_date = excluded.last_sent_date, last_sent_sender = excluded.last_sent_sender,
+        recipients_to = excluded.recipients_to, sent_count = excluded.sent_count,
+        is_job_related = excluded.is_job_related,
+        replies_checked_at = CASE WHEN excluded.last_sent_date IS threads.last_sent_date
+                                  THEN threads.replies_checked_at END
+    WHERE {' OR '.join(f'threads.{col} IS NOT excluded.{col}' for col in THREAD_SENT_COLUMNS)}
+'''
+
+
+def _migration_threads(conn):
+    """Thread summaries for follow-up tracking"""
+    # Dates are UTC 'YYYY-MM-DD HH:MM:SS' (datetime()), so they compare correctly as text
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS threads (
+            thread_id TEXT PRIMARY KEY,
+            subject TEXT,
+            last_email_id TEXT,
+            last_sent_date TEXT,
+            last_sent_sender TEXT,
+            recipients_to TEXT,
+            sent_count INTEGER NOT NULL DEFAULT 0,
+            is_job_related INTEGER NOT NULL DEFAULT 0,
+            last_inbound_date TEXT,
+            last_inbound_sender TEXT,
+            inbound_count INTEGER NOT NULL DEFAULT 0,
+            replies_checked_at TEXT,
+            last_date TEXT GENERATED ALWAYS AS (MAX(last_sent_date, COALESCE(last_inbound_date, ''))) VIRTUAL,
+            last_sender TEXT GENERATED ALWAYS AS (
+                CASE WHEN last_inbound_date > last_sent_date THEN last_inbound_sender ELSE last_sent_sender END
+            ) VIRTUAL,
+            message_count INTEGER GENERATED ALWAYS AS (sent_count + inbound_count) VIRTUAL,
+            awaiting_reply INTEGER GENERATED ALWAYS AS (
+                last_inbound_date IS NULL OR last_inbound_date < last_sent_date
+            ) VIRTUAL
+        )
+    ''')
+    # Follow-up inbox ("awaiting a reply, last sent before X") and the plain thread list
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_threads_followup
+        ON threads(is_job_related, awaiting_reply, last_sent_date DESC, thread_id DESC)
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_threads_recent ON threads(is_job_related, last_date DESC, thread_id DESC)')
+    conn.execute(REFRESH_THREADS_SQL.format(where='thread_id IS NOT NULL'))
+
+
+def _migration_label_source(conn):
+    """Record which classifier stage decided each label"""
+    # 'keywords', 'llm', 'cache' (an earlier keyword/LLM decision), 'model' or 'user'; NULL for older rows
+    conn.execute('ALTER TABLE emails ADD COLUMN label_source TEXT')
+    # The cache may hold decisions of an older trained model, which must not outlive a retrain
+    conn.execute('DELETE FROM classification_cache')
+
+
+def _visible_length(text):
+    return len(' '.join(text.split()))
+
+
+def _migration_rehydrate_cut_bodies(conn):
+    """Re-download HTML bodies the old sanitizer cut short after an <embed>"""
+    # The stored copy has lost everything after the <embed>, so it can't be repaired in place.
+    # Bodies whose HTML has far less text than the plain-text part are marked for BodyHydrator,
+    # which refetches them when opened or in the background; the current copy is shown until then.
+    cut = []
+    for email_id, body_text, body_html in conn.execute('SELECT email_id, body_text, body_html FROM email_bodies'):
+        body_html = _inflate(body_html)
+        if not body_html:
+            continue
+        html_length = _visible_length(html.unescape(_TAG_RE.sub(' ', body_html)))
+        if html_length < 0.5 * _visible_length(_inflate(body_text)):
+            cut.append((email_id,))
+    conn.executemany("UPDATE emails SET body_state = 'metadata' WHERE id = ?", cut)
+
+
+MIGRATIONS = [
+    _migration_list_index,
+    _migration_fts,
+    _migration_classification_cache,
+    _migration_job_probability,
+    _migration_draft_cache,
+    _migration_attachment_store,
+    _migration_body_state,
+    _migration_email_bodies,
+    _migration_email_embeddings,
+    _migration_relevance_corrections,
+    _migration_threads,
+    _migration_label_source,
+    _migration_rehydrate_cut_bodies,
+]
+
+# bm25 column weights, in FTS_COLUMNS order: subject matches count most
+SEARCH_SQL = '''
+    SELECT e.id, e.subject, e.sender, e.date, e.snippet, e.thread_id, e.is_job_related,
+           e.recipients_to, e.recipients_cc, e.recipients_bcc,
+           highlight(emails_fts, 0, ?, ?) AS subject_highlight,
+           snippet(emails_fts, -1, ?, ?, '…', 16) AS match_snippet,
+           bm25(emails_fts, 10.0, 4.0, 3.0, 2.0, 2.0, 1.0) AS rank
+    FROM emails_fts
+    JOIN emails e ON e.rowid = emails_fts.rowid
+    WHERE emails_fts MATCH ? {job_filter}
+    ORDER BY rank
+    LIMIT ? OFFSET ?
+'''
+
 
 class DatabaseManager:
-    def __init__(self, db_path='emails.db'):
-        self.db_path = db_path
+    def __init__(self, db_path=None):
+        # MAUTO_DB_PATH lets the API, sync and scripts share a non-default DB
+        self.db_path = db_path or os.environ.get('MAUTO_DB_PATH', 'emails.db')
+        self._local = threading.local()
         self._init_db()
 
     def _init_db(self):
         conn = sqlite3.connect(self.db_path)
+        _register_functions(conn)
         c = conn.cursor()
         
         # Enable WAL mode for better concurrency
@@ -35,10 +516,56 @@ class DatabaseManager:
         
         # Index for faster thread reconstruction
         c.execute('CREATE INDEX IF NOT EXISTS idx_thread_id ON emails(thread_id);')
+
+        # Mailbox-level sync cursor (e.g. the last Gmail historyId)
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS sync_state (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        ''')
+
+        # Per-message sync state, so incremental syncs can skip known messages
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS message_sync_state (
+                id TEXT PRIMARY KEY,
+                history_id TEXT,
+                status TEXT DEFAULT 'synced',
+                synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
         
         conn.commit()
+
+        self._migrate(conn)
         conn.close()
 
+    def _migrate(self, conn):
+        """
+        Brings an existing DB up to date. PRAGMA user_version records how many
+        MIGRATIONS have been applied; each one runs in its own transaction.
+        """
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        vacuum = False
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            print(f"Applying DB migration {number}: {migration.__doc__.strip()}")
+            conn.isolation_level = None
+            conn.execute('BEGIN')
+            try:
+                migration(conn)
+                conn.execute(f'PRAGMA user_version = {number}')
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            finally:
+                conn.isolation_level = ''
+            vacuum = vacuum or getattr(migration, 'vacuum', False)
+        if vacuum:
+            # Can't run inside a transaction, so it happens after the migrations
+            print("Compacting the database...")
+            conn.execute('VACUUM')
+
     def upsert_email(self, email_data):
         """
         Insert or update an email record.
@@ -46,48 +573,438 @@ class DatabaseManager:
         lists/dicts (recipients, attachments) should be passed as Python objects
         and will be JSON dumped here.
         """
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
+        return self.upsert_many([email_data])
 
-        # Helper to safely serialize JSON
-        def to_json(obj):
-            return json.dumps(obj) if obj is not None else '[]'
+    def upsert_many(self, emails):
+        """
+        Insert or update a batch of emails in a single transaction.
+        Existing rows are only rewritten when a synced column actually changed,
+        and columns not written by sync (e.g. last_synced) are preserved.
+        Returns True on success, False if the batch was rolled back.
+        """
+        if not emails:
+            return True
 
+        full = [e for e in emails if e.get('body_state', 'full') == 'full']
+        metadata = [_email_row(e) for e in emails if e.get('body_state', 'full') != 'full']
+        conn = self._write_conn()
         try:
-            c.execute('''
-                INSERT OR REPLACE INTO emails (
-                    id, thread_id, date, sender, 
-                    recipients_to, recipients_cc, recipients_bcc, 
-                    subject, body_text, body_html, 
-                    attachments, snippet, is_job_related
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                email_data.get('id'),
-                email_data.get('threadId'),
-                email_data.get('date'),
-                email_data.get('sender'),
-                to_json(email_data.get('to', [])),
-                to_json(email_data.get('cc', [])),
-                to_json(email_data.get('bcc', [])),
-                email_data.get('subject'),
-                email_data.get('body_text', ''),
-                email_data.get('body_html', ''),
-                to_json(email_data.get('attachments', [])),
-                email_data.get('snippet', ''),
-                email_data.get('is_job_related', 0)
-            ))
-            conn.commit()
+            with conn:
+                changes = conn.total_changes
+                if full:
+                    # Gmail messages never change, so a stored body is never rewritten (or re-compressed).
+                    # New bodies go in before their email rows, so FTS indexes each message once.
+                    stored = self._stored_body_ids(conn, [e.get('id') for e in full])
+                    conn.executemany(INSERT_BODY_SQL, [_body_row(e) for e in full if e.get('id') not in stored])
+                    conn.executemany(UPSERT_EMAIL_SQL, [_email_row(e) for e in full])
+                if metadata:
+                    conn.executemany(UPSERT_METADATA_SQL, metadata)
+                # A re-sync of unchanged emails leaves their threads alone too
+                if conn.total_changes != changes:
+                    self._refresh_threads(conn, {e.get('threadId') for e in emails})
+                conn.executemany('''
+                    INSERT OR REPLACE INTO message_sync_state (id, history_id, status)
+                    VALUES (?, ?, 'synced')
+                ''', [(e.get('id'), e.get('historyId')) for e in emails])
             return True
         except Exception as e:
-            print(f"Error saving email {email_data.get('id')}: {e}")
+            print(f"Error saving batch of {len(emails)} emails: {e}")
             return False
-        finally:
-            conn.close()
+
+    def update_bodies(self, emails):
+        """Stores the bodies and attachment lists of hydrated emails (parsed format='full' messages)."""
+        conn = self._write_conn()
+        with conn:
+            self._write_bodies(conn, emails)
+            conn.executemany("UPDATE emails SET body_state = 'full' WHERE id = ?", [(e['id'],) for e in emails])
+
+    @staticmethod
+    def _write_bodies(conn, emails):
+        rows = [_body_row(e) for e in emails]
+        conn.executemany(UPDATE_BODY_SQL, rows)
+        conn.executemany(INSERT_BODY_SQL, rows)
+
+    @staticmethod
+    def _refresh_threads(conn, thread_ids):
+        """Brings the threads rows of these threads up to date with `emails` (removing emptied ones)."""
+        ids = [t for t in thread_ids if t is not None]
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            conn.execute(REFRESH_THREADS_SQL.format(where=f'thread_id IN ({placeholders})'), chunk)
+            conn.execute(f'''
+                DELETE FROM threads WHERE thread_id IN ({placeholders})
+                AND NOT EXISTS (SELECT 1 FROM emails WHERE emails.thread_id = threads.thread_id)
+            ''', chunk)
+
+    @staticmethod
+    def _stored_body_ids(conn, email_ids):
+        stored = set()
+        for start in range(0, len(email_ids), 500):
+            chunk = email_ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            stored.update(row[0] for row in conn.execute(
+                f'SELECT email_id FROM email_bodies WHERE email_id IN ({placeholders})', chunk))
+        return stored
+
+    def get_unhydrated_ids(self, limit=50):
+        """IDs of emails synced without their body, newest first."""
+        rows = self.query(
+            "SELECT id FROM emails WHERE body_state = 'metadata' ORDER BY date DESC, id DESC LIMIT ?", (limit,)
+        )
+        return [row['id'] for row in rows]
+
+    def _connect(self, read_only=False):
+        conn = sqlite3.connect(self.db_path, timeout=30, cached_statements=256)
+        _register_functions(conn)
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        if read_only:
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA query_only=1')
+        return conn
+
+    def _write_conn(self):
+        """Long-lived connection per thread, so batched writes skip connection setup."""
+        conn = getattr(self._local, 'write_conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.write_conn = conn
+        return conn
+
+    def _read_conn(self):
+        """
+        Long-lived read-only connection per thread. FastAPI runs sync handlers on a
+        fixed worker threadpool, so this acts as a connection pool for the API.
+        """
+        conn = getattr(self._local, 'read_conn', None)
+        if conn is None:
+            conn = self._connect(read_only=True)
+            self._local.read_conn = conn
+        return conn
+
+    def query(self, sql, params=()):
+        """Runs a read query and returns a list of dicts. Statements are cached per connection."""
+        return [dict(row) for row in self._read_conn().execute(sql, params).fetchall()]
+
+    def query_one(self, sql, params=()):
+        row = self._read_conn().execute(sql, params).fetchone()
+        return dict(row) if row else None
+
+    def execute(self, sql, params=()):
+        """Runs a single write statement in its own transaction. Returns the rowcount."""
+        conn = self._write_conn()
+        with conn:
+            return conn.execute(sql, params).rowcount
+
+    def executemany(self, sql, rows):
+        """Runs a write statement for every row in one transaction."""
+        conn = self._write_conn()
+        with conn:
+            return conn.executemany(sql, rows).rowcount
+
+    def close(self):
+        """Closes the calling thread's connections."""
+        for name in ('read_conn', 'write_conn'):
+            conn = getattr(self._local, name, None)
+            if conn is not None:
+                conn.close()
+                setattr(self._local, name, None)
+
+    # --- Read helpers used by the API ---
+    def list_emails(self, is_job=True, limit=50, offset=0, after=None):
+        """
+        Lists emails newest first. after=(date, id) of the last row of the
+        previous page switches to keyset pagination, which costs the same at any depth.
+        """
+        if after is not None:
+            return self.query(LIST_EMAILS_AFTER_SQL, (1 if is_job else 0, after[0], after[1], limit))
+        return self.query(LIST_EMAILS_SQL, (1 if is_job else 0, limit, offset))
+
+    def get_email(self, email_id, bodies=False):
+        """One email; bodies=True adds the decompressed body_text, body_html and attachments."""
+        if bodies:
+            return self.query_one(f'''
+                SELECT {THREAD_COLUMNS}, {BODY_PROJECTION}
+                FROM emails e LEFT JOIN email_bodies b ON b.email_id = e.id WHERE e.id = ?
+            ''', (email_id,))
+        return self.query_one(f'SELECT {THREAD_COLUMNS} FROM emails e WHERE e.id = ?', (email_id,))
+
+    def get_list_rows(self, email_ids):
+        """The list_emails projection (plus the job flag) of these emails, newest first."""
+        ids = list(email_ids)
+        rows = []
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            rows += self.query(f'SELECT {LIST_COLUMNS}, is_job_related FROM emails WHERE id IN ({placeholders})', chunk)
+        rows.sort(key=lambda r: (r['date'] or '', r['id']), reverse=True)
+        return rows
+
+    def get_attachment_meta(self, message_id, attachment_id):
+        """The attachment's entry (filename, mimeType, size) from the message's attachments JSON, or None."""
+        row = self.query_one('SELECT attachments FROM email_bodies WHERE email_id = ?', (message_id,))
+        if row is None or not row['attachments']:
+            return None
+        return next((a for a in json.loads(row['attachments']) if a.get('attachmentId') == attachment_id), None)
+
+    def get_thread(self, thread_id, bodies=True):
+        """A thread's messages, oldest first. bodies=False skips reading and decompressing the bodies."""
+        if not bodies:
+            return self.query(f'SELECT {THREAD_COLUMNS} FROM emails e WHERE e.thread_id = ? ORDER BY e.date ASC',
+                              (thread_id,))
+        return self.query(f'''
+            SELECT {THREAD_COLUMNS}, {BODY_PROJECTION}
+            FROM emails e LEFT JOIN email_bodies b ON b.email_id = e.id
+            WHERE e.thread_id = ? ORDER BY e.date ASC
+        ''', (thread_id,))
+
+    def search(self, match_query, limit=50, offset=0, is_job=None, mark=('<mark>', '</mark>')):
+        """
+        Ranked (bm25) full-text search. match_query is an FTS5 expression,
+        see src.search.build_match_query. Matches are wrapped in `mark`.
+        """
+        params = [mark[0], mark[1], mark[0], mark[1], match_query]
+        job_filter = ''
+        if is_job is not None:
+            job_filter = 'AND e.is_job_related = ?'
+            params.append(1 if is_job else 0)
+        params += [limit, offset]
+        return self.query(SEARCH_SQL.format(job_filter=job_filter), params)
+
+    def filter_emails(self, plan, limit=200):
+        """
+        Runs a structured filter plan (see src.search.normalize_filter_plan)
+        over the whole mailbox: FTS for keywords/people, indexed columns for
+        dates and the job flag. Newest matches first.
+        """
+        match_query = plan_match_query(plan)
+        clauses, params = [], []
+        if match_query:
+            clauses.append('emails_fts MATCH ?')
+            params.append(match_query)
+        if plan['date_from']:
+            clauses.append('e.date >= ?')
+            params.append(plan['date_from'])
+        if plan['date_to']:
+            # Dates are ISO strings, so "before the next day" includes all of date_to
+            next_day = datetime.date.fromisoformat(plan['date_to']) + datetime.timedelta(days=1)
+            clauses.append('e.date < ?')
+            params.append(next_day.isoformat())
+        if plan['is_job'] is not None:
+            clauses.append('e.is_job_related = ?')
+            params.append(1 if plan['is_job'] else 0)
+
+        source = 'emails e'
+        if match_query:
+            source = 'emails_fts JOIN emails e ON e.rowid = emails_fts.rowid'
+        where = ('WHERE ' + ' AND '.join(clauses)) if clauses else ''
+        sql = f'''
+            SELECT e.id, e.subject, e.sender, e.date, e.snippet, e.thread_id,
+                   e.recipients_to, e.recipients_cc, e.recipients_bcc
+            FROM {source} {where}
+            ORDER BY e.date DESC, e.id DESC LIMIT ?
+        '''
+        return self.query(sql, params + [limit])
+
+    def iter_metadata_chunks(self, chunk_size=100):
+        """Yields lists of {id, subject, sender, date} over the whole mailbox, newest first."""
+        after = None
+        while True:
+            if after is None:
+                rows = self.query('SELECT id, subject, sender, date FROM emails ORDER BY date DESC, id DESC LIMIT ?', (chunk_size,))
+            else:
+                rows = self.query('''
+                    SELECT id, subject, sender, date FROM emails
+                    WHERE (date, id) < (?, ?) ORDER BY date DESC, id DESC LIMIT ?
+                ''', (after[0], after[1], chunk_size))
+            if not rows:
+                return
+            yield rows
+            after = (rows[-1]['date'], rows[-1]['id'])
 
     def get_count(self):
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute('SELECT COUNT(*) FROM emails')
-        count = c.fetchone()[0]
-        conn.close()
-        return count
+        return self._read_conn().execute('SELECT COUNT(*) FROM emails').fetchone()[0]
+
+    def delete_email(self, email_id):
+        """Removes an email that disappeared from the mailbox and records the tombstone."""
+        conn = self._write_conn()
+        with conn:
+            thread = conn.execute('SELECT thread_id FROM emails WHERE id = ?', (email_id,)).fetchone()
+            c = conn.execute('DELETE FROM emails WHERE id = ?', (email_id,))
+            deleted = c.rowcount > 0
+            if thread is not None:
+                self._refresh_threads(conn, [thread[0]])
+            conn.execute('''
+                INSERT OR REPLACE INTO message_sync_state (id, history_id, status)
+                VALUES (?, NULL, 'deleted')
+            ''', (email_id,))
+        return deleted
+
+    def mark_sync_failed(self, email_ids):
+        """Records messages that can't be synced (rejected by Gmail or unparseable), so they aren't waited on."""
+        self.executemany('''
+            INSERT OR REPLACE INTO message_sync_state (id, history_id, status)
+            VALUES (?, NULL, 'failed')
+        ''', [(email_id,) for email_id in email_ids])
+
+    def get_known_ids(self, email_ids):
+        """Returns the subset of email_ids that are already stored in the DB."""
+        known = set()
+        conn = self._read_conn()
+        ids = list(email_ids)
+        # Stay well under SQLite's bound-parameter limit
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            rows = conn.execute(f'SELECT id FROM emails WHERE id IN ({placeholders})', chunk).fetchall()
+            known.update(row[0] for row in rows)
+        return known
+
+    # --- Threads (see src.threads) ---
+    def list_threads(self, is_job=True, awaiting_reply=None, sent_before=None, limit=50, after=None):
+        """
+        Thread summaries. With awaiting_reply/sent_before (the follow-up inbox)
+        they are ordered by when we last wrote, otherwise by last activity;
+        newest first either way. after=(date, thread_id) of the previous page's
+        last row continues from there. Every variant is a range scan of one index.
+        """
+        order = 'last_sent_date' if awaiting_reply is not None or sent_before is not None else 'last_date'
+        clauses, params = ['is_job_related = ?'], [1 if is_job else 0]
+        if awaiting_reply is not None:
+            clauses.append('awaiting_reply = ?')
+            params.append(1 if awaiting_reply else 0)
+        if sent_before is not None:
+            clauses.append('last_sent_date < ?')
+            params.append(sent_before)
+        if after is not None:
+            clauses.append(f'({order}, thread_id) < (?, ?)')
+            params += list(after)
+        return self.query(f'''
+            SELECT {THREAD_LIST_COLUMNS} FROM threads
+            WHERE {' AND '.join(clauses)}
+            ORDER BY {order} DESC, thread_id DESC LIMIT ?
+        ''', params + [limit])
+
+    def get_threads_to_check(self, recheck_before, limit=500):
+        """Threads whose replies were never checked, or that still await one and were checked before recheck_before."""
+        rows = self.query('''
+            SELECT thread_id FROM threads
+            WHERE replies_checked_at IS NULL OR (awaiting_reply = 1 AND replies_checked_at < ?)
+            ORDER BY last_sent_date DESC LIMIT ?
+        ''', (recheck_before, limit))
+        return [row['thread_id'] for row in rows]
+
+    def update_thread_replies(self, activity, checked_ids):
+        """Stores parsed thread activity (GmailClient.parse_thread_activity) and marks checked_ids as checked."""
+        conn = self._write_conn()
+        with conn:
+            conn.executemany('''
+                UPDATE threads SET last_inbound_date = ?, last_inbound_sender = ?, inbound_count = ?
+                WHERE thread_id = ?
+            ''', [(a['last_inbound_date'], a['last_inbound_sender'], a['inbound_count'], a['thread_id'])
+                  for a in activity])
+            conn.executemany("UPDATE threads SET replies_checked_at = datetime('now') WHERE thread_id = ?",
+                             [(thread_id,) for thread_id in checked_ids])
+
+    # --- Relevance labels (see src.relevance) ---
+    def record_relevance_correction(self, email_id, is_job):
+        """Stores the user's label for an email and applies it. Returns False if the email doesn't exist."""
+        conn = self._write_conn()
+        with conn:
+            changed = conn.execute(
+                "UPDATE emails SET is_job_related = ?, job_probability = NULL, label_source = 'user' WHERE id = ?",
+                (1 if is_job else 0, email_id)
+            ).rowcount
+            if changed:
+                conn.execute('''
+                    INSERT OR REPLACE INTO relevance_corrections (email_id, subject, snippet, is_job_related)
+                    SELECT id, subject, snippet, ? FROM emails WHERE id = ?
+                ''', (1 if is_job else 0, email_id))
+                thread_id, subject, snippet = conn.execute(
+                    'SELECT thread_id, subject, snippet FROM emails WHERE id = ?', (email_id,)
+                ).fetchone()
+                # Otherwise the same message synced again would get the corrected label back from the cache
+                versions = conn.execute('SELECT DISTINCT model_id, prompt_version FROM classification_cache').fetchall()
+                conn.executemany('DELETE FROM classification_cache WHERE key = ?',
+                                 [(content_key(subject, snippet, model_id, version),) for model_id, version in versions])
+                self._refresh_threads(conn, [thread_id])
+        return changed > 0
+
+    def get_relevance_training_rows(self):
+        """
+        subject, snippet, is_job_related and corrected for every correction and
+        every email labeled by anything but the trained model.
+        """
+        return self.query('''
+            SELECT e.subject, e.snippet, COALESCE(c.is_job_related, e.is_job_related) AS is_job_related,
+                   c.email_id IS NOT NULL AS corrected
+            FROM emails e LEFT JOIN relevance_corrections c ON c.email_id = e.id
+            WHERE e.label_source IS NOT 'model' OR c.email_id IS NOT NULL
+            UNION ALL
+            SELECT c.subject, c.snippet, c.is_job_related, 1
+            FROM relevance_corrections c WHERE NOT EXISTS (SELECT 1 FROM emails e WHERE e.id = c.email_id)
+        ''')
+
+    # --- Embedding index row map (see src.embeddings) ---
+    def get_embedded_ids(self, email_ids):
+        """Returns the subset of email_ids that already have a vector."""
+        embedded = set()
+        conn = self._read_conn()
+        ids = list(email_ids)
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            rows = conn.execute(f'SELECT email_id FROM email_embeddings WHERE email_id IN ({placeholders})', chunk).fetchall()
+            embedded.update(row[0] for row in rows)
+        return embedded
+
+    def get_unembedded(self, limit=256):
+        """Emails without a vector yet (id, subject, snippet, body_text), newest first."""
+        return self.query('''
+            SELECT e.id, e.subject, e.snippet, inflate(b.body_text) AS body_text
+            FROM emails e LEFT JOIN email_bodies b ON b.email_id = e.id
+            WHERE NOT EXISTS (SELECT 1 FROM email_embeddings x WHERE x.email_id = e.id)
+            ORDER BY e.date DESC, e.id DESC LIMIT ?
+        ''', (limit,))
+
+    def get_embedding_rows(self, below=None):
+        """[(email_id, row)] ordered by row; below= only returns rows under that number."""
+        if below is None:
+            return self._read_conn().execute('SELECT email_id, row FROM email_embeddings ORDER BY row').fetchall()
+        return self._read_conn().execute(
+            'SELECT email_id, row FROM email_embeddings WHERE row < ? ORDER BY row', (below,)).fetchall()
+
+    def get_embedding_state(self, file_key):
+        """(current vectors file, highest mapped row, mapped count) in one read, to detect changes."""
+        return tuple(self._read_conn().execute('''
+            SELECT (SELECT value FROM sync_state WHERE key = ?),
+                   (SELECT MAX(row) FROM email_embeddings),
+                   (SELECT COUNT(*) FROM email_embeddings)
+        ''', (file_key,)).fetchone())
+
+    def add_embedding_rows(self, rows):
+        """Maps (email_id, row) pairs."""
+        self.executemany('INSERT OR REPLACE INTO email_embeddings (email_id, row) VALUES (?, ?)', rows)
+
+    def replace_embedding_rows(self, rows, state):
+        """Swaps in a whole new row map together with sync_state entries, in one transaction."""
+        conn = self._write_conn()
+        with conn:
+            conn.execute('DELETE FROM email_embeddings')
+            conn.executemany('INSERT INTO email_embeddings (email_id, row) VALUES (?, ?)', rows)
+            conn.executemany('INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)', list(state.items()))
+
+    def get_sync_state(self, key, default=None):
+        row = self._read_conn().execute('SELECT value FROM sync_state WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_sync_state(self, key, value):
+        conn = self._write_conn()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)', (key, value))
+
+    def clear_sync_state(self, key):
+        conn = self._write_conn()
+        with conn:
+            conn.execute('DELETE FROM sync_state WHERE key = ?', (key,))
@@ -0,0 +1,315 @@
+import os
+import re
+import threading
+import zlib
+
+import numpy as np
+
+from src.context import clean_body
+
+DEFAULT_EMBEDDING_DIR = 'embeddings'
+DEFAULT_ST_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'
+# Compact once this many rows (and at least this fraction of the file) belong to deleted emails
+COMPACT_MIN_DEAD = 1000
+COMPACT_DEAD_FRACTION = 0.25
+
+# sync_state keys: which embedder built the index, and which vectors file is current
+MODEL_KEY = 'embedding_model'
+FILE_KEY = 'embedding_file'
+
+_WORD_RE = re.compile(r"[a-z0-9][a-z0-9'+#.-]*")
+
+
+def email_text(email, max_body_chars=1000):
+    """What gets embedded: subject, snippet and the start of the body without quotes or signature."""
+    body = clean_body(email.get('body_text'))[:max_body_chars]
+    return f"{email.get('subject') or ''}\n{email.get('snippet') or ''}\n{body}".strip()
+
+
+class HashingEmbedder:
+    """
+    Dependency-free fallback: signed feature hashing of words and word pairs,
+    log-scaled and L2-normalized. Lexical rather than semantic, but fast and
+    stable, so the index works without a model download.
+    """
+    def __init__(self, dim=384):
+        self.dim = dim
+        self.name = f"hashing-v1-{dim}"
+
+    def embed(self, texts):
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            words = _WORD_RE.findall(text.lower())
+            features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+            if not features:
+                continue
+            hashes = np.fromiter((zlib.crc32(f.encode('utf-8')) for f in features), dtype=np.uint32, count=len(features))
+            signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+            np.add.at(out[i], hashes % self.dim, signs)
+        out = np.sign(out) * np.log1p(np.abs(out))
+        return _normalize(out)
+
+
+class SentenceTransformerEmbedder:
+    """A small local sentence-transformers model (CPU by default), loaded on first use."""
+    def __init__(self, model_id=None, batch_size=64, device=None):
+        self.model_id = model_id or os.environ.get('MAUTO_EMBEDDING_MODEL', DEFAULT_ST_MODEL)
+        self.batch_size = batch_size
+        self.device = device or os.environ.get('MAUTO_EMBEDDING_DEVICE', 'cpu')
+        self.name = f"st:{self.model_id}"
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def dim(self):
+        return self.model().get_sentence_embedding_dimension()
+
+    def model(self):
+        with self._lock:
+            if self._model is None:
+                from sentence_transformers import SentenceTransformer
+                self._model = SentenceTransformer(self.model_id, device=self.device)
+            return self._model
+
+    def embed(self, texts):
+        vectors = self.model().encode(list(texts), batch_size=self.batch_size, convert_to_numpy=True,
+                                      normalize_embeddings=True, show_progress_bar=False)
+        return vectors.astype(np.float32)
+
+
+def create_embedder(name=None):
+    """MAUTO_EMBEDDER: 'sentence-transformers' (default when installed) or 'hashing'."""
+    name = name or os.environ.get('MAUTO_EMBEDDER')
+    if name is None:
+        try:
+            import sentence_transformers  # noqa: F401
+            name = 'sentence-transformers'
+        except ImportError:
+            name = 'hashing'
+    if name == 'hashing':
+        return HashingEmbedder()
+    if name == 'sentence-transformers':
+        return SentenceTransformerEmbedder()
+    raise ValueError(f"Unknown embedder {name!r}; expected 'sentence-transformers' or 'hashing'")
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class EmbeddingIndex:
+    """
+    One vector per email, for semantic search and "similar emails".
+
+    Vectors are appended to a float16 file under root and email_embeddings
+    maps each email to its row. Searches are one matrix-vector product over
+    a resident float32 copy (loaded from the memory-mapped file) plus a
+    top-k partition. Deleted emails leave dead rows until compact() rewrites
+    the file. The DB records which file is current, so an index in another
+    process picks up appends and compactions on its next search.
+    """
+    def __init__(self, db, root=None, embedder=None):
+        self.db = db
+        self.root = root or os.environ.get('MAUTO_EMBEDDING_DIR', DEFAULT_EMBEDDING_DIR)
+        self.embedder = embedder or create_embedder()
+        self.embedded = 0
+        self.compactions = 0
+        self._lock = threading.Lock()
+        self._model_checked = False
+        # (db state, float32 matrix, row -> email id); replaced as a whole, so readers never see a mix
+        self._snapshot = (None, np.zeros((0, 0), dtype=np.float32), np.zeros(0, dtype=object))
+        # Spare rows behind the current snapshot, so local appends don't copy the whole matrix
+        self._buffer = None
+
+    # --- Writing ---
+    def add(self, emails):
+        """Embeds and appends emails that aren't indexed yet. Returns how many were added."""
+        with self._lock:
+            self._check_model()
+            embedded = self.db.get_embedded_ids(e['id'] for e in emails)
+            new = list({e['id']: e for e in emails if e['id'] not in embedded}.values())
+            if not new:
+                return 0
+            vectors = self.embedder.embed([email_text(e) for e in new]).astype(np.float16)
+            dim = vectors.shape[1]
+
+            os.makedirs(self.root, exist_ok=True)
+            before = self.db.get_embedding_state(FILE_KEY)
+            # Rows are numbered by file position. A crash before the rows are mapped leaves
+            # orphans at the end of the file, which nothing points at and compact() drops.
+            with open(self._path(before[0]), 'ab') as f:
+                start = f.tell() // (dim * 2)
+                f.write(vectors.tobytes())
+            self.db.add_embedding_rows([(e['id'], start + i) for i, e in enumerate(new)])
+            self.embedded += len(new)
+
+            after = self.db.get_embedding_state(FILE_KEY)
+            if self._snapshot[0] == before:
+                self._append_local(start, vectors, [e['id'] for e in new], after)
+            if self._should_compact(start + len(new), after[2]):
+                self._compact()
+            return len(new)
+
+    def backfill(self, batch_size=256):
+        """Embeds stored emails that have no vector yet (e.g. synced before the index existed)."""
+        added = 0
+        while True:
+            emails = self.db.get_unembedded(batch_size)
+            if not emails:
+                return added
+            added += self.add(emails)
+
+    def compact(self, force=False):
+        """
+        Rewrites the vectors file without the rows of deleted emails, once they
+        make up enough of it (or always with force=True). Returns how many rows were dropped.
+        """
+        with self._lock:
+            self._check_model()
+            file, _, live = self.db.get_embedding_state(FILE_KEY)
+            dim = self._dim()
+            if not force and not self._should_compact(len(self._open(file, dim)) if dim else 0, live):
+                return 0
+            return self._compact()
+
+    @staticmethod
+    def _should_compact(total, live):
+        return total - live >= max(COMPACT_MIN_DEAD, COMPACT_DEAD_FRACTION * total)
+
+    def _compact(self):
+        old_file, _, _ = self.db.get_embedding_state(FILE_KEY)
+        dim = self._dim()
+        live = self.db.get_embedding_rows()
+        old = self._open(old_file, dim)
+        new_file = _next_file(old_file)
+        with open(self._path(new_file), 'wb') as f:
+            for start in range(0, len(live), 16384):
+                rows = [row for _, row in live[start:start + 16384]]
+                f.write(np.ascontiguousarray(old[rows]).tobytes())
+        dropped = len(old) - len(live)
+        del old
+        self.db.replace_embedding_rows([(email_id, i) for i, (email_id, _) in enumerate(live)], {FILE_KEY: new_file})
+        _remove(self._path(old_file))
+        self.compactions += 1
+        print(f"Compacted the embedding index: dropped {dropped} rows, {len(live)} left.")
+        return dropped
+
+    def _check_model(self):
+        """Starts a fresh index when the embedder changed; vectors from different models don't compare."""
+        if self._model_checked:
+            return
+        model = f"{self.embedder.name}:{self.embedder.dim}"
+        current = self.db.get_sync_state(MODEL_KEY)
+        if current != model:
+            old_file = self.db.get_sync_state(FILE_KEY)
+            if current is not None:
+                print(f"Embedding model changed to {model}; rebuilding the embedding index.")
+            self.db.replace_embedding_rows([], {FILE_KEY: _next_file(old_file), MODEL_KEY: model})
+            if old_file:
+                _remove(self._path(old_file))
+        self._model_checked = True
+
+    # --- Searching ---
+    def search(self, query, k=10):
+        """[(email_id, score)] for the k emails closest to a text query, best first."""
+        return self.search_vector(self.embedder.embed([query])[0], k)
+
+    def similar(self, email_id, k=10):
+        """[(email_id, score)] for the emails closest to a stored one (itself excluded), or None if it isn't indexed."""
+        _, matrix, ids = self._current()
+        row = self.db.query_one('SELECT row FROM email_embeddings WHERE email_id = ?', (email_id,))
+        if row is None or row['row'] >= len(ids) or ids[row['row']] != email_id:
+            return None
+        return [hit for hit in self.search_vector(matrix[row['row']], k + 1) if hit[0] != email_id][:k]
+
+    def search_vector(self, vector, k=10):
+        _, matrix, ids = self._current()
+        if not len(ids) or k <= 0:
+            return []
+        scores = matrix @ np.asarray(vector, dtype=np.float32)
+        # Rows of deleted emails (and unfinished appends) never match
+        scores[ids == None] = -np.inf  # noqa: E711
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(ids[i], float(scores[i])) for i in top if scores[i] > -np.inf]
+
+    def stats(self):
+        state, matrix, ids = self._current()
+        return {'embedder': self.embedder.name, 'rows': len(ids), 'live': state[2] if state else 0,
+                'embedded': self.embedded, 'compactions': self.compactions, 'resident_mb': round(matrix.nbytes / 1e6, 1)}
+
+    def _current(self):
+        """The snapshot for the DB's current state, reloaded when another writer changed it."""
+        state = self.db.get_embedding_state(FILE_KEY)
+        if self._snapshot[0] != state:
+            with self._lock:
+                state = self.db.get_embedding_state(FILE_KEY)
+                if self._snapshot[0] != state:
+                    self._load(state)
+        return self._snapshot
+
+    def _load(self, state):
+        file, max_row, _ = state
+        dim = self._dim()
+        if file is None or max_row is None or not dim:
+            self._snapshot = (state, np.zeros((0, dim or 0), dtype=np.float32), np.zeros(0, dtype=object))
+            self._buffer = None
+            return
+        # Rows past max_row are an append whose rows aren't mapped yet
+        vectors = self._open(file, dim)[:max_row + 1]
+        rows = len(vectors)
+        buffer = np.empty((_capacity(rows), dim), dtype=np.float32)
+        for start in range(0, rows, 16384):
+            end = min(start + 16384, rows)
+            buffer[start:end] = vectors[start:end]
+        ids = np.full(len(buffer), None, dtype=object)
+        for email_id, row in self.db.get_embedding_rows(below=rows):
+            ids[row] = email_id
+        self._buffer = (buffer, ids)
+        self._snapshot = (state, buffer[:rows], ids[:rows])
+
+    def _append_local(self, start, vectors, email_ids, state):
+        """Extends the resident snapshot with rows this process just wrote, without reloading."""
+        _, matrix, ids = self._snapshot
+        end = start + len(vectors)
+        if self._buffer is None or len(self._buffer[0]) < end or len(matrix) != start:
+            self._load(state)
+            return
+        buffer, id_buffer = self._buffer
+        # Rows past the current snapshot aren't visible to readers yet, so they can be filled in place
+        buffer[start:end] = vectors
+        id_buffer[start:end] = email_ids
+        self._snapshot = (state, buffer[:end], id_buffer[:end])
+
+    def _open(self, file, dim):
+        path = self._path(file)
+        rows = os.path.getsize(path) // (dim * 2) if os.path.exists(path) else 0
+        if not rows:
+            return np.zeros((0, dim), dtype=np.float16)
+        return np.memmap(path, dtype=np.float16, mode='r', shape=(rows, dim))
+
+    def _dim(self):
+        model = self.db.get_sync_state(MODEL_KEY)
+        return int(model.rsplit(':', 1)[1]) if model else None
+
+    def _path(self, file):
+        return os.path.join(self.root, file)
+
+
+def _next_file(file):
+    """vectors-<n>.f16 -> vectors-<n+1>.f16; a new file name per compaction or rebuild."""
+    version = int(file[len('vectors-'):-len('.f16')]) + 1 if file else 0
+    return f"vectors-{version}.f16"
+
+
+def _capacity(rows):
+    return max(1024, int(rows * 1.25))
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
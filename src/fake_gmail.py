@@ -0,0 +1,283 @@
+"""
+In-process stand-in for the Gmail API service object returned by
+googleapiclient.discovery.build('gmail', 'v1').
+
+Only the calls Mauto makes are implemented. Every execute() sleeps for a
+configurable round-trip latency (a batch costs one round trip), and a
+fraction of calls can fail with 429 so retry/backoff can be exercised.
+Used for offline benchmarks and local development without credentials.
+"""
+import base64
+import datetime
+import json
+import random
+import threading
+import time
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+SUBJECTS = [
+    "Application for Software Engineering Intern",
+    "Following up on my application",
+    "Research position inquiry",
+    "Quick question about the project",
+    "Re: Interview availability",
+    "Weekend plans",
+    "Invoice for March",
+    "Thank you for your time",
+]
+
+
+def _b64(text):
+    return base64.urlsafe_b64encode(text.encode('utf-8')).decode('ascii')
+
+
+def _http_error(status, retry_after=None):
+    info = {'status': str(status)}
+    if retry_after is not None:
+        info['retry-after'] = str(retry_after)
+    return HttpError(httplib2.Response(info), b'{"error": "fake"}')
+
+
+class FakeRequest:
+    def __init__(self, service, handler, **kwargs):
+        self.service = service
+        self.handler = handler
+        self.kwargs = kwargs
+
+    def execute(self, http=None, num_retries=0):
+        # Like googleapiclient, num_retries retries 429/5xx responses
+        for attempt in range(num_retries + 1):
+            self.service._round_trip()
+            try:
+                self.service._maybe_fail()
+            except HttpError:
+                if attempt == num_retries:
+                    raise
+                continue
+            return self.handler(**self.kwargs)
+
+
+class FakeBatch:
+    def __init__(self, service, callback=None):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        request_id = request_id or str(len(self.requests))
+        self.requests.append((request_id, request, callback or self.callback))
+
+    def execute(self, http=None):
+        # One HTTP round trip for the whole batch, plus a little per-item server time
+        self.service._round_trip()
+        time.sleep(self.service.per_item_latency * len(self.requests))
+        for request_id, request, callback in self.requests:
+            try:
+                self.service._maybe_fail()
+                response, exception = request.handler(**request.kwargs), None
+            except HttpError as e:
+                response, exception = None, e
+            if callback:
+                callback(request_id, response, exception)
+
+
+class _Resource:
+    """Mimics the chained resource accessors (users().messages().get(...))."""
+    def __init__(self, **methods):
+        self.__dict__.update(methods)
+
+
+class FakeGmailService:
+    def __init__(self, num_messages=1000, latency=0.05, per_item_latency=0.0,
+                 error_rate=0.0, body_size=2000, seed=0):
+        self.latency = latency
+        self.per_item_latency = per_item_latency
+        self.error_rate = error_rate
+        self.body_size = body_size
+        self.round_trips = 0
+        # Approximate response payload sent for messages.get, to compare fetch formats
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self._messages = {}      # id -> raw message resource
+        self._replies = {}       # thread id -> received (not sent) messages
+        self._thread_ids = {}    # thread id -> ids of its sent messages
+        self._order = []         # newest first
+        self._history = []       # list of (history_id, record)
+        self._history_id = 1000
+        self._oldest_history_id = self._history_id
+        self._next_id = 0
+        for _ in range(num_messages):
+            self.add_message(record_history=False)
+
+    # --- Test helpers ---
+    def add_message(self, subject=None, thread_id=None, record_history=True):
+        with self._lock:
+            self._next_id += 1
+            self._history_id += 1
+            msg_id = f"fake{self._next_id:08x}"
+            msg = self._build_message(msg_id, thread_id or f"thread{self._next_id // 3:08x}", subject)
+            msg['historyId'] = str(self._history_id)
+            self._messages[msg_id] = msg
+            self._thread_ids.setdefault(msg['threadId'], set()).add(msg_id)
+            self._order.insert(0, msg_id)
+            if record_history:
+                self._history.append((self._history_id, {'messagesAdded': [{'message': {'id': msg_id, 'labelIds': ['SENT']}}]}))
+            else:
+                self._oldest_history_id = self._history_id
+            return msg_id
+
+    def add_reply(self, thread_id, sender="Recruiter <recruiter@example.org>", minutes_after=60):
+        """Adds a received message to a thread (not in the sent listing or history, like real replies)."""
+        with self._lock:
+            self._next_id += 1
+            latest = max((int(self._messages[i]['internalDate']) for i in self._thread_ids.get(thread_id, ())), default=0)
+            reply = {
+                'id': f"fake{self._next_id:08x}",
+                'threadId': thread_id,
+                'labelIds': ['INBOX'],
+                'internalDate': str(latest + minutes_after * 60000),
+                'payload': {'mimeType': 'text/plain', 'headers': [{'name': 'From', 'value': sender}]},
+            }
+            self._replies.setdefault(thread_id, []).append(reply)
+            return reply['id']
+
+    def delete_message(self, msg_id):
+        with self._lock:
+            self._history_id += 1
+            msg = self._messages.pop(msg_id, None)
+            if msg is not None:
+                self._thread_ids[msg['threadId']].discard(msg_id)
+            if msg_id in self._order:
+                self._order.remove(msg_id)
+            self._history.append((self._history_id, {'messagesDeleted': [{'message': {'id': msg_id, 'labelIds': ['SENT']}}]}))
+
+    def expire_history(self):
+        """Drops all history records, as Gmail does after roughly a week."""
+        with self._lock:
+            self._history = []
+            self._oldest_history_id = self._history_id + 1
+
+    # --- Service surface ---
+    def users(self):
+        return _Resource(
+            getProfile=lambda userId: FakeRequest(self, self._get_profile),
+            messages=lambda: _Resource(
+                list=lambda userId, labelIds=None, maxResults=100, pageToken=None:
+                    FakeRequest(self, self._list_messages, maxResults=maxResults, pageToken=pageToken),
+                list_next=self._list_next,
+                get=lambda userId, id, format='full', metadataHeaders=None:
+                    FakeRequest(self, self._get_message, id=id, format=format, metadataHeaders=metadataHeaders),
+                attachments=lambda: _Resource(
+                    get=lambda userId, messageId, id: FakeRequest(self, self._get_attachment, id=id)
+                ),
+            ),
+            threads=lambda: _Resource(
+                get=lambda userId, id, format='full', metadataHeaders=None:
+                    FakeRequest(self, self._get_thread, id=id),
+            ),
+            history=lambda: _Resource(
+                list=lambda userId, startHistoryId, labelId=None, historyTypes=None, pageToken=None:
+                    FakeRequest(self, self._list_history, startHistoryId=startHistoryId),
+                list_next=lambda previous_request, previous_response: None,
+            ),
+        )
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback=callback)
+
+    # --- Internals ---
+    def _round_trip(self):
+        with self._lock:
+            self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _maybe_fail(self):
+        if self.error_rate and self._rng.random() < self.error_rate:
+            raise _http_error(429, retry_after=0)
+
+    def _get_profile(self):
+        return {'emailAddress': 'me@example.com', 'historyId': str(self._history_id)}
+
+    def _list_messages(self, maxResults, pageToken):
+        start = int(pageToken or 0)
+        ids = self._order[start:start + maxResults]
+        response = {'messages': [{'id': i, 'threadId': self._messages[i]['threadId']} for i in ids]}
+        if start + maxResults < len(self._order):
+            response['nextPageToken'] = str(start + maxResults)
+        return response
+
+    def _list_next(self, previous_request, previous_response):
+        token = previous_response.get('nextPageToken')
+        if not token:
+            return None
+        return FakeRequest(self, self._list_messages,
+                           maxResults=previous_request.kwargs['maxResults'], pageToken=token)
+
+    def _get_message(self, id, format, metadataHeaders=None):
+        msg = self._messages.get(id)
+        if msg is None:
+            raise _http_error(404)
+        if format == 'metadata':
+            # Headers (optionally only the requested ones) and snippet; no parts or bodies
+            wanted = {h.lower() for h in metadataHeaders} if metadataHeaders else None
+            headers = [h for h in msg['payload']['headers'] if wanted is None or h['name'].lower() in wanted]
+            msg = dict(msg, payload={'mimeType': msg['payload']['mimeType'], 'headers': headers})
+        with self._lock:
+            self.bytes_sent += len(json.dumps(msg))
+        return msg
+
+    def _get_thread(self, id):
+        # Labels, dates and the From header of each message, like format='metadata' with metadataHeaders=['From']
+        with self._lock:
+            messages = [self._messages[i] for i in self._thread_ids.get(id, ())] + self._replies.get(id, [])
+        if not messages:
+            raise _http_error(404)
+        messages.sort(key=lambda m: int(m['internalDate']))
+        return {'id': id, 'messages': [
+            {'id': m['id'], 'threadId': id, 'labelIds': m['labelIds'], 'internalDate': m['internalDate'],
+             'payload': {'headers': [h for h in m['payload']['headers'] if h['name'] == 'From']}}
+            for m in messages
+        ]}
+
+    def _get_attachment(self, id):
+        data = f"fake attachment {id}".encode('utf-8')
+        return {'data': base64.urlsafe_b64encode(data).decode('ascii'), 'size': len(data)}
+
+    def _list_history(self, startHistoryId):
+        start = int(startHistoryId)
+        if start < self._oldest_history_id:
+            raise _http_error(404)
+        records = [dict(record, id=str(hid)) for hid, record in self._history if hid > start]
+        return {'history': records, 'historyId': str(self._history_id)}
+
+    def _build_message(self, msg_id, thread_id, subject):
+        subject = subject or self._rng.choice(SUBJECTS)
+        sent = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(minutes=self._next_id * 37)
+        text = (f"Hi,\n\nThis is message {msg_id} about {subject.lower()}.\n" + "lorem ipsum " * (self.body_size // 12))[:self.body_size]
+        headers = [
+            {'name': 'Subject', 'value': subject},
+            {'name': 'From', 'value': 'Me <me@example.com>'},
+            {'name': 'To', 'value': f"Recruiter {self._next_id % 50} <recruiter{self._next_id % 50}@example.org>"},
+            {'name': 'Date', 'value': sent.strftime('%a, %d %b %Y %H:%M:%S +0000')},
+        ]
+        parts = [
+            {'mimeType': 'text/plain', 'body': {'data': _b64(text)}},
+            {'mimeType': 'text/html', 'body': {'data': _b64(f"<p>{text}</p>")}},
+        ]
+        if self._next_id % 10 == 0:
+            parts.append({
+                'filename': 'resume.pdf', 'mimeType': 'application/pdf',
+                'body': {'attachmentId': f"att-{msg_id}", 'size': 48213},
+            })
+        return {
+            'id': msg_id,
+            'threadId': thread_id,
+            'labelIds': ['SENT'],
+            'snippet': text[:120],
+            'internalDate': str(int(sent.timestamp() * 1000)),
+            'payload': {'mimeType': 'multipart/mixed', 'headers': headers, 'parts': parts},
+        }
@@ -1,91 +1,319 @@
-import os.path
-import pickle
 import base64
 import email.utils
 import datetime
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+import itertools
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from googleapiclient.errors import HttpError
 
-SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
+from src.gmail_service import get_service_manager
+from src.sanitize import sanitize_html
+
+# Gmail accepts up to 100 calls per batch, but recommends <= 50 to avoid rate limiting
+DEFAULT_BATCH_SIZE = 50
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# googleapiclient retries 429/5xx with exponential backoff for single requests
+NUM_RETRIES = 5
+# Headers parse_message reads; format='metadata' fetches only these (plus the snippet)
+METADATA_HEADERS = ['Subject', 'From', 'To', 'Cc', 'Bcc', 'Date']
+
+
+class HistoryExpiredError(Exception):
+    """Raised when a stored historyId is older than Gmail's history window."""
 
 class GmailClient:
-    def __init__(self, credentials_path='credentials.json', token_path='token.pickle'):
+    def __init__(self, credentials_path='credentials.json', token_path='token.pickle', service=None):
         self.credentials_path = credentials_path
         self.token_path = token_path
-        self.service = None
+        # A prebuilt service (e.g. FakeGmailService) skips OAuth entirely
+        self.service = service
+        self.creds = None
+        self._manager = None
 
     def authenticate(self):
-        creds = None
-        if os.path.exists(self.token_path):
-            with open(self.token_path, 'rb') as token:
-                creds = pickle.load(token)
-        
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-            else:
-                if not os.path.exists(self.credentials_path):
-                    raise FileNotFoundError(f"Credentials file not found at {self.credentials_path}")
-                
-                flow = InstalledAppFlow.from_client_secrets_file(
-                    self.credentials_path, SCOPES)
-                creds = flow.run_local_server(port=0)
-            
-            with open(self.token_path, 'wb') as token:
-                pickle.dump(creds, token)
-
-        self.service = build('gmail', 'v1', credentials=creds)
-        print("Authentication successful.")
+        """Attaches the process-wide service; only the first call in a process loads credentials."""
+        self._manager = get_service_manager(self.credentials_path, self.token_path)
+        self.creds = self._manager.creds
+        self.service = self._manager.service
 
     def get_sent_messages(self, max_results=100):
         """Gets a list of messages from the user's sent box."""
+        messages_list = self.list_sent_message_ids(max_results=max_results)
+
+        print(f"Found {len(messages_list)} messages. Fetching details...")
+
+        # Batches complete out of order; restore the listing order (newest first)
+        order = {msg_id: i for i, msg_id in enumerate(messages_list)}
+        full_messages = list(self.iter_messages(messages_list))
+        full_messages.sort(key=lambda m: order[m['id']])
+        return full_messages
+
+    def list_sent_message_ids(self, max_results=100):
+        """Lists the IDs of the most recent sent messages, newest first."""
+        return list(self.iter_sent_message_ids(max_results=max_results))
+
+    def iter_sent_message_ids(self, max_results=100):
+        """
+        Yields sent message IDs page by page, newest first, without holding the
+        full listing. Raises if a page still fails after retries.
+        """
         if not self.service:
             raise Exception("Gmail Client not authenticated.")
 
-        messages_list = []
-        next_page_token = None
+        yielded = 0
         
         # Initial fetch
         request = self.service.users().messages().list(userId='me', labelIds=['SENT'], maxResults=min(max_results, 500))
         
-        while request is not None and len(messages_list) < max_results:
-            try:
-                response = request.execute()
-                messages = response.get('messages', [])
-                if not messages:
-                    break
-                    
-                messages_list.extend(messages)
-                
-                # Check if we need more
-                if len(messages_list) >= max_results:
-                    messages_list = messages_list[:max_results]
-                    break
+        while request is not None and yielded < max_results:
+            # A failed page is raised, not skipped: a silently truncated listing would look complete to the sync
+            response = request.execute(num_retries=NUM_RETRIES)
 
-                request = self.service.users().messages().list_next(previous_request=request, previous_response=response)
-            except Exception as e:
-                print(f"Error listing messages: {e}")
+            messages = response.get('messages', [])
+            if not messages:
                 break
 
-        print(f"Found {len(messages_list)} messages. Fetching details...")
-        
-        full_messages = []
-        for msg_meta in messages_list:
+            for m in messages[:max_results - yielded]:
+                yield m['id']
+            yielded += len(messages)
+
+            request = self.service.users().messages().list_next(previous_request=request, previous_response=response)
+
+    def get_history_id(self):
+        """Returns the mailbox's current historyId."""
+        if not self.service:
+            raise Exception("Gmail Client not authenticated.")
+        profile = self.service.users().getProfile(userId='me').execute(num_retries=NUM_RETRIES)
+        return profile['historyId']
+
+    def get_history_changes(self, start_history_id):
+        """
+        Lists sent-mail changes since start_history_id.
+        Returns (added_ids, deleted_ids, latest_history_id). Gmail messages are
+        immutable, so a SENT label change is treated as an add or a delete.
+        Raises HistoryExpiredError if start_history_id is too old.
+        """
+        if not self.service:
+            raise Exception("Gmail Client not authenticated.")
+
+        # Last event wins: a message added and then deleted ends up deleted
+        changes = {}
+        latest_history_id = start_history_id
+        request = self.service.users().history().list(
+            userId='me', startHistoryId=start_history_id, labelId='SENT',
+            historyTypes=['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved']
+        )
+
+        while request is not None:
             try:
-                full_msg = self._fetch_message_details(msg_meta['id'])
-                if full_msg:
-                    full_messages.append(full_msg)
+                response = request.execute(num_retries=NUM_RETRIES)
+            except HttpError as e:
+                if e.resp.status == 404:
+                    raise HistoryExpiredError(f"historyId {start_history_id} is no longer available")
+                raise
+
+            for record in response.get('history', []):
+                for item in record.get('messagesAdded', []):
+                    changes[item['message']['id']] = 'added'
+                for item in record.get('messagesDeleted', []):
+                    changes[item['message']['id']] = 'deleted'
+                for item in record.get('labelsAdded', []):
+                    if 'SENT' in item.get('labelIds', []):
+                        changes[item['message']['id']] = 'added'
+                for item in record.get('labelsRemoved', []):
+                    if 'SENT' in item.get('labelIds', []):
+                        changes[item['message']['id']] = 'deleted'
+
+            latest_history_id = response.get('historyId', latest_history_id)
+            request = self.service.users().history().list_next(previous_request=request, previous_response=response)
+
+        added = [msg_id for msg_id, change in changes.items() if change == 'added']
+        deleted = [msg_id for msg_id, change in changes.items() if change == 'deleted']
+        return added, deleted, latest_history_id
+
+    def get_message(self, msg_id):
+        """Fetches and parses a single message."""
+        if not self.service:
+            raise Exception("Gmail Client not authenticated.")
+        return self._fetch_message_details(msg_id)
+
+    def iter_messages(self, msg_ids, batch_size=DEFAULT_BATCH_SIZE, max_workers=4, max_retries=5, parse=True,
+                      format='full', on_failed=None):
+        """
+        Fetches messages in Gmail batch requests spread over a bounded worker pool.
+        Yields messages as each batch completes (not in input order). With
+        parse=False the raw API resources are yielded instead of parsed dicts.
+        format='metadata' fetches headers and snippet only (no bodies or
+        attachment list), a small fraction of the bytes.
+        on_failed(msg_id, reason) is called (from a worker thread) for each
+        message that couldn't be fetched; see _fetch_batch for the reasons.
+        """
+        fetch = lambda chunk: self._fetch_batch(chunk, max_retries, format, on_failed=on_failed)
+        for msg in self._iter_batches(msg_ids, batch_size, max_workers, fetch):
+            if not parse:
+                yield msg
+                continue
+            try:
+                yield self.parse_message(msg)
             except Exception as e:
-                print(f"Error fetching message {msg_meta['id']}: {e}")
-        
-        return full_messages
+                print(f"Error parsing message {msg.get('id')}: {e}")
+
+    def iter_thread_activity(self, thread_ids, batch_size=DEFAULT_BATCH_SIZE, max_workers=2, max_retries=5):
+        """
+        Yields parse_thread_activity() of each thread, fetched in batches with
+        only labels, dates and the From header of every message. This is how
+        replies are seen, since only sent mail is synced.
+        """
+        fetch = lambda chunk: self._fetch_batch(chunk, max_retries, make_request=self._thread_request)
+        for thread in self._iter_batches(thread_ids, batch_size, max_workers, fetch):
+            yield self.parse_thread_activity(thread)
+
+    def _iter_batches(self, ids, batch_size, max_workers, fetch):
+        """Runs fetch(chunk of ids) over a bounded worker pool, yielding results as each batch completes."""
+        if not self.service:
+            raise Exception("Gmail Client not authenticated.")
+
+        # ids may be a lazy iterator; it is only consumed as batches are submitted
+        ids = iter(ids)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            # Keep a bounded number of batches in flight so results stream instead of piling up
+            in_flight = set()
+            exhausted = False
+            while not exhausted or in_flight:
+                while not exhausted and len(in_flight) < max_workers * 2:
+                    chunk = list(itertools.islice(ids, batch_size))
+                    if not chunk:
+                        exhausted = True
+                        break
+                    in_flight.add(pool.submit(fetch, chunk))
+
+                if not in_flight:
+                    break
+
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+
+    def _fetch_batch(self, msg_ids, max_retries, format='full', make_request=None, on_failed=None):
+        """
+        Runs one batch of messages.get calls (or make_request(id) calls),
+        retrying 429/5xx items with backoff. Items that fail are passed to
+        on_failed(id, reason): 'deleted' for a 404 (gone since it was listed),
+        'permanent' for other errors a retry can't fix (e.g. 400), and
+        'transient' when retries ran out or the error wasn't an HTTP status.
+        """
+        make_request = make_request or (lambda msg_id: self._get_request(msg_id, format))
+        on_failed = on_failed or (lambda request_id, reason: None)
+        results = []
+        pending = list(msg_ids)
+        attempt = 0
+
+        while pending:
+            retry_ids = []
+            retry_after = [0]
+
+            def callback(request_id, response, exception):
+                if exception is None:
+                    results.append(response)
+                elif self._is_retryable(exception):
+                    retry_ids.append(request_id)
+                    retry_after[0] = max(retry_after[0], self._retry_after(exception))
+                else:
+                    print(f"Error fetching message {request_id}: {exception}")
+                    on_failed(request_id, self._failure_reason(exception))
+
+            batch = self.service.new_batch_http_request(callback=callback)
+            for msg_id in pending:
+                batch.add(make_request(msg_id), request_id=msg_id)
 
+            try:
+                batch.execute(http=self._thread_http())
+            except HttpError as e:
+                if not self._is_retryable(e):
+                    raise
+                # The whole batch was rejected, retry all of it
+                retry_ids = list(pending)
+                retry_after[0] = self._retry_after(e)
+
+            if not retry_ids:
+                break
+
+            attempt += 1
+            if attempt > max_retries:
+                print(f"Giving up on {len(retry_ids)} messages after {max_retries} retries.")
+                for msg_id in retry_ids:
+                    on_failed(msg_id, 'transient')
+                break
+
+            time.sleep(max(retry_after[0], self._backoff_delay(attempt)))
+            pending = retry_ids
+
+        return results
+
+    def _get_request(self, msg_id, format='full'):
+        if format == 'metadata':
+            return self.service.users().messages().get(userId='me', id=msg_id, format='metadata',
+                                                       metadataHeaders=METADATA_HEADERS)
+        return self.service.users().messages().get(userId='me', id=msg_id, format=format)
+
+    def _thread_request(self, thread_id):
+        return self.service.users().threads().get(userId='me', id=thread_id, format='metadata',
+                                                  metadataHeaders=['From'])
 
+    @staticmethod
+    def parse_thread_activity(thread):
+        """
+        Reply state of a thread resource: the number of messages not sent by
+        us and the (UTC, 'YYYY-MM-DD HH:MM:SS') date and sender of the latest one.
+        """
+        inbound = [m for m in thread.get('messages', [])
+                   if not {'SENT', 'DRAFT'} & set(m.get('labelIds', []))]
+        activity = {'thread_id': thread['id'], 'inbound_count': len(inbound),
+                    'last_inbound_date': None, 'last_inbound_sender': None}
+        if inbound:
+            latest = max(inbound, key=lambda m: int(m.get('internalDate', 0)))
+            sent = datetime.datetime.fromtimestamp(int(latest.get('internalDate', 0)) / 1000, datetime.timezone.utc)
+            activity['last_inbound_date'] = sent.strftime('%Y-%m-%d %H:%M:%S')
+            activity['last_inbound_sender'] = next(
+                (h['value'] for h in latest.get('payload', {}).get('headers', []) if h['name'].lower() == 'from'), None)
+        return activity
+
+    def _thread_http(self):
+        """httplib2 is not thread-safe, so each worker thread gets its own transport."""
+        if self._manager is None:
+            return None
+        return self._manager.http()
+
+    @staticmethod
+    def _is_retryable(exception):
+        return isinstance(exception, HttpError) and exception.resp.status in RETRYABLE_STATUSES
+
+    @staticmethod
+    def _failure_reason(exception):
+        if not isinstance(exception, HttpError):
+            return 'transient'
+        return 'deleted' if exception.resp.status == 404 else 'permanent'
+
+    @staticmethod
+    def _retry_after(exception):
+        try:
+            return float(exception.resp.get('retry-after', 0))
+        except (TypeError, ValueError):
+            return 0
+
+    @staticmethod
+    def _backoff_delay(attempt, base=0.5, cap=32.0):
+        # Exponential backoff with full jitter
+        return random.uniform(0, min(cap, base * (2 ** attempt)))
 
     def _fetch_message_details(self, msg_id):
-        msg = self.service.users().messages().get(userId='me', id=msg_id, format='full').execute()
-        
+        msg = self.service.users().messages().get(userId='me', id=msg_id, format='full').execute(num_retries=NUM_RETRIES)
+        return self.parse_message(msg)
+
+    def parse_message(self, msg):
+        """Parses a raw Gmail message resource into the dict stored in the DB."""
         payload = msg.get('payload', {})
         headers = payload.get('headers', [])
         
@@ -104,13 +332,15 @@ class GmailClient:
         except Exception:
             date = raw_date # Fallback
         
-        # Parse Body and Attachments
+        # Parse Body and Attachments. HTML is sanitized once here, so views can render it as stored.
         body_text, body_html = self._parse_body(payload)
+        body_html = sanitize_html(body_html)
         attachments = self._parse_attachments(payload)
 
         return {
             'id': msg['id'],
             'threadId': msg['threadId'],
+            'historyId': msg.get('historyId'),
             'snippet': msg.get('snippet', ''),
             'subject': subject,
             'sender': sender,
@@ -187,7 +417,7 @@ class GmailClient:
             
         attachment = self.service.users().messages().attachments().get(
             userId='me', messageId=msg_id, id=attachment_id
-        ).execute()
+        ).execute(http=self._thread_http(), num_retries=NUM_RETRIES)
         
         data = attachment.get('data')
         if data:
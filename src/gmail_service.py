@@ -0,0 +1,133 @@
+import datetime
+import os
+import pickle
+import tempfile
+import threading
+
+import httplib2
+import google_auth_httplib2
+from google.auth.transport.requests import Request
+from google_auth_oauthlib.flow import InstalledAppFlow
+from googleapiclient.discovery import build
+from googleapiclient.http import HttpRequest
+
+SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
+
+# Refresh the access token this long before it expires
+REFRESH_MARGIN = 300
+
+
+class GmailServiceManager:
+    """
+    One authenticated Gmail service per process. Credentials are loaded (or
+    obtained through the OAuth flow) once, the service is built once from the
+    discovery document bundled with googleapiclient (no network fetch), and a
+    daemon thread refreshes the access token before it expires.
+    httplib2 is not thread-safe, so every request is built on a transport
+    owned by the calling thread; the service can be shared by any number of
+    threads, and each thread reuses its own connections.
+    """
+    def __init__(self, credentials_path='credentials.json', token_path='token.pickle', refresh_margin=REFRESH_MARGIN):
+        self.credentials_path = credentials_path
+        self.token_path = token_path
+        self.refresh_margin = refresh_margin
+        self.creds = None
+        self.service = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._refresher = None
+
+    def start(self):
+        """Authenticates and builds the service (once). Returns self."""
+        with self._lock:
+            if self.service is None:
+                self.creds = self._load_credentials()
+                self.service = build('gmail', 'v1', credentials=self.creds, requestBuilder=self._build_request,
+                                     static_discovery=True, cache_discovery=False)
+                self._refresher = threading.Thread(target=self._refresh_loop, name="gmail-token-refresh", daemon=True)
+                self._refresher.start()
+                print("Authentication successful.")
+        return self
+
+    def http(self):
+        """This thread's authorized transport."""
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = google_auth_httplib2.AuthorizedHttp(self.creds, http=httplib2.Http())
+            self._local.http = http
+        return http
+
+    def stop(self):
+        self._stop.set()
+
+    def _build_request(self, _http, *args, **kwargs):
+        # Ignore the service's shared transport and use the calling thread's
+        return HttpRequest(self.http(), *args, **kwargs)
+
+    def _load_credentials(self):
+        creds = None
+        if os.path.exists(self.token_path):
+            with open(self.token_path, 'rb') as token:
+                creds = pickle.load(token)
+
+        if not creds or not creds.valid:
+            if creds and creds.expired and creds.refresh_token:
+                creds.refresh(Request())
+            else:
+                if not os.path.exists(self.credentials_path):
+                    raise FileNotFoundError(f"Credentials file not found at {self.credentials_path}")
+
+                flow = InstalledAppFlow.from_client_secrets_file(
+                    self.credentials_path, SCOPES)
+                creds = flow.run_local_server(port=0)
+            self._save(creds)
+        return creds
+
+    def _save(self, creds):
+        # Write then rename, so a crash mid-write can't corrupt the token
+        directory = os.path.dirname(os.path.abspath(self.token_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.token-')
+        with os.fdopen(fd, 'wb') as token:
+            pickle.dump(creds, token)
+        os.replace(tmp_path, self.token_path)
+
+    def _seconds_until_refresh(self):
+        expiry = self.creds.expiry
+        if expiry is None:
+            return None
+        # google-auth keeps expiry as naive UTC
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        return (expiry - now).total_seconds() - self.refresh_margin
+
+    def _refresh_loop(self):
+        while True:
+            delay = self._seconds_until_refresh()
+            if delay is None:
+                # No expiry known (e.g. not a user token); nothing to schedule
+                return
+            if self._stop.wait(max(delay, 0)):
+                return
+            try:
+                with self._lock:
+                    self.creds.refresh(Request())
+                    self._save(self.creds)
+                print("Refreshed Gmail access token.")
+            except Exception as e:
+                print(f"Token refresh failed, retrying in 60s: {e}")
+                if self._stop.wait(60):
+                    return
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_service_manager(credentials_path='credentials.json', token_path='token.pickle'):
+    """The process-wide, started manager for these credentials."""
+    key = (os.path.abspath(credentials_path), os.path.abspath(token_path))
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            manager = _managers[key] = GmailServiceManager(credentials_path, token_path)
+    return manager.start()
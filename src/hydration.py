@@ -0,0 +1,110 @@
+import json
+import threading
+import time
+
+DEFAULT_PREFETCH_BATCH = 25
+# Pause between prefetch batches, so on-demand hydration and sync get the network first
+DEFAULT_PREFETCH_DELAY = 1.0
+
+
+class BodyHydrator:
+    """
+    Downloads the bodies and attachment lists of emails synced in metadata
+    mode: on demand for whatever is being opened (hydrate()), and in the
+    background, newest first, a small batch at a time (wake()).
+    client_factory returns an authenticated GmailClient.
+    """
+    def __init__(self, db, client_factory=None, batch_size=DEFAULT_PREFETCH_BATCH, delay=DEFAULT_PREFETCH_DELAY):
+        self.db = db
+        self.client_factory = client_factory or _default_client
+        self.batch_size = batch_size
+        self.delay = delay
+        self.hydrated = 0
+        self.prefetched = 0
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._on_demand = 0
+        self._wake = threading.Event()
+        self._thread = None
+
+    def client(self):
+        if self._client is None:
+            # Authenticating can take a while (or open a browser); only other callers of client() wait on it
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self.client_factory()
+        return self._client
+
+    def hydrate(self, emails):
+        """
+        Fills in body_text/body_html/attachments of any email dicts (DB rows)
+        that only have metadata, in place, with one batched fetch. Returns emails.
+        """
+        missing = [e for e in emails if e.get('body_state') == 'metadata']
+        if not missing:
+            return emails
+        with self._lock:
+            self._on_demand += 1
+        try:
+            fetched = {m['id']: m for m in self._fetch(list(dict.fromkeys(e['id'] for e in missing)))}
+        except Exception as e:
+            # Still serve what we have (subject, snippet) if Gmail can't be reached
+            print(f"Error hydrating email bodies: {e}")
+            return emails
+        finally:
+            with self._lock:
+                self._on_demand -= 1
+        for email in missing:
+            message = fetched.get(email['id'])
+            if message is not None:
+                email.update(body_text=message['body_text'], body_html=message['body_html'],
+                             attachments=json.dumps(message['attachments']), body_state='full')
+        self.hydrated += len(fetched)
+        return emails
+
+    def wake(self):
+        """Starts (or resumes) the background prefetcher; it stops once nothing is left to hydrate."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._prefetch, name="body-prefetch", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def stats(self):
+        return {'hydrated': self.hydrated, 'prefetched': self.prefetched,
+                'prefetching': self._thread is not None and self._thread.is_alive()}
+
+    def _fetch(self, email_ids):
+        """Fetches full messages and stores their bodies. Returns the parsed messages."""
+        messages = list(self.client().iter_messages(email_ids, batch_size=self.batch_size, max_workers=1))
+        if messages:
+            self.db.update_bodies(messages)
+        return messages
+
+    def _prefetch(self):
+        # Messages Gmail didn't return (e.g. deleted since the sync) are skipped for the rest of this run
+        failed = set()
+        while True:
+            self._wake.clear()
+            # Interactive hydration goes first
+            while self._on_demand:
+                time.sleep(0.1)
+            ids = [i for i in self.db.get_unhydrated_ids(self.batch_size + len(failed)) if i not in failed]
+            if not ids:
+                return
+            try:
+                fetched = {m['id'] for m in self._fetch(ids)}
+            except Exception as e:
+                print(f"Error prefetching email bodies: {e}")
+                return
+            self.prefetched += len(fetched)
+            failed.update(i for i in ids if i not in fetched)
+            self._wake.wait(self.delay)
+
+
+def _default_client():
+    from src.gmail_client import GmailClient
+    client = GmailClient()
+    client.authenticate()
+    return client
@@ -0,0 +1,291 @@
+import queue
+import threading
+import time
+
+_DONE = object()
+
+
+class SyncPipeline:
+    """
+    Streaming sync: fetch -> parse -> classify -> batched write
+    (-> attachment prefetch, when an AttachmentStore is given)
+    (-> embedding, when an EmbeddingIndex is given).
+    Each stage runs on its own thread and hands items to the next one through
+    a bounded queue, so network, inference and SQLite time overlap and memory
+    stays flat no matter how many messages are synced. Rows are committed as
+    each write batch fills (or flush_interval elapses), so they show up in the
+    API while the sync is still running.
+    With message_format='metadata' only headers and snippets are fetched
+    (all classification needs); bodies are filled in later by BodyHydrator.
+    Setting the `cancel` event stops the pipeline early: queued messages are
+    dropped, and anything already written stays written.
+    Messages that can never be stored end up in `gone` (deleted since they
+    were listed) or `skipped` (rejected by Gmail or unparseable); `failed`
+    counts the ones worth retrying.
+    """
+    def __init__(self, client, db, ai, cache=None, queue_size=64, write_batch_size=25, flush_interval=1.0,
+                 fetch_batch_size=50, fetch_workers=4, classify_batch_size=16, attachments=None,
+                 cancel=None, on_stored=None, message_format='full', embeddings=None, embed_batches=4):
+        self.client = client
+        self.db = db
+        self.ai = ai
+        # Optional ClassificationCache; a hit skips both the heuristic and the LLM
+        self.cache = cache
+        self.queue_size = queue_size
+        self.write_batch_size = write_batch_size
+        self.flush_interval = flush_interval
+        self.fetch_batch_size = fetch_batch_size
+        self.fetch_workers = fetch_workers
+        self.classify_batch_size = classify_batch_size
+        # Optional AttachmentStore; stored messages then get their attachments downloaded
+        self.attachments = attachments
+        # Optional EmbeddingIndex; stored batches are embedded up to embed_batches at a time
+        self.embeddings = embeddings
+        self.embed_batches = embed_batches
+        self.cancel = cancel
+        self.message_format = message_format
+        # Called from the write thread with each committed batch
+        self.on_stored = on_stored
+        self.stats = {'listed': 0, 'fetched': 0, 'classified': 0, 'stored': 0, 'failed': 0, 'gone': 0, 'skipped': 0,
+                      'attachments': 0, 'embedded': 0}
+        self.gone = []
+        self.skipped = []
+        self._stats_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._errors = []
+
+    def run(self, msg_ids):
+        """Runs the pipeline over msg_ids (any iterable, consumed lazily). Returns the stats dict."""
+        parse_q = queue.Queue(maxsize=self.queue_size)
+        classify_q = queue.Queue(maxsize=self.queue_size)
+        write_q = queue.Queue(maxsize=self.queue_size)
+        # The write stage feeds the optional stages after it
+        outputs = {}
+        if self.attachments:
+            outputs['attachments'] = queue.Queue(maxsize=self.queue_size)
+        if self.embeddings:
+            outputs['embeddings'] = queue.Queue(maxsize=self.queue_size)
+
+        stages = [
+            threading.Thread(target=self._guard, args=(self._fetch_stage, msg_ids, parse_q), name='sync-fetch'),
+            threading.Thread(target=self._guard, args=(self._parse_stage, parse_q, classify_q), name='sync-parse'),
+            threading.Thread(target=self._guard, args=(self._classify_stage, classify_q, write_q), name='sync-classify'),
+            threading.Thread(target=self._guard, args=(self._write_stage, write_q, outputs), name='sync-write'),
+        ]
+        if 'attachments' in outputs:
+            stages.append(threading.Thread(target=self._guard, args=(self._prefetch_stage, outputs['attachments'], None),
+                                           name='sync-attachments'))
+        if 'embeddings' in outputs:
+            stages.append(threading.Thread(target=self._guard, args=(self._embed_stage, outputs['embeddings'], None),
+                                           name='sync-embeddings'))
+        for t in stages:
+            t.start()
+        for t in stages:
+            t.join()
+
+        if self._errors:
+            raise self._errors[0]
+        return self.stats
+
+    # --- Stages ---
+    def _fetch_stage(self, msg_ids, out_q):
+        def counted(ids):
+            for msg_id in ids:
+                if self._stopping():
+                    return
+                self._count('listed')
+                yield msg_id
+
+        raw_messages = self.client.iter_messages(
+            counted(msg_ids), batch_size=self.fetch_batch_size, max_workers=self.fetch_workers, parse=False,
+            format=self.message_format, on_failed=self._fetch_failed,
+        )
+        for raw in raw_messages:
+            self._count('fetched')
+            if not self._put(out_q, raw):
+                return
+
+    def _parse_stage(self, in_q, out_q):
+        for raw in self._drain(in_q):
+            try:
+                email = self.client.parse_message(raw)
+            except Exception as e:
+                print(f"Error parsing message {raw.get('id')}: {e}")
+                self._count('skipped')
+                with self._stats_lock:
+                    self.skipped.append(raw.get('id'))
+                continue
+            if self.message_format == 'metadata':
+                email['body_state'] = 'metadata'
+            if not self._put(out_q, email):
+                return
+
+    def _classify_stage(self, in_q, out_q):
+        try:
+            # Classify whatever has queued up together, so ambiguous emails share one forward pass
+            for batch in self._drain_batches(in_q, self.classify_batch_size):
+                misses = []
+                for email in batch:
+                    cached = self.cache.get(email['subject'], email['snippet']) if self.cache else None
+                    if cached is None:
+                        misses.append(email)
+                    else:
+                        email['is_job_related'], email['job_probability'] = int(cached[0]), cached[1]
+                        email['label_source'] = 'cache'
+
+                if misses:
+                    items = [(e['subject'], e['snippet']) for e in misses]
+                    classify_sources = getattr(self.ai, 'classify_batch_sources', None)
+                    if classify_sources is not None:
+                        results, sources = classify_sources(items)
+                    else:
+                        results, sources = self.ai.classify_batch(items), ['llm'] * len(items)
+                    for email, (is_job, probability), source in zip(misses, results, sources):
+                        email['is_job_related'], email['job_probability'] = (1 if is_job else 0), probability
+                        email['label_source'] = source
+                        # The trained model changes with every retrain, so only its inputs' labels are kept
+                        if self.cache and source != 'model':
+                            self.cache.put(email['subject'], email['snippet'], is_job, probability)
+
+                for email in batch:
+                    self._count('classified')
+                    if not self._put(out_q, email):
+                        return
+        finally:
+            if self.cache:
+                self.cache.flush()
+
+    def _write_stage(self, in_q, outputs):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            timeout = max(0.0, deadline - time.monotonic())
+            try:
+                item = in_q.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _DONE:
+                self._flush(batch, outputs)
+                return
+            if item is not None:
+                batch.append(item)
+
+            if len(batch) >= self.write_batch_size or time.monotonic() >= deadline:
+                self._flush(batch, outputs)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+    def _flush(self, batch, outputs=None):
+        if not batch:
+            return
+        if self.db.upsert_many(batch):
+            self._count('stored', len(batch))
+            if self.on_stored is not None:
+                try:
+                    self.on_stored(batch)
+                except Exception as e:
+                    print(f"Error in on_stored callback: {e}")
+            outputs = outputs or {}
+            if 'embeddings' in outputs:
+                self._put(outputs['embeddings'], batch)
+            if 'attachments' in outputs:
+                for email in batch:
+                    if email.get('attachments') and not self._put(outputs['attachments'], email):
+                        break
+        else:
+            self._count('failed', len(batch))
+        print(f"Stored {self.stats['stored']} emails so far...")
+
+    def _prefetch_stage(self, in_q, _):
+        # Failures are logged per attachment and never fail the sync; the API fetches on demand instead
+        for email in self._drain(in_q):
+            self._count('attachments', self.attachments.prefetch(self.client, email))
+
+    def _embed_stage(self, in_q, _):
+        # Stored batches that queued up while the model was busy are embedded together
+        for batches in self._drain_batches(in_q, self.embed_batches):
+            try:
+                self._count('embedded', self.embeddings.add([email for batch in batches for email in batch]))
+            except Exception as e:
+                # The next sync's backfill picks these up
+                print(f"Error embedding emails: {e}")
+
+    def _fetch_failed(self, msg_id, reason):
+        # Runs on the client's fetch workers
+        with self._stats_lock:
+            if reason == 'deleted':
+                self.stats['gone'] += 1
+                self.gone.append(msg_id)
+            elif reason == 'permanent':
+                self.stats['skipped'] += 1
+                self.skipped.append(msg_id)
+            else:
+                self.stats['failed'] += 1
+
+    # --- Plumbing ---
+    def _stopping(self):
+        return self._stop.is_set() or (self.cancel is not None and self.cancel.is_set())
+
+    def _count(self, key, n=1):
+        with self._stats_lock:
+            self.stats[key] += n
+
+    def _guard(self, stage, in_arg, out_q):
+        """Runs a stage, always signalling the next stage when it ends (or fails)."""
+        try:
+            stage(in_arg, out_q)
+        except Exception as e:
+            self._errors.append(e)
+            self._stop.set()
+        finally:
+            for q in (out_q.values() if isinstance(out_q, dict) else [out_q]):
+                if q is not None:
+                    self._put(q, _DONE, force=True)
+
+    def _put(self, q, item, force=False):
+        """Blocking put that gives up when the pipeline is stopping (backpressure without deadlock)."""
+        while True:
+            if self._stopping() and not force:
+                return False
+            try:
+                q.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                if self._stopping() and force:
+                    # Downstream may have died; make room for the sentinel
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def _drain_batches(self, q, max_size):
+        """Like _drain, but yields whatever is already queued (up to max_size) as one list."""
+        while True:
+            item = q.get()
+            if item is _DONE:
+                return
+            batch = [item]
+            done = False
+            while len(batch) < max_size:
+                try:
+                    item = q.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _DONE:
+                    done = True
+                    break
+                batch.append(item)
+            if not self._stopping():
+                yield batch
+            if done:
+                return
+
+    def _drain(self, q):
+        while True:
+            item = q.get()
+            if item is _DONE:
+                return
+            if self._stopping():
+                continue
+            yield item
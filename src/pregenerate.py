@@ -0,0 +1,137 @@
+import os
+import threading
+import time
+
+from src.context import thread_version, DRAFT_PROMPT_VERSION
+from src.threads import utc_cutoff
+
+# The UI's default instructions, so opening a stale thread finds its draft
+DEFAULT_CONTEXT = "I haven't heard back yet. Keep it short and polite."
+DEFAULT_STALE_DAYS = 5
+DEFAULT_PREGENERATE_LIMIT = 20
+# Seconds of generation per wake(), and the share of wall time it may take
+DEFAULT_BUDGET_SECONDS = 300
+DEFAULT_DUTY = 0.5
+# Seconds the scheduler must have been idle before a draft is started
+DEFAULT_QUIET_SECONDS = 5
+
+
+def draft_key(cache, ai, email, thread, context):
+    """DraftCache key of a follow-up to email with this thread and context, as generated by ai."""
+    return cache.key(email['id'], thread_version(thread), context, ai.model_id, DRAFT_PROMPT_VERSION,
+                     ai.draft_params)
+
+
+class DraftPregenerator:
+    """
+    Writes follow-up drafts for stale threads (awaiting a reply, last written
+    to more than stale_days ago, newest first) into the DraftCache while the
+    model has nothing else to do, so opening one shows its draft at once.
+    ai is a ScheduledEngine at IDLE priority. Drafts are streamed and dropped
+    at the next token as soon as other work is queued, then retried once the
+    scheduler has been idle for quiet seconds again. Each wake() generates
+    for at most budget seconds, pausing between drafts so generation takes at
+    most duty of the time. hydrate downloads missing bodies of a thread.
+    """
+    def __init__(self, db, cache, ai, hydrate=None, context=DEFAULT_CONTEXT, stale_days=None, limit=None,
+                 budget=None, duty=DEFAULT_DUTY, quiet=DEFAULT_QUIET_SECONDS):
+        self.db = db
+        self.cache = cache
+        self.ai = ai
+        self.hydrate = hydrate or (lambda thread: thread)
+        self.context = context
+        if stale_days is None:
+            stale_days = float(os.environ.get('MAUTO_PREGENERATE_DAYS', DEFAULT_STALE_DAYS))
+        if limit is None:
+            limit = int(os.environ.get('MAUTO_PREGENERATE_LIMIT', DEFAULT_PREGENERATE_LIMIT))
+        if budget is None:
+            budget = float(os.environ.get('MAUTO_PREGENERATE_BUDGET', DEFAULT_BUDGET_SECONDS))
+        if not 0 < duty <= 1:
+            raise ValueError(f"duty must be in (0, 1], got {duty}")
+        self.stale_days = stale_days
+        self.limit = limit
+        self.budget = budget
+        self.duty = duty
+        self.quiet = quiet
+        self.generated = 0
+        self.interrupted = 0
+        self.failed = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def wake(self):
+        """Starts a pass over the stale threads unless one is running; it stops when done or out of budget."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._pregenerate, name="draft-pregenerate", daemon=True)
+                self._thread.start()
+
+    def stats(self):
+        return {'generated': self.generated, 'interrupted': self.interrupted, 'failed': self.failed,
+                'seconds': round(self.seconds, 1), 'running': self._thread is not None and self._thread.is_alive()}
+
+    def _pregenerate(self):
+        spent = 0.0
+        try:
+            stale = self.db.list_threads(awaiting_reply=True, sent_before=utc_cutoff(days=self.stale_days),
+                                         limit=self.limit)
+        except Exception as e:
+            print(f"Error listing stale threads: {e}")
+            return
+        for row in stale:
+            try:
+                thread = self.hydrate(self.db.get_thread(row['thread_id']))
+            except Exception as e:
+                # e.g. Gmail unreachable; the thread is tried again next pass
+                print(f"Error loading thread {row['thread_id']} for pre-generation: {e}")
+                self.failed += 1
+                continue
+            email = next((m for m in thread if m['id'] == row['last_email_id']), None)
+            if email is None:
+                continue
+            key = draft_key(self.cache, self.ai, email, thread, self.context)
+            draft = None
+            while draft is None and not self.cache.contains(key):
+                if spent >= self.budget:
+                    print(f"Draft pre-generation stopped after {spent:.0f}s (budget {self.budget:.0f}s)")
+                    return
+                self._wait_for_idle()
+                start = time.monotonic()
+                try:
+                    draft = self._generate(email, thread)
+                except Exception as e:
+                    print(f"Error pre-generating a draft for thread {row['thread_id']}: {e}")
+                    self.failed += 1
+                    break
+                finally:
+                    elapsed = time.monotonic() - start
+                    spent += elapsed
+                    self.seconds += elapsed
+                if draft is None:
+                    self.interrupted += 1
+                else:
+                    self.cache.put(key, email['id'], draft, self.ai.model_id, DRAFT_PROMPT_VERSION)
+                    self.generated += 1
+                # Leave the rest of the time to everything else
+                time.sleep(elapsed * (1 - self.duty) / self.duty)
+
+    def _wait_for_idle(self):
+        while True:
+            idle = self.ai.scheduler.idle_for()
+            if idle >= self.quiet:
+                return
+            time.sleep(min(self.quiet - idle, 1.0))
+
+    def _generate(self, email, thread):
+        """The draft, or None if other work arrived first (the decoding is stopped at the next token)."""
+        tokens = self.ai.stream_follow_up(email, context=self.context, thread=thread)
+        draft = []
+        try:
+            for token in tokens:
+                if not self.ai.scheduler.idle_for():
+                    return None
+                draft.append(token)
+        finally:
+            tokens.close()
+        return "".join(draft)
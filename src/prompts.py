@@ -1,10 +1,14 @@
+# Templates keep their fixed instructions first and the per-call values last,
+# so the backend can reuse the prefilled instruction prefix across calls.
+
 FOLLOW_UP_TEMPLATE = """
 You are an expert AI assistant helping me write professional emails.
+Your goal: Write a polite, professional, and concise follow-up email to an email I sent.
+
 I sent an email to {recipient} about "{subject}" on {date}.
-Here is the email thread content:
+Here is the email thread, newest message first:
 {thread_content}
 
-Your goal: Write a polite, professional, and concise follow-up email.
 Context: {context}
 Draft:
 """
@@ -33,12 +37,30 @@ Decision:
 
 FILTER_TEMPLATE = """
 You are an email filtering assistant. Given a list of email metadata and a natural language prompt, return a JSON list of email IDs that match the criteria.
+Return ONLY a JSON list of IDs.
+Example: ["msg1", "msg2"]
+
 Prompt: "{prompt}"
 
 Emails:
 {metadata_list}
 
-Return ONLY a JSON list of IDs.
-Example: ["msg1", "msg2"]
 Result:
 """
+
+FILTER_QUERY_TEMPLATE = """
+You are an email search assistant. Convert a natural language request about my sent emails into a structured query.
+Respond with ONLY a JSON object with these keys (use null when the request does not constrain it):
+- "keywords": list of words or short phrases that should appear in the email, or []
+- "sender": name or address the email was sent from, or null
+- "recipient": name or address the email was sent to, or null
+- "date_from": earliest date as "YYYY-MM-DD", or null
+- "date_to": latest date as "YYYY-MM-DD", or null
+- "is_job": true for job/career related emails, false for unrelated ones, or null
+
+Example: {{"keywords": ["internship"], "sender": null, "recipient": "google.com", "date_from": null, "date_to": "2025-01-31", "is_job": true}}
+
+Today is {today}.
+Request: "{prompt}"
+JSON:
+"""
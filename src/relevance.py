@@ -0,0 +1,286 @@
+import datetime
+import hashlib
+import json
+import os
+import re
+import threading
+import zlib
+from functools import lru_cache
+
+import numpy as np
+
+from src.prompts import CLASSIFICATION_TEMPLATE
+
+# 1. Obvious Job Keywords (High Confidence YES)
+JOB_KEYWORDS = [
+    "job", "internship", "intern ", "career", "vacancy", "opening", 
+    "hiring", "recruitment", "application", "applied", "position", 
+    "role", "candidate", "interview", "offer", "resume", "cv ", "linkedin",
+    "handshake", "workday", "greenhouse", "lever", "smartrecruiters",
+    "thank you for applying", "your application", "employment"
+]
+
+# 2. Obvious Non-Job Keywords (High Confidence NO)
+TRASH_KEYWORDS = [
+    "newsletter", "unsubscribe", "sale", "discount", "promotional",
+    "subscription", "billing", "receipt", "verification code", "otp",
+    "marketing", "advertisement", "daily digest"
+]
+
+# Changes whenever the prompt or the keyword heuristic changes, so cached
+# classifications made under an older version stop matching.
+CLASSIFIER_VERSION = hashlib.sha256(
+    (CLASSIFICATION_TEMPLATE + repr(JOB_KEYWORDS) + repr(TRASH_KEYWORDS)).encode('utf-8')
+).hexdigest()[:12]
+
+
+def keyword_scores(subject, snippet):
+    text = (subject + " " + snippet).lower()
+    job_score = sum(1 for kw in JOB_KEYWORDS if kw in text)
+    trash_score = sum(1 for kw in TRASH_KEYWORDS if kw in text)
+    return job_score, trash_score
+
+
+def keyword_decision(subject, snippet):
+    """Returns True/False for high-confidence keyword matches, None if ambiguous."""
+    job_score, trash_score = keyword_scores(subject, snippet)
+    if job_score >= 2 and trash_score == 0:
+        return True # High confidence Job
+    if trash_score >= 2 and job_score == 0:
+        return False # High confidence Irrelevant
+    return None
+
+
+DEFAULT_MODEL_PATH = 'relevance_model.npz'
+# The model decides when it is at least this sure either way; the rest goes to the LLM
+DEFAULT_CONFIDENCE = 0.9
+# User corrections count this many times as much as labels the classifier produced itself
+CORRECTION_WEIGHT = 5.0
+MIN_TRAINING_EXAMPLES = 200
+MIN_EXAMPLES_PER_CLASS = 20
+
+_TOKEN_RE = re.compile(r"[a-z0-9][a-z0-9'+#.-]*")
+_BIGRAM_PRIME = np.uint64(1000003)
+_SUBJECT_SALT = np.uint64(0x9E3779B97F4A7C15)
+
+
+@lru_cache(maxsize=65536)
+def _token_hash(token):
+    return zlib.crc32(token.encode('utf-8'))
+
+
+def _hashes(text):
+    return np.fromiter((_token_hash(t) for t in _TOKEN_RE.findall(text.lower())), dtype=np.uint64)
+
+
+class RelevanceModel:
+    """
+    Logistic regression over hashed word and word-pair features of subject
+    and snippet (subject words also get their own features). Pure NumPy:
+    a batch is scored with one sparse dot product, and training is
+    full-batch AdaGrad, a few seconds for 100k emails.
+    """
+    def __init__(self, dim=2 ** 18, weights=None, bias=0.0, meta=None):
+        self.dim = dim
+        self.weights = np.zeros(dim, dtype=np.float32) if weights is None else weights
+        self.bias = float(bias)
+        self.meta = meta or {}
+
+    def features(self, items):
+        """Sparse rows for (subject, snippet) pairs: (row index, column, value) arrays, rows L2-normalized."""
+        rows, cols = [], []
+        mask = np.uint64(self.dim - 1)
+        for i, (subject, snippet) in enumerate(items):
+            subject_h = _hashes(subject or '')
+            words = np.concatenate([subject_h, _hashes(snippet or '')])
+            bigrams = words[:-1] * _BIGRAM_PRIME + words[1:]
+            features = np.unique(np.concatenate([words, bigrams, subject_h ^ _SUBJECT_SALT]) & mask)
+            rows.append(np.full(len(features), i, dtype=np.int64))
+            cols.append(features.astype(np.int64))
+        if not rows:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        counts = np.bincount(rows, minlength=len(items))
+        values = (1.0 / np.sqrt(np.maximum(counts, 1)))[rows].astype(np.float32)
+        return rows, cols, values
+
+    def predict_proba(self, items, features=None):
+        """P(job-related) for each (subject, snippet) pair, in one vectorized pass."""
+        rows, cols, values = features if features is not None else self.features(items)
+        z = np.bincount(rows, weights=self.weights[cols] * values, minlength=len(items)) + self.bias
+        return 1.0 / (1.0 + np.exp(-z))
+
+    def fit(self, items, labels, sample_weight=None, epochs=150, learning_rate=0.5, l2=1e-6):
+        """Trains from scratch. Classes are re-weighted to count equally. Returns self."""
+        y = np.asarray(labels, dtype=np.float64)
+        sw = np.ones(len(y)) if sample_weight is None else np.asarray(sample_weight, dtype=np.float64)
+        positives = sw[y == 1].sum()
+        negatives = sw[y == 0].sum()
+        sw = sw * np.where(y == 1, sw.sum() / (2 * max(positives, 1e-9)), sw.sum() / (2 * max(negatives, 1e-9)))
+        sw /= sw.sum()
+
+        features = self.features(items)
+        rows, cols, values = features
+        w = np.zeros(self.dim)
+        b = 0.0
+        g_w = np.full(self.dim, 1e-8)
+        g_b = 1e-8
+        self.weights, self.bias = w, b
+        for _ in range(epochs):
+            error = (self.predict_proba(items, features) - y) * sw
+            grad_w = np.bincount(cols, weights=error[rows] * values, minlength=self.dim) + l2 * w
+            grad_b = error.sum()
+            g_w += grad_w ** 2
+            g_b += grad_b ** 2
+            w -= learning_rate * grad_w / np.sqrt(g_w)
+            b -= learning_rate * grad_b / np.sqrt(g_b)
+            self.weights, self.bias = w, b
+        self.weights = w.astype(np.float32)
+        self.meta = {'examples': len(y), 'positives': int((y == 1).sum()),
+                     'trained_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')}
+        return self
+
+    def save(self, path):
+        # Written next to the target and renamed, so a reader never loads half a file
+        tmp = f"{path}.tmp.npz"
+        np.savez_compressed(tmp, weights=self.weights, bias=self.bias, dim=self.dim,
+                            meta=np.array(json.dumps(self.meta)))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(int(data['dim']), data['weights'], float(data['bias']), json.loads(str(data['meta'])))
+
+
+def training_data(db):
+    """
+    (items, labels, weights) from the stored labels the keywords or the LLM
+    decided, plus user corrections (which take precedence). The model's own
+    decisions are left out, so it never trains on itself.
+    """
+    rows = db.get_relevance_training_rows()
+    items = [(r['subject'] or '', r['snippet'] or '') for r in rows]
+    labels = [1 if r['is_job_related'] else 0 for r in rows]
+    weights = [CORRECTION_WEIGHT if r['corrected'] else 1.0 for r in rows]
+    return items, labels, weights
+
+
+def train_relevance_model(db, path=None):
+    """
+    Trains a RelevanceModel on the DB's labels and saves it. Returns the
+    model, or None when there isn't enough data of both classes yet.
+    """
+    items, labels, weights = training_data(db)
+    positives = sum(labels)
+    if len(labels) < MIN_TRAINING_EXAMPLES or min(positives, len(labels) - positives) < MIN_EXAMPLES_PER_CLASS:
+        print(f"Not enough labeled emails to train the relevance model yet ({len(labels)}, {positives} job-related).")
+        return None
+    model = RelevanceModel().fit(items, labels, weights)
+    model.meta['corrections'] = int(sum(1 for w in weights if w == CORRECTION_WEIGHT))
+    model.save(path or default_model_path())
+    print(f"Trained the relevance model on {len(labels)} emails ({positives} job-related).")
+    return model
+
+
+def train_if_stale(db, path=None, growth=0.25):
+    """
+    Retrains when there is no model yet, the user corrected labels since it
+    was trained, or the mailbox grew by `growth`. Returns the new model or None.
+    """
+    path = path or default_model_path()
+    if os.path.exists(path):
+        meta = RelevanceModel.load(path).meta
+        row = db.query_one('''
+            SELECT (SELECT COUNT(*) FROM emails WHERE label_source IS NOT 'model') AS emails,
+                   (SELECT COUNT(*) FROM relevance_corrections) AS corrections
+        ''')
+        if row['corrections'] == meta.get('corrections') and row['emails'] < meta.get('examples', 0) * (1 + growth):
+            return None
+    return train_relevance_model(db, path)
+
+
+def default_model_path():
+    return os.environ.get('MAUTO_RELEVANCE_MODEL', DEFAULT_MODEL_PATH)
+
+
+class RelevanceClassifier:
+    """
+    Classifies whole batches cheaply before anything reaches the LLM:
+    keyword matches first, then the trained RelevanceModel (if there is
+    one), and only pairs the model isn't `confidence` sure about go to
+    ai.classify_batch. Same interface and results format as
+    AIEngine.classify_batch; classify_batch_sources also says which stage
+    decided each pair. The model file is reloaded when it changes.
+    """
+    def __init__(self, ai, model_path=None, confidence=None):
+        self.ai = ai
+        self.model_path = model_path or default_model_path()
+        self.confidence = confidence or float(os.environ.get('MAUTO_RELEVANCE_CONFIDENCE', DEFAULT_CONFIDENCE))
+        self.decided = {'keywords': 0, 'model': 0, 'llm': 0}
+        self._model = None
+        self._model_mtime = None
+        self._lock = threading.Lock()
+
+    @property
+    def model_id(self):
+        return getattr(self.ai, 'model_id', None)
+
+    def model(self):
+        """The current RelevanceModel, or None if none has been trained."""
+        try:
+            mtime = os.stat(self.model_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            if mtime != self._model_mtime:
+                self._model = RelevanceModel.load(self.model_path)
+                self._model_mtime = mtime
+            return self._model
+
+    def classify_batch(self, items, threshold=0.5):
+        return self.classify_batch_sources(items, threshold)[0]
+
+    def classify_batch_sources(self, items, threshold=0.5):
+        """(results, sources): classify_batch's results and 'keywords', 'model' or 'llm' for each pair."""
+        results = [None] * len(items)
+        sources = ['keywords'] * len(items)
+        undecided = []
+        for i, (subject, snippet) in enumerate(items):
+            decision = keyword_decision(subject, snippet)
+            if decision is not None:
+                results[i] = (decision, None)
+            else:
+                undecided.append(i)
+        self._count('keywords', len(items) - len(undecided))
+
+        model = self.model() if undecided else None
+        if model is not None:
+            probabilities = model.predict_proba([items[i] for i in undecided])
+            unsure = []
+            for i, probability in zip(undecided, probabilities):
+                if max(probability, 1 - probability) >= self.confidence:
+                    results[i] = (bool(probability >= threshold), float(probability))
+                    sources[i] = 'model'
+                else:
+                    unsure.append(i)
+            self._count('model', len(undecided) - len(unsure))
+            undecided = unsure
+
+        if undecided:
+            for i, result in zip(undecided, self.ai.classify_batch([items[i] for i in undecided], threshold)):
+                results[i] = result
+                sources[i] = 'llm'
+            self._count('llm', len(undecided))
+        return results, sources
+
+    def classify_relevance(self, subject, snippet):
+        return self.classify_batch([(subject, snippet)])[0][0]
+
+    def stats(self):
+        model = self.model()
+        return {**self.decided, 'confidence': self.confidence, 'trained': model.meta if model is not None else None}
+
+    def _count(self, key, n):
+        with self._lock:
+            self.decided[key] += n
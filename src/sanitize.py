@@ -0,0 +1,88 @@
+import html
+import re
+from html.parser import HTMLParser
+
+# Tags kept as-is (minus disallowed attributes); anything else is unwrapped to its text
+ALLOWED_TAGS = {
+    'a', 'abbr', 'b', 'blockquote', 'br', 'caption', 'center', 'code', 'col', 'colgroup', 'dd', 'div', 'dl',
+    'dt', 'em', 'font', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'i', 'img', 'li', 'ol', 'p', 'pre', 's',
+    'small', 'span', 'strike', 'strong', 'sub', 'sup', 'table', 'tbody', 'td', 'tfoot', 'th', 'thead', 'tr',
+    'u', 'ul',
+}
+# Elements that never have an end tag
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source',
+             'track', 'wbr'}
+# Dropped together with everything inside them (void ones are just skipped: nothing is inside)
+DROP_CONTENT_TAGS = {'script', 'style', 'head', 'title', 'iframe', 'object', 'embed', 'noscript', 'template',
+                     'svg', 'math', 'form', 'select', 'textarea', 'button'}
+ALLOWED_ATTRS = {
+    'align', 'alt', 'bgcolor', 'border', 'cellpadding', 'cellspacing', 'color', 'colspan', 'dir', 'face',
+    'height', 'href', 'rowspan', 'size', 'src', 'style', 'title', 'valign', 'width',
+}
+_SAFE_URL_RE = re.compile(r'^(?:https?:|mailto:|cid:|#)', re.IGNORECASE)
+_SAFE_IMAGE_RE = re.compile(r'^(?:https?:|cid:|data:image/(?:png|gif|jpe?g|webp);)', re.IGNORECASE)
+# CSS that can run code in old engines, load resources, or overlay the app UI
+_UNSAFE_STYLE_RE = re.compile(r'expression\s*\(|javascript:|url\s*\(|@import|position\s*:', re.IGNORECASE)
+
+
+class _Sanitizer(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out = []
+        self.dropping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROP_CONTENT_TAGS:
+            if tag not in VOID_TAGS:
+                self.dropping += 1
+            return
+        if self.dropping or tag not in ALLOWED_TAGS:
+            return
+        kept = []
+        for name, value in attrs:
+            value = value or ''
+            if name not in ALLOWED_ATTRS:
+                continue
+            if name == 'href' and not _SAFE_URL_RE.match(value.strip()):
+                continue
+            if name == 'src' and (tag != 'img' or not _SAFE_IMAGE_RE.match(value.strip())):
+                continue
+            if name == 'style' and _UNSAFE_STYLE_RE.search(value):
+                continue
+            kept.append(f' {name}="{html.escape(value)}"')
+        if tag == 'a':
+            # Links open outside the app and can't reach back into it
+            kept.append(' target="_blank" rel="noopener noreferrer"')
+        self.out.append(f"<{tag}{''.join(kept)}>")
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in DROP_CONTENT_TAGS:
+            return
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag in DROP_CONTENT_TAGS:
+            if tag not in VOID_TAGS:
+                self.dropping = max(0, self.dropping - 1)
+            return
+        if self.dropping or tag not in ALLOWED_TAGS or tag in VOID_TAGS:
+            return
+        self.out.append(f"</{tag}>")
+
+    def handle_data(self, data):
+        if not self.dropping:
+            self.out.append(html.escape(data, quote=False))
+
+
+def sanitize_html(body_html):
+    """
+    Email HTML reduced to safe, inert markup: allowlisted tags and attributes,
+    no scripts, event handlers, forms or frames, only http(s)/mailto/cid links.
+    Done once when a message is stored, so views can render it directly.
+    """
+    if not body_html:
+        return body_html or ''
+    sanitizer = _Sanitizer()
+    sanitizer.feed(body_html)
+    sanitizer.close()
+    return ''.join(sanitizer.out)
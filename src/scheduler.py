@@ -0,0 +1,275 @@
+"""
+Single-worker inference scheduler.
+
+One thread owns the AIEngine (loaded by the first job, so concurrent requests
+can't race to load it) and runs jobs from a priority queue, interactive work
+ahead of background classification. A job is a callable taking the engine.
+Jobs submitted with the same key while one is queued or running share its
+result. Callers wait with a timeout; a job whose callers have all given up is
+dropped before it runs.
+
+A running job is never preempted, so background callers should keep their
+jobs small (e.g. one classification micro-batch) to bound interactive latency.
+Idle-priority work that runs long (e.g. pre-generating drafts) should instead
+stream and stop as soon as idle_for() drops to 0.
+"""
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from src.ai_engine import draft_params
+from src.backends import configured_model_id
+
+INTERACTIVE = 0
+BACKGROUND = 10
+IDLE = 20
+
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BACKGROUND: 'background', IDLE: 'idle'}
+
+_END = object()
+
+
+class _Job:
+    def __init__(self, fn, priority, key, deadline):
+        self.fn = fn
+        self.priority = priority
+        self.key = key
+        self.deadline = deadline
+        self.submitted = time.monotonic()
+        self.started = False
+        self.future = Future()
+
+
+class InferenceScheduler:
+    def __init__(self, engine_factory=None):
+        """engine_factory: builds the engine on the worker thread (defaults to AIEngine())."""
+        if engine_factory is None:
+            from src.ai_engine import AIEngine
+            engine_factory = AIEngine
+        self.engine_factory = engine_factory
+        self.engine = None
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._pending = 0
+        self._running = None
+        self._stats = {}
+        self._thread = None
+        # Jobs above IDLE priority queued or running, and when the last of them finished
+        self._busy = 0
+        self._idle_since = time.monotonic()
+
+    def submit(self, fn, priority=INTERACTIVE, key=None, timeout=None):
+        """
+        Queues fn(engine) and returns a Future. With a key, a call identical to
+        one already queued or running joins it instead (and can raise its
+        priority). timeout: seconds the job may wait in the queue; None waits forever.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._lock:
+            self._ensure_worker()
+            stats = self._stat(priority)
+            stats['submitted'] += 1
+
+            job = self._inflight.get(key) if key is not None else None
+            if job is not None:
+                stats['coalesced'] += 1
+                # Keep it alive for as long as any caller still wants it
+                if job.deadline is not None:
+                    job.deadline = None if deadline is None else max(job.deadline, deadline)
+                if priority < job.priority and not job.started:
+                    if job.priority >= IDLE > priority:
+                        self._busy += 1
+                    # Re-queued at the higher priority; the worker skips the stale entry
+                    job.priority = priority
+                    self._queue.put((priority, next(self._seq), job))
+                return job.future
+
+            job = _Job(fn, priority, key, deadline)
+            if priority < IDLE:
+                self._busy += 1
+            if key is not None:
+                self._inflight[key] = job
+            self._pending += 1
+            self._queue.put((priority, next(self._seq), job))
+            return job.future
+
+    def run(self, fn, priority=INTERACTIVE, key=None, timeout=None):
+        """submit() and wait for the result. Raises TimeoutError if it isn't ready in time."""
+        return self.submit(fn, priority, key, timeout).result(timeout=timeout)
+
+    def stream(self, fn, priority=INTERACTIVE, timeout=None):
+        """
+        Runs fn(engine), which returns a generator of chunks, on the worker and
+        yields the chunks here as they are produced. Closing this generator
+        cancels the job; decoding stops at the next chunk.
+        """
+        chunks = queue.Queue()
+        cancel = threading.Event()
+
+        def job(engine):
+            if cancel.is_set():
+                return
+            gen = fn(engine)
+            try:
+                for chunk in gen:
+                    if cancel.is_set():
+                        break
+                    chunks.put(chunk)
+            finally:
+                gen.close()
+
+        future = self.submit(job, priority, timeout=timeout)
+        future.add_done_callback(lambda f: chunks.put(_END))
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is _END:
+                    break
+                yield chunk
+            future.result()
+        finally:
+            cancel.set()
+
+    def idle_for(self):
+        """Seconds since the last non-idle job finished; 0 while one is queued or running."""
+        with self._lock:
+            return 0.0 if self._busy else time.monotonic() - self._idle_since
+
+    def stats(self):
+        """Queue depth, what is running, and per-priority counts and queue wait times."""
+        with self._lock:
+            by_priority = {}
+            for priority, s in sorted(self._stats.items()):
+                started = s['completed'] + s['failed']
+                by_priority[PRIORITY_NAMES.get(priority, str(priority))] = dict(
+                    s, avg_wait_ms=1000 * s['wait_seconds'] / started if started else 0.0,
+                )
+            running = self._running
+            return {
+                'queue_depth': self._pending,
+                'running': PRIORITY_NAMES.get(running.priority, running.priority) if running else None,
+                'engine_loaded': self.engine is not None,
+                'priorities': by_priority,
+            }
+
+    def _stat(self, priority):
+        return self._stats.setdefault(priority, {
+            'submitted': 0, 'coalesced': 0, 'completed': 0, 'failed': 0, 'expired': 0,
+            'wait_seconds': 0.0, 'max_wait_ms': 0.0,
+        })
+
+    def _ensure_worker(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._work, name="inference-worker", daemon=True)
+            self._thread.start()
+
+    def _work(self):
+        while True:
+            _, _, job = self._queue.get()
+            now = time.monotonic()
+            with self._lock:
+                if job.started:
+                    continue
+                job.started = True
+                self._pending -= 1
+                stats = self._stat(job.priority)
+                expired = job.deadline is not None and now > job.deadline
+                if expired:
+                    stats['expired'] += 1
+                    self._finish(job)
+                else:
+                    waited = now - job.submitted
+                    stats['wait_seconds'] += waited
+                    stats['max_wait_ms'] = max(stats['max_wait_ms'], 1000 * waited)
+                    self._running = job
+
+            if expired:
+                job.future.set_exception(TimeoutError("Inference request timed out in the queue"))
+                continue
+
+            try:
+                if self.engine is None:
+                    self.engine = self.engine_factory()
+                result = job.fn(self.engine)
+            except Exception as e:
+                print(f"Inference job failed: {e}")
+                with self._lock:
+                    stats['failed'] += 1
+                    self._finish(job)
+                job.future.set_exception(e)
+            else:
+                with self._lock:
+                    stats['completed'] += 1
+                    self._finish(job)
+                job.future.set_result(result)
+
+    def _finish(self, job):
+        # Caller holds self._lock
+        if job.key is not None and self._inflight.get(job.key) is job:
+            del self._inflight[job.key]
+        if self._running is job:
+            self._running = None
+        if job.priority < IDLE:
+            self._busy -= 1
+            if not self._busy:
+                self._idle_since = time.monotonic()
+
+
+class ScheduledEngine:
+    """
+    AIEngine look-alike whose calls run as scheduler jobs at one priority, so
+    it can be handed to the sync pipeline or used by API handlers as-is.
+    """
+    def __init__(self, scheduler, priority=INTERACTIVE, timeout=None):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.timeout = timeout
+
+    def _run(self, fn, key=None):
+        return self.scheduler.run(fn, self.priority, key=key, timeout=self.timeout)
+
+    @property
+    def model_id(self):
+        # Known without loading the model, so cache lookups stay instant
+        engine = self.scheduler.engine
+        return engine.model_id if engine is not None else configured_model_id()
+
+    @property
+    def draft_params(self):
+        engine = self.scheduler.engine
+        return engine.draft_params if engine is not None else draft_params()
+
+    def stats(self):
+        engine = self.scheduler.engine
+        return engine.stats() if engine is not None else {}
+
+    def generate_follow_up(self, email_data, context="I haven't heard back yet. Keep it short.", thread=None):
+        return self._run(lambda engine: engine.generate_follow_up(email_data, context, thread),
+                         key=('follow_up', email_data['id'], context))
+
+    def stream_follow_up(self, email_data, context="I haven't heard back yet. Keep it short.", thread=None):
+        return self.scheduler.stream(lambda engine: engine.stream_follow_up(email_data, context, thread),
+                                     self.priority, timeout=self.timeout)
+
+    def classify_relevance(self, subject, snippet):
+        return self.classify_batch([(subject, snippet)])[0][0]
+
+    def classify_batch(self, items, threshold=0.5):
+        items = [tuple(item) for item in items]
+        return self._run(lambda engine: engine.classify_batch(items, threshold),
+                         key=('classify', tuple(items), threshold))
+
+    def filter_emails(self, emails_metadata, prompt):
+        return self._run(lambda engine: engine.filter_emails(emails_metadata, prompt))
+
+    def plan_filter_query(self, prompt, today=None):
+        return self._run(lambda engine: engine.plan_filter_query(prompt, today), key=('plan', prompt, today))
+
+    def filter_emails_scan(self, metadata_chunks, prompt, workers=2):
+        # Same chunking as AIEngine, but each chunk is its own job so drafts can cut in
+        from src.ai_engine import AIEngine
+        return AIEngine.filter_emails_scan(self, metadata_chunks, prompt, workers)
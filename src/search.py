@@ -0,0 +1,112 @@
+import datetime
+import re
+
+# Field filters accepted in search queries, mapped to emails_fts columns
+FIELD_COLUMNS = {
+    'from': ['sender'],
+    'to': ['recipients_to', 'recipients_cc', 'recipients_bcc'],
+    'cc': ['recipients_cc'],
+    'bcc': ['recipients_bcc'],
+    'subject': ['subject'],
+    'body': ['body_text'],
+}
+
+# [-][field:]("quoted phrase" | bareword)[*]
+_TOKEN_RE = re.compile(r'(-?)(?:(\w+):)?("([^"]*)"|[^\s"]+)(\*?)')
+
+
+def build_match_query(text):
+    """
+    Translates a user search string into an FTS5 MATCH expression.
+    Supports prefix queries (intern*), quoted phrases, negation (-newsletter)
+    and field filters (from:, to:, cc:, bcc:, subject:, body:). Every term is
+    quoted, so user input can never produce an FTS5 syntax error.
+    Returns None if the query has no searchable terms.
+    """
+    positives, negatives = [], []
+    for negate, field, raw, phrase, star in _TOKEN_RE.findall(text):
+        value = phrase if raw.startswith('"') else raw
+        if raw.endswith('*') and not star:
+            value, star = value[:-1], '*'
+
+        field = field.lower()
+        if field and field not in FIELD_COLUMNS:
+            # Unknown "field:" prefix, e.g. a time like 10:30; search it as text
+            value, field = f"{field}:{value}", ''
+
+        value = value.strip()
+        if not value:
+            continue
+
+        term = '"' + value.replace('"', '""') + '"' + star
+        if field:
+            columns = FIELD_COLUMNS[field]
+            column_filter = columns[0] if len(columns) == 1 else '{' + ' '.join(columns) + '}'
+            term = f"{column_filter} : {term}"
+
+        (negatives if negate else positives).append(term)
+
+    if not positives:
+        # FTS5 NOT is binary, so a purely negative query can't be expressed
+        return None
+
+    query = ' AND '.join(positives)
+    for term in negatives:
+        query = f"({query}) NOT {term}"
+    return query
+
+
+def normalize_filter_plan(raw):
+    """
+    Validates the structured query produced by the LLM (see
+    FILTER_QUERY_TEMPLATE) and drops anything malformed, so a sloppy
+    generation narrows the search less instead of failing it.
+    """
+    if not isinstance(raw, dict):
+        return None
+
+    def text(value):
+        # Quotes would split the phrase when it's turned into FTS terms
+        value = value.replace('"', ' ').strip() if isinstance(value, str) else None
+        return value or None
+
+    def day(value):
+        value = text(value)
+        try:
+            return datetime.date.fromisoformat(value).isoformat() if value else None
+        except ValueError:
+            return None
+
+    keywords = raw.get('keywords') or []
+    if isinstance(keywords, str):
+        keywords = [keywords]
+
+    is_job = raw.get('is_job')
+    return {
+        'keywords': [k for k in map(text, keywords) if k],
+        'sender': text(raw.get('sender')),
+        'recipient': text(raw.get('recipient')),
+        'date_from': day(raw.get('date_from')),
+        'date_to': day(raw.get('date_to')),
+        'is_job': is_job if isinstance(is_job, bool) else None,
+    }
+
+
+def plan_match_query(plan):
+    """Builds the FTS5 part of a filter plan: keywords are OR'ed, sender/recipient must match."""
+    def field_term(field, value):
+        return build_match_query(f'{field}:"{value}"')
+
+    required = []
+    if plan['keywords']:
+        keyword_terms = [build_match_query(f'"{k}"') for k in plan['keywords']]
+        keyword_terms = [t for t in keyword_terms if t]
+        if keyword_terms:
+            required.append('(' + ' OR '.join(keyword_terms) + ')')
+    if plan['sender']:
+        required.append(field_term('from', plan['sender']))
+    if plan['recipient']:
+        required.append(field_term('to', plan['recipient']))
+
+    required = [t for t in required if t]
+    return ' AND '.join(required) if required else None
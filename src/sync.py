@@ -1,48 +1,204 @@
-from src.gmail_client import GmailClient
+import itertools
+import os
+from src.gmail_client import GmailClient, HistoryExpiredError
 from src.database import DatabaseManager
+from src.pipeline import SyncPipeline
+from src.cache import ClassificationCache
+from src.relevance import CLASSIFIER_VERSION, RelevanceClassifier, train_if_stale
+from src.attachments import AttachmentStore
+from src.embeddings import EmbeddingIndex
+from src.threads import ReplyTracker, DEFAULT_CHECK_LIMIT
 
-def main(ai=None, db=None):
+HISTORY_KEY = 'gmail_history_id'
+
+def main(ai=None, db=None, full=False, max_results=50, client=None, attachments=None, job=None, message_format=None,
+         embeddings=None):
+    """
+    Syncs sent mail into the DB.
+    Incremental by default: only messages added/deleted since the stored
+    Gmail historyId are fetched. Falls back to a full resync when there is
+    no stored historyId, when full=True, or when the history window expired.
+    attachments: an AttachmentStore to prefetch new attachments into. By
+    default one is used only when MAUTO_PREFETCH_ATTACHMENTS=1.
+    message_format: 'full' (default) or 'metadata', which syncs headers and
+    snippets only and leaves bodies to BodyHydrator (default from MAUTO_SYNC_FORMAT).
+    embeddings: an EmbeddingIndex that new emails are embedded into. By
+    default one is used unless MAUTO_EMBEDDINGS=0.
+    job: a SyncJob (see src.sync_jobs) that follows the sync's progress and
+    can cancel it. With a job, failures are raised instead of just printed.
+    Returns the pipeline stats, or None when nothing was synced.
+    """
     print("=== Mauto Email Sync ===")
-    
+
     # 1. Init Database
     if db is None:
         db = DatabaseManager()
     print(f"Current DB Count: {db.get_count()} emails")
-    
-    # 2. Init Gmail Client
-    client = GmailClient()
-    try:
-        client.authenticate()
-    except Exception as e:
-        print(f"Authentication failed: {e}")
-        return
 
-    # 3. Init AI Engine (if not provided)
-    if ai is None:
-        from src.ai_engine import AIEngine
-        ai = AIEngine()
+    # 2. Init Gmail Client (if not provided)
+    if client is None:
+        client = GmailClient()
+        try:
+            client.authenticate()
+        except Exception as e:
+            print(f"Authentication failed: {e}")
+            if job is not None:
+                raise
+            return
 
-    # 4. Fetch Data
-    print("\nFetching recent sent emails (limit=50)...")
     try:
-        emails = client.get_sent_messages(max_results=50)
-        
-        # 5. Store in DB with Classification
-        success_count = 0
-        for i, email in enumerate(emails):
-            print(f"[{i+1}/{len(emails)}] Processing: {email['subject'][:40]}...")
-            is_job = ai.classify_relevance(email['subject'], email['snippet'])
-            email['is_job_related'] = 1 if is_job else 0
-            
-            if db.upsert_email(email):
-                success_count += 1
-        
+        # 3. Work out what changed
+        start_history_id = None if full else db.get_sync_state(HISTORY_KEY)
+        added_ids, deleted_ids = [], []
+        new_history_id = None
+
+        if start_history_id:
+            try:
+                added_ids, deleted_ids, new_history_id = client.get_history_changes(start_history_id)
+                print(f"Incremental sync from historyId {start_history_id}: "
+                      f"{len(added_ids)} added, {len(deleted_ids)} deleted")
+            except HistoryExpiredError as e:
+                print(f"{e}. Falling back to full resync.")
+                start_history_id = None
+
+        if not start_history_id:
+            # Snapshot the historyId before listing so nothing sent mid-sync is missed
+            new_history_id = client.get_history_id()
+            print(f"\nFull resync: listing recent sent emails (limit={max_results})...")
+            # Listing is streamed page by page straight into the pipeline
+            added_ids = _unknown_ids(db, client.iter_sent_message_ids(max_results=max_results))
+
+        # 4. Apply deletions
+        for msg_id in deleted_ids:
+            db.delete_email(msg_id)
+        if job is not None:
+            job.deleted(deleted_ids)
+
+        if embeddings is None and os.environ.get('MAUTO_EMBEDDINGS', '1') != '0':
+            embeddings = EmbeddingIndex(db)
+
+        # Peek so the model is only loaded when there is something to classify
+        added_ids = iter(added_ids)
+        first_id = next(added_ids, None)
+        if first_id is None:
+            print("Nothing new to sync.")
+            db.set_sync_state(HISTORY_KEY, new_history_id)
+            if job is not None and job.cancelled.is_set():
+                return
+            _check_replies(db, client, job)
+            _update_embeddings(embeddings)
+            return
+
+        # 5. Init AI Engine (if not provided) only when there is work for it
+        if ai is None:
+            from src.ai_engine import AIEngine
+            ai = AIEngine()
+
+        # Keywords and the trained relevance model decide first; only unsure emails reach the LLM
+        if not isinstance(ai, RelevanceClassifier):
+            ai = RelevanceClassifier(ai)
+        decided_before = dict(ai.decided)
+
+        # Cached decisions from an older model/prompt can never hit again
+        cache = ClassificationCache(db, getattr(ai, 'model_id', None), CLASSIFIER_VERSION)
+        cache.prune()
+
+        if attachments is None and os.environ.get('MAUTO_PREFETCH_ATTACHMENTS') == '1':
+            attachments = AttachmentStore(db)
+
+        if message_format is None:
+            message_format = os.environ.get('MAUTO_SYNC_FORMAT', 'full')
+
+        # 6. Stream fetch -> parse -> classify -> store
+        pipeline = SyncPipeline(client, db, ai, cache=cache, attachments=attachments,
+                                cancel=job.cancelled if job else None, on_stored=job.stored if job else None,
+                                message_format=message_format, embeddings=embeddings)
+        if job is not None:
+            job.track(pipeline)
+        stats = pipeline.run(itertools.chain([first_id], added_ids))
+
+        # Messages deleted since they were listed are deletions; ones Gmail rejects are recorded, not waited on
+        for msg_id in pipeline.gone:
+            db.delete_email(msg_id)
+        if job is not None:
+            job.deleted(pipeline.gone)
+        db.mark_sync_failed(pipeline.skipped)
+
+        # Only advance the cursor when every change was applied, so transient failures are retried next run
+        cancelled = job is not None and job.cancelled.is_set()
+        settled = stats['stored'] + stats['gone'] + stats['skipped']
+        if settled == stats['listed'] and not cancelled:
+            db.set_sync_state(HISTORY_KEY, new_history_id)
+        elif cancelled:
+            # Reply checks, the embedding backfill and retraining wait for the next sync
+            print("Sync cancelled; keeping the previous historyId so the rest is synced next run.")
+            return stats
+        else:
+            print(f"{stats['failed']} messages failed; keeping the previous historyId so they are retried.")
+
         print(f"\nSync Complete.")
-        print(f"Successfully synced: {success_count}/{len(emails)}")
+        print(f"Successfully synced: {stats['stored']}/{stats['listed']}")
+        if stats['gone'] or stats['skipped']:
+            print(f"Deleted before they could be fetched: {stats['gone']}, "
+                  f"skipped (rejected or unparseable): {stats['skipped']}")
+        print(f"Classification cache: {cache.hits} hits, {cache.misses} misses")
+        decided = {key: ai.decided[key] - decided_before[key] for key in decided_before}
+        print(f"Classified by keywords/model/LLM: {decided['keywords']}/{decided['model']}/{decided['llm']}")
+        if attachments is not None:
+            print(f"Prefetched attachments: {stats['attachments']}")
+        _check_replies(db, client, job)
+        _update_embeddings(embeddings)
+        _update_relevance_model(db)
         print(f"Total Emails in DB: {db.get_count()}")
+        return stats
 
     except Exception as e:
         print(f"Error during sync: {e}")
+        if job is not None:
+            raise
+
+def _check_replies(db, client, job=None):
+    """Updates the reply state of new and still-unanswered threads (MAUTO_REPLY_CHECK_LIMIT per sync, 0 disables)."""
+    limit = int(os.environ.get('MAUTO_REPLY_CHECK_LIMIT', DEFAULT_CHECK_LIMIT))
+    if limit <= 0:
+        return
+    try:
+        ReplyTracker(db, client, limit=limit).check(cancel=job.cancelled if job else None)
+    except Exception as e:
+        # Reply state just stays as it was; the next sync tries again
+        print(f"Error checking threads for replies: {e}")
+
+def _update_embeddings(embeddings):
+    """Embeds anything the pipeline missed (or synced before the index existed) and drops deleted rows."""
+    if embeddings is None:
+        return
+    try:
+        backfilled = embeddings.backfill()
+        if backfilled:
+            print(f"Embedded {backfilled} previously unindexed emails")
+        embeddings.compact()
+    except Exception as e:
+        print(f"Error updating the embedding index: {e}")
+
+def _update_relevance_model(db):
+    """Retrains the relevance model on the new labels (and corrections) when it is out of date."""
+    try:
+        train_if_stale(db)
+    except Exception as e:
+        print(f"Error training the relevance model: {e}")
+
+def _unknown_ids(db, msg_ids, chunk_size=500):
+    """Filters out IDs already in the DB, checking them a chunk at a time."""
+    msg_ids = iter(msg_ids)
+    while True:
+        chunk = list(itertools.islice(msg_ids, chunk_size))
+        if not chunk:
+            return
+        known_ids = db.get_known_ids(chunk)
+        for msg_id in chunk:
+            if msg_id not in known_ids:
+                yield msg_id
 
 if __name__ == "__main__":
-    main()
+    import sys
+    main(full='--full' in sys.argv)
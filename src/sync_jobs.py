@@ -0,0 +1,154 @@
+import datetime
+import queue
+import threading
+import uuid
+from collections import OrderedDict
+
+# Progress events are sent at most this often while a job runs
+PROGRESS_INTERVAL = 0.5
+
+
+class SyncJob:
+    """One sync run: its status, live pipeline counters and a cancel switch."""
+    def __init__(self, manager, options):
+        self.id = uuid.uuid4().hex[:12]
+        self.options = options
+        self.status = 'queued'
+        self.error = None
+        self.deleted_count = 0
+        self.created_at = _now()
+        self.finished_at = None
+        self.cancelled = threading.Event()
+        self._manager = manager
+        self._pipeline = None
+
+    def track(self, pipeline):
+        self._pipeline = pipeline
+
+    def stored(self, batch):
+        """Pipeline hook: pushes the committed rows to subscribers."""
+        self._manager.publish_rows(self, [e['id'] for e in batch])
+
+    def deleted(self, email_ids):
+        self.deleted_count += len(email_ids)
+        if email_ids:
+            self._manager.publish('deleted', {'job_id': self.id, 'ids': list(email_ids)})
+
+    def to_dict(self):
+        stats = dict(self._pipeline.stats) if self._pipeline is not None else {}
+        return {
+            'id': self.id, 'status': self.status, 'error': self.error,
+            'created_at': self.created_at, 'finished_at': self.finished_at,
+            'stats': dict(stats, deleted=self.deleted_count), 'options': self.options,
+        }
+
+
+class SyncJobManager:
+    """
+    Runs syncs as background jobs, one at a time: starting a sync while one is
+    running returns the running job instead of starting a second. Progress,
+    newly stored rows and status changes are broadcast to subscribers (the
+    /api/sync/events stream).
+    run_sync(job=..., **options) does the work (src.sync.main with the API's
+    engine and DB bound in).
+    """
+    def __init__(self, run_sync, db, history=20):
+        self.run_sync = run_sync
+        self.db = db
+        self.history = history
+        self._jobs = OrderedDict()
+        self._current = None
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._subscribers_lock = threading.Lock()
+
+    def start(self, **options):
+        """Returns (job, started): the new job, or the one already running and False."""
+        with self._lock:
+            if self._current is not None:
+                return self._current, False
+            job = self._current = SyncJob(self, options)
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.history:
+                self._jobs.popitem(last=False)
+        threading.Thread(target=self._run, args=(job,), name=f"sync-job-{job.id}", daemon=True).start()
+        return job, True
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def current(self):
+        return self._current
+
+    def jobs(self):
+        """Recent jobs, newest first."""
+        with self._lock:
+            return list(reversed(self._jobs.values()))
+
+    def cancel(self, job_id):
+        """Asks a job to stop. Returns the job, or None if there is no such job."""
+        job = self._jobs.get(job_id)
+        if job is not None and job.status in ('queued', 'running'):
+            job.cancelled.set()
+            self.publish('job', job.to_dict())
+        return job
+
+    # --- Events ---
+    def subscribe(self, maxsize=256):
+        """A queue receiving (event, data) tuples until unsubscribe()."""
+        q = queue.Queue(maxsize=maxsize)
+        with self._subscribers_lock:
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._subscribers_lock:
+            self._subscribers.discard(q)
+
+    def publish(self, event, data):
+        with self._subscribers_lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait((event, data))
+            except queue.Full:
+                # A stalled client misses events rather than stalling the sync
+                pass
+
+    def publish_rows(self, job, email_ids):
+        with self._subscribers_lock:
+            if not self._subscribers:
+                return
+        self.publish('emails', {'job_id': job.id, 'emails': self.db.get_list_rows(email_ids)})
+
+    def _run(self, job):
+        job.status = 'running'
+        self.publish('job', job.to_dict())
+        finished = threading.Event()
+        reporter = threading.Thread(target=self._report, args=(job, finished), name=f"sync-progress-{job.id}", daemon=True)
+        reporter.start()
+        try:
+            self.run_sync(job=job, **job.options)
+            job.status = 'cancelled' if job.cancelled.is_set() else 'completed'
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+        finally:
+            job.finished_at = _now()
+            finished.set()
+            reporter.join()
+            with self._lock:
+                self._current = None
+            self.publish('job', job.to_dict())
+
+    def _report(self, job, finished):
+        last = None
+        while not finished.wait(PROGRESS_INTERVAL):
+            snapshot = job.to_dict()
+            if snapshot != last:
+                self.publish('job', snapshot)
+                last = snapshot
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
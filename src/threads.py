@@ -0,0 +1,43 @@
+import datetime
+
+DEFAULT_CHECK_LIMIT = 500
+# Threads still waiting for a reply are looked at again after this long
+DEFAULT_RECHECK_HOURS = 6
+
+
+def utc_cutoff(days=0, hours=0):
+    """'YYYY-MM-DD HH:MM:SS' (UTC) that long ago, the format of the threads table's dates."""
+    moment = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days, hours=hours)
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+class ReplyTracker:
+    """
+    Fills in the reply side of the threads table. Only sent mail is synced,
+    so replies are read from Gmail's thread view (labels, dates and From of
+    each message, batched): first for threads never checked or where we sent
+    something new, then periodically for threads still awaiting a reply.
+    At most `limit` threads per run, newest first, to stay within quota.
+    """
+    def __init__(self, db, client, limit=DEFAULT_CHECK_LIMIT, recheck_hours=DEFAULT_RECHECK_HOURS):
+        self.db = db
+        self.client = client
+        self.limit = limit
+        self.recheck_hours = recheck_hours
+
+    def check(self, cancel=None):
+        """Checks the threads that are due. Returns how many were checked."""
+        thread_ids = self.db.get_threads_to_check(utc_cutoff(hours=self.recheck_hours), self.limit)
+        if not thread_ids:
+            return 0
+        activity = []
+        for thread in self.client.iter_thread_activity(thread_ids):
+            activity.append(thread)
+            if cancel is not None and cancel.is_set():
+                break
+        # Threads Gmail didn't return (e.g. deleted) count as checked, so they aren't retried every run
+        checked = thread_ids if cancel is None or not cancel.is_set() else [a['thread_id'] for a in activity]
+        self.db.update_thread_replies(activity, checked)
+        replied = sum(1 for a in activity if a['last_inbound_date'])
+        print(f"Checked {len(activity)} threads for replies ({replied} have replies).")
+        return len(activity)
@@ -1,6 +1,7 @@
 import sqlite3
 import json
 from src.ai_engine import AIEngine
+from src.database import DatabaseManager
 
 def test_generation():
     # 1. Fetch a real email from DB
@@ -9,7 +10,7 @@ def test_generation():
     c = conn.cursor()
     
     # Get a sent email that is likely a cold outreach (e.g., has "Intern" or "Research" in subject)
-    c.execute("SELECT * FROM emails WHERE subject LIKE '%Intern%' OR subject LIKE '%Research%' LIMIT 1")
+    c.execute("SELECT id FROM emails WHERE subject LIKE '%Intern%' OR subject LIKE '%Research%' LIMIT 1")
     row = c.fetchone()
     conn.close()
 
@@ -17,7 +18,8 @@ def test_generation():
         print("No suitable test email found in DB.")
         return
 
-    email_data = dict(row)
+    # Bodies are stored compressed in email_bodies
+    email_data = DatabaseManager().get_email(row['id'], bodies=True)
     # Parse json fields back to lists if needed, though prompts usually take string representation fine
     print(f"\n--- Testing AI on Email: {email_data['subject']} ---\n")
 
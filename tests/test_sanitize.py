@@ -0,0 +1,16 @@
+from src.sanitize import sanitize_html
+
+
+def test_content_after_embed_is_kept():
+    html = '<p>Hello</p><embed src=x.swf><p>Interview on Monday at 10am</p>'
+    assert sanitize_html(html) == '<p>Hello</p><p>Interview on Monday at 10am</p>'
+
+
+def test_self_closed_and_stray_embed_end_tags_are_ignored():
+    html = '<p>a</p><embed src="x" /><p>b</p></embed><script>x<embed>y</script><p>c</p>'
+    assert sanitize_html(html) == '<p>a</p><p>b</p><p>c</p>'
+
+
+def test_drop_content_tags_still_drop_their_content():
+    html = '<object><embed src=x>fallback</object><style>p {}</style><p>after</p>'
+    assert sanitize_html(html) == '<p>after</p>'
@@ -1,6 +1,6 @@
-import { useState, useEffect } from 'react'
+import { useState, useEffect, useRef } from 'react'
 import axios from 'axios'
-import { Layout, Mail, RefreshCw, Zap, Briefcase, Trash2, Search, Loader2 } from 'lucide-react'
+import { Layout, Mail, RefreshCw, Zap, Briefcase, Trash2, Search, Loader2, X } from 'lucide-react'
 import { clsx } from 'clsx'
 
 // Components
@@ -12,6 +12,7 @@ function App() {
   const [selectedEmailId, setSelectedEmailId] = useState(null)
   const [loading, setLoading] = useState(false)
   const [syncing, setSyncing] = useState(false)
+  const [syncJob, setSyncJob] = useState(null)
   const [activeCategory, setActiveCategory] = useState('jobs')
   const [searchQuery, setSearchQuery] = useState('')
   const [filtering, setFiltering] = useState(false)
@@ -41,8 +42,13 @@ function App() {
       setFiltering(true)
       try {
         const res = await axios.post('http://localhost:8000/api/filter', { prompt: searchQuery })
-        const matchingIds = res.data.matching_ids || []
-        setEmails(prev => prev.filter(email => matchingIds.includes(email.id)))
+        if (res.data.emails) {
+          // Query-planned filters search the whole mailbox, not just the loaded page
+          setEmails(res.data.emails)
+        } else {
+          const matchingIds = res.data.matching_ids || []
+          setEmails(prev => prev.filter(email => matchingIds.includes(email.id)))
+        }
       } catch (err) {
         console.error("Filter error:", err)
       } finally {
@@ -59,19 +65,62 @@ function App() {
     fetchEmails(activeCategory)
   }, [activeCategory])
 
+  // Sync progress and new rows are pushed by the server; rows are merged into the current list
+  const categoryRef = useRef(activeCategory)
+  categoryRef.current = activeCategory
+
+  useEffect(() => {
+    const events = new EventSource('http://localhost:8000/api/sync/events')
+
+    events.addEventListener('job', (e) => {
+      const job = JSON.parse(e.data)
+      setSyncJob(job)
+      setSyncing(job.status === 'queued' || job.status === 'running')
+    })
+
+    events.addEventListener('emails', (e) => {
+      const isJob = categoryRef.current === 'jobs'
+      const incoming = JSON.parse(e.data).emails.filter(email => Boolean(email.is_job_related) === isJob)
+      if (!incoming.length) return
+      setEmails(prev => {
+        const ids = new Set(incoming.map(email => email.id))
+        return [...incoming, ...prev.filter(email => !ids.has(email.id))]
+          .sort((a, b) => (b.date || '').localeCompare(a.date || '') || b.id.localeCompare(a.id))
+      })
+    })
+
+    events.addEventListener('deleted', (e) => {
+      const ids = new Set(JSON.parse(e.data).ids)
+      setEmails(prev => prev.filter(email => !ids.has(email.id)))
+    })
+
+    return () => events.close()
+  }, [])
+
   const triggerSync = async () => {
     setSyncing(true)
     try {
-      await axios.post('http://localhost:8000/api/sync')
-      // Poll or wait for sync (classification takes time)
-      setTimeout(() => fetchEmails(activeCategory), 15000)
+      const res = await axios.post('http://localhost:8000/api/sync')
+      setSyncJob(res.data.job)
     } catch (err) {
       console.error("Error syncing:", err)
-    } finally {
       setSyncing(false)
     }
   }
 
+  const cancelSync = async () => {
+    if (!syncJob) return
+    try {
+      await axios.post(`http://localhost:8000/api/sync/jobs/${syncJob.id}/cancel`)
+    } catch (err) {
+      console.error("Error cancelling sync:", err)
+    }
+  }
+
+  const syncProgress = syncJob?.stats?.listed
+    ? `Syncing ${syncJob.stats.stored}/${syncJob.stats.listed}...`
+    : "Syncing..."
+
   // Global Resize Handler
   useEffect(() => {
     const handleMouseMove = (e) => {
@@ -154,19 +203,33 @@ function App() {
         </div>
 
         <div className="mt-auto p-4 border-t border-material-border">
-          <button
-            onClick={triggerSync}
-            disabled={syncing}
-            className={clsx(
-              "flex items-center justify-center space-x-2 w-full py-2.5 rounded-lg font-medium transition-all text-sm",
-              syncing
-                ? "bg-material-muted/10 text-material-muted cursor-not-allowed"
-                : "bg-white border border-material-border hover:bg-slate-50 text-material-text shadow-sm"
+          <div className="flex items-center space-x-2">
+            <button
+              onClick={triggerSync}
+              disabled={syncing}
+              className={clsx(
+                "flex items-center justify-center space-x-2 w-full py-2.5 rounded-lg font-medium transition-all text-sm",
+                syncing
+                  ? "bg-material-muted/10 text-material-muted cursor-not-allowed"
+                  : "bg-white border border-material-border hover:bg-slate-50 text-material-text shadow-sm"
+              )}
+            >
+              <RefreshCw size={16} className={clsx(syncing && "animate-spin")} />
+              <span>{syncing ? syncProgress : "Sync Gmail"}</span>
+            </button>
+            {syncing && syncJob && (
+              <button
+                onClick={cancelSync}
+                title="Cancel sync"
+                className="p-2.5 rounded-lg border border-material-border bg-white hover:bg-slate-50 text-material-muted shadow-sm"
+              >
+                <X size={16} />
+              </button>
             )}
-          >
-            <RefreshCw size={16} className={clsx(syncing && "animate-spin")} />
-            <span>{syncing ? "Syncing..." : "Sync Gmail"}</span>
-          </button>
+          </div>
+          {!syncing && syncJob?.status === 'failed' && (
+            <p className="mt-2 text-xs text-red-500 truncate" title={syncJob.error}>Sync failed: {syncJob.error}</p>
+          )}
         </div>
       </div>
 
@@ -1,6 +1,6 @@
-import { useState, useEffect } from 'react'
+import { useState, useEffect, useRef } from 'react'
 import axios from 'axios'
-import { Sparkles, Loader2, Copy, Send, User, Check } from 'lucide-react'
+import { Sparkles, Loader2, Copy, Send, User, Check, Square, RefreshCw } from 'lucide-react'
 import ReactMarkdown from 'react-markdown'
 import { clsx } from 'clsx'
 
@@ -12,6 +12,8 @@ export default function EmailDetail({ emailId }) {
     // AI State
     const [aiContext, setAiContext] = useState("I haven't heard back yet. Keep it short and polite.")
     const [generatedDraft, setGeneratedDraft] = useState("")
+    const [draftCached, setDraftCached] = useState(false)
+    const generationRef = useRef(null)
 
     // Attachment Preview State
     const [previewUrl, setPreviewUrl] = useState(null)
@@ -48,6 +50,21 @@ export default function EmailDetail({ emailId }) {
         }
     }, [isResizing])
 
+    // Abandoning the stream closes the connection, which stops decoding on the server
+    const stopGenerating = () => {
+        if (generationRef.current) {
+            generationRef.current.abort()
+            generationRef.current = null
+        }
+    }
+
+    const cancelGeneration = () => {
+        stopGenerating()
+        setGenerating(false)
+    }
+
+    useEffect(() => cancelGeneration, [emailId])
+
     useEffect(() => {
         const fetchDetail = async () => {
             setLoading(true)
@@ -55,6 +72,9 @@ export default function EmailDetail({ emailId }) {
             try {
                 const res = await axios.get(`http://localhost:8000/api/emails/${emailId}`)
                 setData(res.data)
+                // Stale threads usually come with a draft written in the background
+                setGeneratedDraft(res.data.suggested_draft || "")
+                setDraftCached(Boolean(res.data.suggested_draft))
             } catch (err) {
                 console.error(err)
             } finally {
@@ -64,19 +84,59 @@ export default function EmailDetail({ emailId }) {
         if (emailId) fetchDetail()
     }, [emailId])
 
-    const handleGenerate = async () => {
+    const handleGenerate = async (regenerate = false) => {
+        stopGenerating()
+        const controller = new AbortController()
+        generationRef.current = controller
         setGenerating(true)
+        setGeneratedDraft("")
+        setDraftCached(false)
         try {
-            const res = await axios.post('http://localhost:8000/api/generate', {
-                email_id: emailId,
-                context: aiContext
+            const res = await fetch('http://localhost:8000/api/generate/stream', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ email_id: emailId, context: aiContext, regenerate }),
+                signal: controller.signal
             })
-            setGeneratedDraft(res.data.draft)
+            if (!res.ok) throw new Error(`HTTP ${res.status}`)
+
+            // Server-sent events: blank-line separated blocks of "event:" / "data:" lines
+            const reader = res.body.getReader()
+            const decoder = new TextDecoder()
+            let buffer = ""
+            while (true) {
+                const { done, value } = await reader.read()
+                if (done) break
+                buffer += decoder.decode(value, { stream: true })
+                const blocks = buffer.split("\n\n")
+                buffer = blocks.pop()
+                for (const block of blocks) {
+                    let event = "message"
+                    let data = ""
+                    for (const line of block.split("\n")) {
+                        if (line.startsWith("event:")) event = line.slice(6).trim()
+                        else if (line.startsWith("data:")) data += line.slice(5).trim()
+                    }
+                    if (!data) continue
+                    const payload = JSON.parse(data)
+                    if (event === "message") setGeneratedDraft(prev => prev + payload.token)
+                    else if (event === "done") {
+                        setGeneratedDraft(payload.draft)
+                        setDraftCached(payload.cached)
+                    }
+                    else if (event === "error") throw new Error(payload.detail)
+                }
+            }
         } catch (err) {
-            console.error(err)
-            setGeneratedDraft("Error generating draft.")
+            if (err.name !== 'AbortError') {
+                console.error(err)
+                setGeneratedDraft("Error generating draft.")
+            }
         } finally {
-            setGenerating(false)
+            if (generationRef.current === controller) {
+                generationRef.current = null
+                setGenerating(false)
+            }
         }
     }
 
@@ -182,11 +242,14 @@ export default function EmailDetail({ emailId }) {
                 {/* AI Action Area */}
                 <div className="absolute bottom-6 left-6 transition-all duration-75" style={{ right: previewUrl ? `${sidebarWidth + 24}px` : '24px' }}>
                     <div className="bg-white rounded-2xl shadow-xl border border-slate-200 overflow-hidden flex flex-col transition-all max-h-[60vh]">
-                        {generatedDraft && (
+                        {(generatedDraft || generating) && (
                             <div className="bg-slate-50 p-4 border-b border-slate-100 max-h-64 overflow-y-auto">
                                 <div className="flex items-center justify-between mb-2">
-                                    <span className="text-xs font-bold uppercase text-purple-600 tracking-wider flex items-center space-x-1"><Sparkles size={12} /><span>AI Draft</span></span>
-                                    <button className="text-slate-400 hover:text-slate-600 transition-colors"><Copy size={16} /></button>
+                                    <span className="text-xs font-bold uppercase text-purple-600 tracking-wider flex items-center space-x-1"><Sparkles size={12} /><span>AI Draft</span>{generating && <Loader2 size={12} className="animate-spin" />}{draftCached && <span className="text-slate-400 normal-case font-medium tracking-normal">(cached)</span>}</span>
+                                    <div className="flex items-center space-x-2">
+                                        {!generating && <button onClick={() => handleGenerate(true)} title="Regenerate" className="text-slate-400 hover:text-slate-600 transition-colors"><RefreshCw size={16} /></button>}
+                                        <button className="text-slate-400 hover:text-slate-600 transition-colors"><Copy size={16} /></button>
+                                    </div>
                                 </div>
                                 <div className="prose prose-sm prose-slate max-w-none"><ReactMarkdown>{generatedDraft}</ReactMarkdown></div>
                             </div>
@@ -196,8 +259,8 @@ export default function EmailDetail({ emailId }) {
                                 <Sparkles size={18} className="text-purple-500" />
                                 <input type="text" className="bg-transparent border-none focus:ring-0 text-sm w-full text-slate-700 placeholder-slate-400" placeholder="Context: Ask for a 15min call..." value={aiContext} onChange={(e) => setAiContext(e.target.value)} onKeyDown={(e) => { if (e.key === 'Enter' && !generating) handleGenerate(); }} />
                             </div>
-                            <button onClick={handleGenerate} disabled={generating} className={clsx("w-10 h-10 rounded-full flex items-center justify-center transition-all shadow-md", generating ? "bg-slate-100 text-slate-400 animate-pulse" : "bg-blue-600 text-white hover:bg-blue-700 hover:scale-105")}>
-                                {generating ? <Loader2 size={18} className="animate-spin" /> : <Send size={18} className="ml-0.5" />}
+                            <button onClick={generating ? cancelGeneration : () => handleGenerate()} title={generating ? "Stop generating" : "Generate draft"} className={clsx("w-10 h-10 rounded-full flex items-center justify-center transition-all shadow-md", generating ? "bg-slate-100 text-slate-500 hover:bg-slate-200" : "bg-blue-600 text-white hover:bg-blue-700 hover:scale-105")}>
+                                {generating ? <Square size={14} className="fill-current" /> : <Send size={18} className="ml-0.5" />}
                             </button>
                         </div>
                     </div>